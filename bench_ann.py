@@ -0,0 +1,55 @@
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+from nrekit import ann
+from bench_util import timeit
+
+# Phase 2 retrieval: the n distant ins nearest to the prototype of a support set, by ann.IVFIndex
+# against the brute-force ann.search_exact. With no --repre, the representations are drawn from a
+# mixture of gaussians, one per relation.
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--repre', help='representations of the distant ins (.npy), synthetic if not given', default=None)
+parser.add_argument('--num_ins', type=int, default=200000)
+parser.add_argument('--num_rel', type=int, default=500)
+parser.add_argument('--hidden_size', type=int, default=230)
+parser.add_argument('--n', help='num of candidates retrieved', type=int, default=2000)
+parser.add_argument('--support_size', type=int, default=5)
+parser.add_argument('--nlist', type=int, default=None)
+parser.add_argument('--nprobe', type=int, nargs='+', default=[16, 64, 128, 256])
+parser.add_argument('--num_queries', type=int, default=20)
+args = parser.parse_args()
+
+rng = np.random.RandomState(0)
+if args.repre is not None:
+    repre = np.load(args.repre, mmap_mode='r')
+else:
+    center = rng.randn(args.num_rel, args.hidden_size).astype(np.float32)
+    label = rng.randint(args.num_rel, size=args.num_ins)
+    repre = np.maximum(center[label] + 0.7 * rng.randn(args.num_ins, args.hidden_size).astype(np.float32), 0)
+
+start = time.time()
+index = ann.IVFIndex.build(repre, nlist=args.nlist)
+build = time.time() - start
+file_name = os.path.join(tempfile.mkdtemp(), 'distant.ivf')
+index.save(file_name)
+index = ann.IVFIndex.load(file_name)
+some = np.random.RandomState(1).choice(len(repre), 100, replace=False)
+assert np.array_equal(index.reconstruct(some), np.asarray(repre[some], dtype=np.float32))
+print('{} ins, {} lists: built in {:.1f}s, {:.0f}MB memory-mapped'.format(len(index), len(index.centroids), build, os.path.getsize(file_name) / 2 ** 20))
+
+queries = [np.asarray(repre[np.sort(rng.choice(len(repre), args.support_size, replace=False)) if args.repre is not None else
+    rng.choice(np.flatnonzero(label == rng.randint(args.num_rel)), args.support_size)], dtype=np.float32).mean(0) for _ in range(args.num_queries)]
+exact = [ann.search_exact(repre, query, args.n) for query in queries]
+exact_time = timeit(lambda: [ann.search_exact(repre, query, args.n) for query in queries], 1) / args.num_queries
+for query, (index_exact, dist_exact) in zip(queries[:3], exact[:3]):
+    # brute force over the whole index gives the exact neighbours back
+    found, dist = index.search(query, args.n, nprobe=len(index.centroids))
+    assert np.allclose(dist, dist_exact, rtol=1e-4, atol=1e-2)
+print('brute force: {:.1f}ms per query'.format(exact_time))
+for nprobe in args.nprobe:
+    recall = np.mean([len(np.intersect1d(index.search(query, args.n, nprobe=nprobe)[0], truth)) / float(args.n) for query, (truth, _) in zip(queries, exact)])
+    latency = timeit(lambda: [index.search(query, args.n, nprobe=nprobe) for query in queries], 1) / args.num_queries
+    print('nprobe {:3}: recall@{} {:.3f}, {:.2f}ms per query ({:.0f}x)'.format(nprobe, args.n, recall, latency, exact_time / latency))
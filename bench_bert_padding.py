@@ -0,0 +1,64 @@
+import time
+import argparse
+import numpy as np
+import torch
+from nrekit.data_loader_bert import JSONFileDataLoaderBERT as DataLoader
+from pytorch_pretrained_bert import BertModel, BertConfig
+
+def run_epoch(model, loader, batch_size, num_batches, cuda, train):
+    '''
+    return: (real tokens, padded tokens, seconds) over num_batches batches of next_batch_one_epoch
+    '''
+    loader.current = 0
+    tokens = 0
+    padded_tokens = 0
+    start = time.time()
+    for _ in range(num_batches):
+        batch = loader.next_batch_one_epoch(batch_size)
+        if batch is None:
+            break
+        _, x = model(batch['word'], attention_mask=batch['mask'])
+        if train:
+            x.sum().backward()
+        tokens += int(batch['mask'].sum())
+        padded_tokens += batch['mask'].numel()
+    if cuda:
+        torch.cuda.synchronize()
+    return tokens, padded_tokens, time.time() - start
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--data', default='./data/tacred_train.json')
+parser.add_argument('--vocab', default='./data/bert_vocab.txt')
+parser.add_argument('--pretrain', help='BERT weights; a randomly initialized bert-base is used if not given, the speed does not depend on them', default=None)
+parser.add_argument('--max_length', type=int, default=300)
+parser.add_argument('--batch_size', type=int, default=4)
+parser.add_argument('--num_batches', type=int, default=200)
+parser.add_argument('--train', help='also run the backward pass', action='store_true')
+args = parser.parse_args()
+
+cuda = torch.cuda.is_available()
+if args.pretrain is None:
+    model = BertModel(BertConfig(vocab_size_or_config_json_file=30522))
+else:
+    model = BertModel.from_pretrained(args.pretrain)
+if cuda:
+    model = model.cuda()
+if args.train:
+    model.train()
+else:
+    model.eval()
+torch.set_grad_enabled(args.train)
+
+lengths = DataLoader(args.data, vocab=args.vocab, max_length=args.max_length, cuda=cuda).data_length
+print('{} sentences, length mean {:.1f}, median {:.0f}, max {} (max_length {})'.format(len(lengths), lengths.mean(), np.median(lengths), lengths.max(), args.max_length))
+
+speed = {}
+for dynamic_padding in [False, True]:
+    loader = DataLoader(args.data, vocab=args.vocab, max_length=args.max_length, cuda=cuda, dynamic_padding=dynamic_padding)
+    # warm up (cuda kernels, allocator) before timing
+    run_epoch(model, loader, args.batch_size, 5, cuda, args.train)
+    tokens, padded_tokens, seconds = run_epoch(model, loader, args.batch_size, args.num_batches, cuda, args.train)
+    speed[dynamic_padding] = tokens / seconds
+    print('dynamic_padding={}: {:.0f} tokens/sec, {:.1f}% of the computed positions are padding'.format(
+        dynamic_padding, speed[dynamic_padding], 100 * (1 - float(tokens) / padded_tokens)))
+print('speedup: {:.2f}x'.format(speed[True] / speed[False]))
@@ -0,0 +1,115 @@
+import time
+import argparse
+import numpy as np
+import torch
+from nrekit.cache import EmbeddingCache
+from nrekit.snowball import SiameseBase
+from nrekit.sentence_encoder import CNNSentenceEncoder
+from bench_util import synchronize
+
+# The encoder calls of Snowball._forward_train, with and without the representation cache: each
+# snowball iteration encodes the grown support set, the phase 1 and phase 2 candidates (by the
+# classifier and by the siamese network) and the query set.
+
+def dataset(uid, max_length):
+    # the tokens of an instance only depend on its uid
+    word = np.stack([np.random.RandomState(u).randint(0, 20000, max_length) for u in uid])
+    to_tensor = lambda x: torch.from_numpy(np.asarray(x)).long().to(device)
+    return {'word': to_tensor(word), 'pos1': to_tensor(word % 80), 'pos2': to_tensor(word % 77), 'mask': to_tensor(word % 4), 'id': to_tensor(uid)}
+
+def episode(args, rng):
+    support = rng.choice(args.num_uids, args.support_size, replace=False)
+    query = rng.choice(args.num_uids, args.query_size, replace=False)
+    calls = []
+    for _ in range(args.snowball_max_iter):
+        phase1 = rng.choice(args.num_uids, args.phase1_candidate_num, replace=False)
+        phase2 = rng.choice(args.num_uids, args.phase2_candidate_num, replace=False)
+        calls += [('main', support), ('siamese', support), ('siamese', phase1), ('main', phase2), ('siamese', phase2), ('main', query)]
+        support = np.concatenate([support, phase1[:args.phase1_add_num], phase2[:args.phase2_add_num]])
+    return calls
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--max_length', type=int, default=40)
+parser.add_argument('--num_uids', help='num of distant + query ins', type=int, default=20000)
+parser.add_argument('--support_size', type=int, default=5)
+parser.add_argument('--query_size', type=int, default=500)
+parser.add_argument('--phase1_candidate_num', type=int, default=50)
+parser.add_argument('--phase2_candidate_num', type=int, default=2000)
+parser.add_argument('--phase1_add_num', type=int, default=5)
+parser.add_argument('--phase2_add_num', type=int, default=5)
+parser.add_argument('--snowball_max_iter', type=int, default=5)
+parser.add_argument('--num_episodes', type=int, default=3)
+parser.add_argument('--capacity', help='capacity of the caches kept across episodes', type=int, default=5000)
+args = parser.parse_args()
+
+device = 'cuda' if torch.cuda.is_available() else 'cpu'
+torch.manual_seed(0)
+encoders = {name: CNNSentenceEncoder(np.random.randn(20000, 50).astype(np.float32), args.max_length).to(device).eval() for name in ['main', 'siamese']}
+def encode(name):
+    def fn(dataset):
+        with torch.no_grad():
+            return encoders[name](dataset)
+    return fn
+
+for scope in ['none', 'episode', 'global']:
+    caches = {name: EmbeddingCache(args.capacity if scope == 'global' else None) for name in encoders}
+    rng = np.random.RandomState(0)
+    seconds = 0
+    for _ in range(args.num_episodes):
+        calls = episode(args, rng)
+        if scope == 'episode':
+            for cache in caches.values():
+                cache.clear()
+        for name, uid in calls:
+            data = dataset(uid, args.max_length)
+            start = time.time()
+            if scope == 'none':
+                x = encode(name)(data)
+            else:
+                x = caches[name].encode(data, encode(name))
+            synchronize()
+            seconds += time.time() - start
+            if scope != 'none':
+                assert (x - encode(name)(data)).abs().max() < 1e-4
+                assert max(len(cache) for cache in caches.values()) <= (args.capacity if scope == 'global' else np.inf)
+    counters = ', '.join('{} {} hits / {} misses'.format(name, cache.hits, cache.misses) for name, cache in caches.items())
+    print('cache {}: encoding {:.0f}ms per episode{}'.format(scope, seconds / args.num_episodes * 1e3, ' (' + counters + ')' if scope != 'none' else ''))
+
+# LRU: the least recently used uids are the ones evicted
+cache = EmbeddingCache(4)
+fn = encode('main')
+for uid in [[0, 1, 2, 3], [0], [4, 5]]:
+    cache.encode(dataset(np.array(uid), args.max_length), fn)
+assert (cache.lookup(np.array([0, 1, 2, 3, 4, 5])) >= 0).tolist() == [True, False, False, True, True, True]
+
+# the cache of a model is cleared once the weights of its encoder change: by a training step, or by
+# loading other weights
+siamese = SiameseBase(encoders['main'])
+siamese.cache = EmbeddingCache()
+data = dataset(np.arange(8), args.max_length)
+optimizer = torch.optim.SGD(encoders['main'].parameters(), 0.1)
+for update in [lambda: None, optimizer.step, lambda: encoders['main'].load_state_dict(encoders['siamese'].state_dict())]:
+    encoders['main'](data).pow(2).sum().backward()
+    update()
+    optimizer.zero_grad()
+    with torch.no_grad():
+        assert (siamese.encode(data) - encode('main')(data)).abs().max() < 1e-4
+assert siamese.cache.hits == 0 and siamese.cache.misses == 24
+with torch.no_grad():
+    siamese.encode(data)
+assert siamese.cache.hits == 8 # the same weights
+
+# the train / eval mode of an encoder only matters through its dropout: the CNN encoder is cached in
+# train mode too, an encoder with dropout only in eval mode
+siamese.train()
+with torch.no_grad():
+    siamese.encode(data)
+assert siamese.cache.hits == 16
+dropped = SiameseBase(torch.nn.Sequential(encoders['main'], torch.nn.Dropout(0.5))).train()
+dropped.cache = EmbeddingCache()
+for train in [True, False]:
+    dropped.train(train)
+    with torch.no_grad():
+        dropped.encode(data)
+        dropped.encode(data)
+assert dropped.cache.hits == 8 and dropped.cache.misses == 8
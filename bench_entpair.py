@@ -0,0 +1,48 @@
+import random
+import argparse
+import numpy as np
+import torch
+from nrekit.data_loader import JSONFileDataLoader as DataLoader
+from bench_util import timeit
+
+def per_pair(loader, entpairs):
+    return [loader.get_same_entpair_ins(entpair) for entpair in entpairs]
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--distant', help='split the snowball expands from', default='./data/distant.json')
+parser.add_argument('--word_vec', default='./data/glove.6B.50d.json')
+parser.add_argument('--max_length', type=int, default=40)
+parser.add_argument('--num_entpairs', help='num of support entity pairs looked up at a time', type=int, nargs='+', default=[5, 10, 50])
+parser.add_argument('--repeat', type=int, default=50)
+parser.add_argument('--mmap', action='store_true')
+args = parser.parse_args()
+
+random.seed(0)
+np.random.seed(0)
+loader = DataLoader(args.distant, args.word_vec, max_length=args.max_length, cuda=torch.cuda.is_available(), mmap=args.mmap, distant=True)
+for num_entpairs in args.num_entpairs:
+    entpairs = list(loader.data_entpair[np.random.randint(loader.instance_tot, size=num_entpairs)]) + ['no head#no tail']
+
+    # the batch holds the instances of per-pair lookups one after another
+    batch = loader.get_same_entpair_ins_batch(entpairs)
+    for i, raw in enumerate(per_pair(loader, entpairs)):
+        begin, end = batch['offset'][i], batch['offset'][i + 1]
+        if raw is None:
+            assert begin == end
+            continue
+        for key in ['word', 'pos1', 'pos2', 'mask', 'id']:
+            assert (batch[key][begin:end].cpu() == raw[key].cpu()).all(), key
+        assert batch['entpair'][begin:end] == raw['entpair']
+    exclude_id = batch['id'][::2].cpu().numpy()
+    excluded = loader.get_same_entpair_ins_batch(entpairs, exclude_id=exclude_id)
+    assert (excluded['id'].cpu() == batch['id'][1::2].cpu()).all()
+    segment = np.repeat(np.arange(len(entpairs)), np.diff(batch['offset']))
+    assert (np.diff(excluded['offset']) == np.bincount(segment[1::2], minlength=len(entpairs))).all()
+    # every instance already seen: an empty batch
+    empty = loader.get_same_entpair_ins_batch(entpairs, exclude_id=batch['id'].cpu().numpy())
+    assert empty['word'].shape == (0, args.max_length) and empty['id'].shape == (0,) and (empty['offset'] == 0).all()
+
+    legacy = timeit(lambda: per_pair(loader, entpairs), args.repeat)
+    batched = timeit(lambda: loader.get_same_entpair_ins_batch(entpairs), args.repeat)
+    print('{} entity pairs ({} instances): get_same_entpair_ins per pair {:.2f}ms, get_same_entpair_ins_batch {:.2f}ms ({:.1f}x)'.format(
+        num_entpairs, len(batch['id']), legacy, batched, legacy / batched))
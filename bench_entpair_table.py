@@ -0,0 +1,87 @@
+import os
+import time
+import random
+import argparse
+import tempfile
+import numpy as np
+import torch
+from models.snowball import Siamese
+from nrekit.data_loader import JSONFileDataLoader as DataLoader
+from nrekit.sentence_encoder import CNNSentenceEncoder
+from nrekit import entpair_table
+from nrekit.cache import EmbeddingCache
+from bench_util import synchronize
+
+# Phase 1 of the snowball: the siamese scores of the distant ins sharing the entity pairs of the
+# support set, encoded at every iteration against looked up in an entpair_table.EntpairTable.
+
+def time_phase1(phase1, supports, table):
+    # the support ins encoded (cached) beforehand, as by the previous snowball iterations
+    seconds = 0
+    for support in supports:
+        siamese.cache.clear()
+        siamese.encode(support)
+        start = time.time()
+        phase1(siamese, loader, support, table, args.phase1_add_num)
+        synchronize()
+        seconds += time.time() - start
+    return seconds / len(supports) * 1e3
+
+def phase1(siamese, loader, support, table, k):
+    raw_all = loader.get_same_entpair_ins_batch(list(dict.fromkeys(support['entpair'])), table=table)
+    picked = []
+    for i in range(len(raw_all['offset']) - 1):
+        begin, end = raw_all['offset'][i], raw_all['offset'][i + 1]
+        if begin < end:
+            distant = {key: raw_all[key][begin:end] for key in raw_all if key != 'offset'}
+            picked.append(begin + siamese.forward_infer_topk(support, distant, k)[1])
+    return raw_all['id'][torch.cat(picked)] if picked else None
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--distant', default='./data/distant.json')
+parser.add_argument('--word_vec', default='./data/glove.6B.50d.json')
+parser.add_argument('--max_length', type=int, default=40)
+parser.add_argument('--support_size', type=int, default=20)
+parser.add_argument('--phase1_add_num', type=int, default=5)
+parser.add_argument('--num_runs', type=int, default=20)
+args = parser.parse_args()
+
+random.seed(0)
+np.random.seed(0)
+torch.manual_seed(0)
+loader = DataLoader(args.distant, args.word_vec, max_length=args.max_length, cuda=torch.cuda.is_available(), mmap=True, distant=True)
+encoder = CNNSentenceEncoder(loader.word_vec_mat, args.max_length)
+siamese = Siamese(encoder).eval()
+siamese.cache = EmbeddingCache()
+if torch.cuda.is_available():
+    siamese.cuda()
+
+# offline: the siamese representations of all the distant ins
+start = time.time()
+repre = []
+with torch.no_grad():
+    for begin in range(0, loader.instance_tot, 10000):
+        index = np.arange(begin, min(begin + 10000, loader.instance_tot))
+        repre.append(siamese._encode(loader.get_ins(index)).cpu().numpy())
+repre = np.concatenate(repre, 0)
+table = entpair_table.EntpairTable.build(loader.data_entpair, loader.uid, repre, fc=siamese.fc)
+file_name = os.path.join(tempfile.mkdtemp(), 'distant.entpair')
+table.save(file_name)
+table = entpair_table.EntpairTable.load(file_name)
+print('table of {} ins and {} entity pairs: built in {:.1f}s, {:.0f}MB memory-mapped'.format(
+    len(table), len(table.offset) - 1, time.time() - start, os.path.getsize(file_name) / 2 ** 20))
+
+# support sets of ins with large entity pairs
+size = np.diff(loader.data_entpair.offset)
+supports = [loader.get_ins(np.random.choice(np.flatnonzero(size[loader.data_entpair.id] > 1), args.support_size, replace=False)) for _ in range(args.num_runs)]
+with torch.no_grad():
+    for support in supports:
+        encoded = phase1(siamese, loader, support, None, args.phase1_add_num)
+        looked_up = phase1(siamese, loader, support, table, args.phase1_add_num)
+        assert (encoded == looked_up).all()
+    encode_time = time_phase1(phase1, supports, None)
+    table_time = time_phase1(phase1, supports, table)
+print('phase 1 with {} support ins: encoding the distant ins {:.1f}ms, entity pair table {:.1f}ms ({:.1f}x)'.format(
+    args.support_size, encode_time, table_time, encode_time / table_time))
+cohesion = table.cohesion[~np.isnan(table.cohesion)]
+print('cohesion of the {} entity pairs of several ins: mean {:.3f}, min {:.3f}, max {:.3f}'.format(len(cohesion), cohesion.mean(), cohesion.min(), cohesion.max()))
@@ -0,0 +1,67 @@
+import time
+import argparse
+import multiprocessing
+import numpy as np
+
+def memory_usage():
+    '''
+    return: (RSS, private anonymous RSS, PSS) of the current process in MB.
+            PSS splits each shared page among the processes mapping it.
+    '''
+    usage = {}
+    for file_name in ['/proc/self/status', '/proc/self/smaps_rollup']:
+        try:
+            for line in open(file_name):
+                key, value = line.split(':', 1)
+                if value.strip().endswith('kB'):
+                    usage[key] = int(value.split()[0]) / 1024
+        except IOError:
+            pass
+    return usage.get('VmRSS', 0), usage.get('RssAnon', 0), usage.get('Pss', 0)
+
+def run(args, mmap, barrier, results):
+    from nrekit.data_loader import JSONFileDataLoader as DataLoader
+    start = time.time()
+    loaders = []
+    for file_name in args.data:
+        loaders.append(DataLoader(file_name, args.word_vec, max_length=args.max_length, mmap=mmap, cuda=False,
+            distant='distant' in file_name))
+    startup_time = time.time() - start
+    # gather batches over the whole split, as an epoch of training would
+    for loader in loaders:
+        for _ in range(args.num_batches):
+            loader.next_batch(args.batch_size)
+    # measure while every process is still alive, so that shared pages are split among all of them
+    barrier.wait()
+    results.put((startup_time,) + memory_usage())
+    barrier.wait()
+
+if __name__ == '__main__':
+    # the processes are spawned, they must not re-run this part
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--data', nargs='+', default=['./data/train_train.json', './data/train_val.json', './data/val.json', './data/test.json', './data/distant.json'])
+    parser.add_argument('--word_vec', default='./data/glove.6B.50d.json')
+    parser.add_argument('--max_length', type=int, default=40)
+    parser.add_argument('--num_procs', help='number of concurrent processes, as in a grid search', type=int, default=4)
+    parser.add_argument('--num_batches', type=int, default=100)
+    parser.add_argument('--batch_size', type=int, default=50)
+    args = parser.parse_args()
+
+    # build the _processed_data cache once, so that every run below only loads it
+    from nrekit.data_loader import JSONFileDataLoader as DataLoader
+    for file_name in args.data:
+        DataLoader(file_name, args.word_vec, max_length=args.max_length, cuda=False, distant='distant' in file_name)
+
+    context = multiprocessing.get_context('spawn')
+    for mmap in [False, True]:
+        barrier = context.Barrier(args.num_procs)
+        results = context.Queue()
+        procs = [context.Process(target=run, args=(args, mmap, barrier, results)) for _ in range(args.num_procs)]
+        for p in procs:
+            p.start()
+        stats = np.array([results.get() for _ in procs])
+        for p in procs:
+            p.join()
+        startup_time, rss, rss_anon, pss = stats.mean(0)
+        print('mmap={}: startup {:.2f}s, per process RSS {:.0f}MB (private {:.0f}MB, PSS {:.0f}MB), {} processes total PSS {:.0f}MB'.format(
+            mmap, startup_time, rss, rss_anon, pss, args.num_procs, stats[:, 3].sum()))
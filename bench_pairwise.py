@@ -0,0 +1,51 @@
+import argparse
+import torch
+from models import snowball
+from bench_util import timeit, Lookup, broadcast_logits
+
+# Siamese.score against the former broadcast of (x - y)^2 or x * y into a (support, candidates,
+# hidden_size) tensor, and the mean scores against large support sets streamed a chunk of support ins
+# at a time. Their results are checked by check_pairwise.py.
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--hidden_size', type=int, default=768)
+parser.add_argument('--support_sizes', type=int, nargs='+', default=[5, 50, 200])
+parser.add_argument('--candidate_num', type=int, default=2000)
+parser.add_argument('--tile_size', type=int, default=1000)
+parser.add_argument('--support_chunk_size', type=int, default=64)
+parser.add_argument('--large_support_sizes', help='support sizes scored a chunk at a time only', type=int, nargs='+', default=[2000, 10000])
+parser.add_argument('--repeat', type=int, default=3)
+args = parser.parse_args()
+
+device = 'cuda' if torch.cuda.is_available() else 'cpu'
+torch.manual_seed(0)
+for support_size in args.support_sizes:
+    repre = torch.relu(torch.randn(support_size + args.candidate_num, args.hidden_size, device=device))
+    support = {'word': repre[:support_size], 'id': torch.arange(support_size, device=device)}
+    candidate = {'word': repre[support_size:], 'id': torch.arange(support_size, support_size + args.candidate_num, device=device)}
+    for euc in [True, False]:
+        siamese = snowball.Siamese(Lookup(repre), hidden_size=args.hidden_size, euc=euc).to(device).eval()
+        with torch.no_grad():
+            legacy = timeit(lambda: torch.sigmoid(broadcast_logits(repre[support['id']], repre[candidate['id']], siamese.fc, euc)).mean(0), args.repeat)
+            siamese.tile_size = args.tile_size
+            fast = timeit(lambda: siamese.score(support, candidate), args.repeat)
+        print('{} support ins x {} candidates ({}): broadcast {:.1f}ms with a {:.0f}MB tensor, Siamese.score {:.1f}ms with {:.2f}MB tiles ({:.1f}x)'.format(
+            support_size, args.candidate_num, 'euclidean' if euc else 'dot product', legacy, support_size * args.candidate_num * args.hidden_size * 4 / 2 ** 20,
+            fast, support_size * min(siamese.tile_size, args.candidate_num) * 4 / 2 ** 20, legacy / fast))
+
+# large support sets: (support, candidates) logits vs a chunk of them
+for support_size in args.large_support_sizes:
+    repre = torch.relu(torch.randn(support_size + args.candidate_num, args.hidden_size, device=device))
+    support = {'word': repre[:support_size], 'id': torch.arange(support_size, device=device)}
+    candidate = {'word': repre[support_size:], 'id': torch.arange(support_size, support_size + args.candidate_num, device=device)}
+    siamese = snowball.Siamese(Lookup(repre), hidden_size=args.hidden_size).to(device).eval()
+    with torch.no_grad():
+        siamese.tile_size = 0
+        siamese.support_chunk_size = 0
+        full = timeit(lambda: siamese.score(support, candidate), args.repeat)
+        siamese.tile_size = args.tile_size
+        siamese.support_chunk_size = args.support_chunk_size
+        streamed = timeit(lambda: siamese.score(support, candidate), args.repeat)
+    print('{} support ins x {} candidates: all the pairs at once {:.1f}ms with {:.0f}MB of logits, {} support ins at a time {:.1f}ms with {:.2f}MB'.format(
+        support_size, args.candidate_num, full, support_size * args.candidate_num * 4 / 2 ** 20, siamese.support_chunk_size, streamed,
+        siamese.support_chunk_size * min(siamese.tile_size, args.candidate_num) * 4 / 2 ** 20))
@@ -0,0 +1,58 @@
+import time
+import random
+import argparse
+import numpy as np
+import torch
+from nrekit.data_loader import JSONFileDataLoader as DataLoader
+from nrekit.sentence_encoder import CNNSentenceEncoder
+from nrekit.prefetch import Prefetcher
+
+def run(loader, model, batch_size, num_batches, depth, cuda):
+    '''
+    return: (batches/sec of a training-like loop, uids of the first batches)
+    '''
+    random.seed(0)
+    loader.index = list(range(loader.instance_tot))
+    loader.current = loader.instance_tot
+    next_data = lambda: loader.next_batch(batch_size)
+    if depth:
+        next_data = Prefetcher(next_data, depth=depth, cuda=cuda)
+    ids = []
+    start = time.time()
+    for it in range(num_batches):
+        batch = next_data()
+        model(batch).sum().backward()
+        if it < 10:
+            ids.append(batch['id'].cpu().numpy())
+    if cuda:
+        torch.cuda.synchronize()
+    seconds = time.time() - start
+    if depth:
+        next_data.close()
+    return num_batches / seconds, np.concatenate(ids)
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--data', default='./data/train_train.json')
+parser.add_argument('--word_vec', default='./data/glove.6B.50d.json')
+parser.add_argument('--max_length', type=int, default=40)
+parser.add_argument('--batch_size', type=int, default=200)
+parser.add_argument('--num_batches', type=int, default=500)
+parser.add_argument('--depth', type=int, nargs='+', default=[1, 2, 4])
+parser.add_argument('--mmap', action='store_true')
+args = parser.parse_args()
+
+cuda = torch.cuda.is_available()
+loader = DataLoader(args.data, args.word_vec, max_length=args.max_length, cuda=cuda, mmap=args.mmap)
+model = CNNSentenceEncoder(loader.word_vec_mat, args.max_length)
+if cuda:
+    model = model.cuda()
+
+# warm up (cuda kernels, allocator, page cache)
+run(loader, model, args.batch_size, 20, 0, cuda)
+speed, ids = run(loader, model, args.batch_size, args.num_batches, 0, cuda)
+print('{}: no prefetch: {:.1f} batches/sec'.format('cuda' if cuda else 'cpu', speed))
+for depth in args.depth:
+    prefetch_speed, prefetch_ids = run(loader, model, args.batch_size, args.num_batches, depth, cuda)
+    # the batches come in the same order as without prefetching
+    assert (prefetch_ids == ids).all()
+    print('prefetch depth {}: {:.1f} batches/sec ({:.2f}x)'.format(depth, prefetch_speed, prefetch_speed / speed))
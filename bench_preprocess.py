@@ -0,0 +1,243 @@
+import sys
+import io
+import json
+import os
+import time
+import random
+import argparse
+import numpy as np
+from nrekit import preprocess
+
+def legacy_preprocess(ori_data, ori_word_vec, max_length, case_sensitive=False, distant=False):
+    '''
+    the per-token loop formerly used by JSONFileDataLoader.__init__, kept as reference
+    '''
+    if not case_sensitive:
+        for relation in ori_data:
+            for ins in ori_data[relation]:
+                for i in range(len(ins['tokens'])):
+                    ins['tokens'][i] = ins['tokens'][i].lower()
+    word2id = {}
+    word_vec_tot = len(ori_word_vec)
+    UNK = word_vec_tot
+    BLANK = word_vec_tot + 1
+    word_vec_dim = len(ori_word_vec[0]['vec'])
+    word_vec_mat = np.zeros((word_vec_tot, word_vec_dim), dtype=np.float32)
+    for cur_id, word in enumerate(ori_word_vec):
+        w = word['word']
+        if not case_sensitive:
+            w = w.lower()
+        word2id[w] = cur_id
+        word_vec_mat[cur_id, :] = word['vec']
+        word_vec_mat[cur_id] = word_vec_mat[cur_id] / np.sqrt(np.sum(word_vec_mat[cur_id] ** 2))
+    word2id['UNK'] = UNK
+    word2id['BLANK'] = BLANK
+
+    instance_tot = 0
+    for relation in ori_data:
+        instance_tot += len(ori_data[relation])
+    data_word = np.zeros((instance_tot, max_length), dtype=np.int32)
+    data_pos1 = np.zeros((instance_tot, max_length), dtype=np.int32)
+    data_pos2 = np.zeros((instance_tot, max_length), dtype=np.int32)
+    data_mask = np.zeros((instance_tot, max_length), dtype=np.int32)
+    data_length = np.zeros((instance_tot), dtype=np.int32)
+    data_label = np.zeros((instance_tot), dtype=np.int32)
+    data_entpair = []
+    rel2scope = {}
+    entpair2scope = {}
+    rel2id = {}
+    rel_tot = 0
+    i = 0
+    for relation in ori_data:
+        rel2scope[relation] = [i, i]
+        if relation not in rel2id:
+            rel2id[relation] = rel_tot
+            rel_tot += 1
+        for ins in ori_data[relation]:
+            head, tail, pos1, pos2 = preprocess.parse_instance(ins, distant)
+            words = ins['tokens']
+            cur_ref_data_word = data_word[i]
+            entpair = head + '#' + tail
+            data_entpair.append(entpair)
+            for j, word in enumerate(words):
+                if j < max_length:
+                    if word in word2id:
+                        cur_ref_data_word[j] = word2id[word]
+                    else:
+                        cur_ref_data_word[j] = UNK
+            for j in range(j + 1, max_length):
+                cur_ref_data_word[j] = BLANK
+            data_length[i] = len(words)
+            data_label[i] = rel2id[relation]
+            if len(words) > max_length:
+                data_length[i] = max_length
+            if pos1 >= max_length:
+                pos1 = max_length - 1
+            if pos2 >= max_length:
+                pos2 = max_length - 1
+            pos_min = min(pos1, pos2)
+            pos_max = max(pos1, pos2)
+            for j in range(max_length):
+                data_pos1[i][j] = j - pos1 + max_length
+                data_pos2[i][j] = j - pos2 + max_length
+                if j >= data_length[i]:
+                    data_mask[i][j] = 0
+                elif j <= pos_min:
+                    data_mask[i][j] = 1
+                elif j <= pos_max:
+                    data_mask[i][j] = 2
+                else:
+                    data_mask[i][j] = 3
+            if not entpair in entpair2scope:
+                entpair2scope[entpair] = [i]
+            else:
+                entpair2scope[entpair].append(i)
+            i += 1
+        rel2scope[relation][1] = i
+    return word2id, word_vec_mat, {'data_word': data_word, 'data_pos1': data_pos1, 'data_pos2': data_pos2, 'data_mask': data_mask,
+            'data_length': data_length, 'data_label': data_label, 'data_entpair': np.array(data_entpair),
+            'rel2scope': rel2scope, 'rel2id': rel2id, 'entpair2scope': entpair2scope}
+
+def synthetic_corpus(num_ins, num_rel=100, vocab_size=20000, word_vec_dim=50, num_entpair=50000, distant=False):
+    words = ['w{}'.format(i) for i in range(vocab_size)]
+    ori_word_vec = [{'word': w.upper() if i % 7 == 0 else w, 'vec': list(np.random.randn(word_vec_dim))} for i, w in enumerate(words)]
+    ori_data = {}
+    for i in range(num_ins):
+        # a few sentences are empty (but not the first, which the legacy loop cannot handle)
+        length = random.randint(5, 80) if i == 0 or random.random() >= 0.001 else 0
+        # a few words fall outside the vocabulary
+        tokens = [random.choice(words) if random.random() < 0.95 else 'oov' for _ in range(length)]
+        tokens = [w.capitalize() if random.random() < 0.1 else w for w in tokens]
+        pos1, pos2 = random.sample(range(length), 2) if length else (0, 0)
+        entpair = random.randint(0, num_entpair)
+        head = 'head{}'.format(entpair)
+        tail = 'tail{}'.format(entpair)
+        if distant:
+            ins = {'h': {'name': head, 'pos': [[pos1]]}, 't': {'name': tail, 'pos': [[pos2]]}, 'tokens': tokens}
+        else:
+            ins = {'h': [head, 'Q0', [[pos1]]], 't': [tail, 'Q1', [[pos2]]], 'tokens': tokens}
+        ori_data.setdefault('P{}'.format(i % num_rel), []).append(ins)
+    return ori_data, ori_word_vec
+
+def npy_bytes(array):
+    f = io.BytesIO()
+    np.save(f, array)
+    return f.getvalue()
+
+def assert_same(processed, other):
+    for key in processed:
+        if key == 'data_entpair':
+            columns, other_columns = processed[key].columns(), other[key].columns()
+            for name in columns:
+                assert npy_bytes(columns[name]) == npy_bytes(other_columns[name]), name
+        elif key.startswith('data_'):
+            assert npy_bytes(processed[key]) == npy_bytes(other[key]), key
+        else:
+            assert json.dumps(processed[key]) == json.dumps(other[key]), key
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--num_ins', help='number of synthetic sentences', type=int, default=1000000)
+parser.add_argument('--max_length', type=int, default=40)
+parser.add_argument('--distant', action='store_true')
+parser.add_argument('--num_workers', help='also time the sharded pre-processing with this many processes', type=int, default=0)
+args = parser.parse_args()
+
+random.seed(0)
+np.random.seed(0)
+print('Generating {} synthetic sentences...'.format(args.num_ins))
+ori_data, ori_word_vec = synthetic_corpus(args.num_ins, distant=args.distant)
+
+start = time.time()
+word2id, word_vec_mat = preprocess.build_word_vec(ori_word_vec)
+processed = preprocess.preprocess(ori_data, word2id, args.max_length, distant=args.distant)
+vectorized_time = time.time() - start
+print('vectorized: {:.2f}s'.format(vectorized_time))
+
+start = time.time()
+legacy_word2id, legacy_word_vec_mat, legacy = legacy_preprocess(ori_data, ori_word_vec, args.max_length, distant=args.distant)
+legacy_time = time.time() - start
+print('legacy loop: {:.2f}s'.format(legacy_time))
+print('speedup: {:.1f}x'.format(legacy_time / vectorized_time))
+
+assert npy_bytes(word_vec_mat) == npy_bytes(legacy_word_vec_mat)
+assert json.dumps(word2id) == json.dumps(legacy_word2id)
+for key in legacy:
+    if key == 'data_entpair':
+        assert npy_bytes(processed[key][np.arange(len(legacy[key]))]) == npy_bytes(legacy[key]), key
+    elif key == 'entpair2scope':
+        # the dict is replaced by the array index, which must give the same scopes
+        entpair_index = processed['data_entpair']
+        assert len(entpair_index.key) == len(legacy[key])
+        assert json.dumps({entpair: entpair_index.scope(entpair).tolist() for entpair in legacy[key]}) == json.dumps(legacy[key]), key
+    elif key.startswith('data_'):
+        assert npy_bytes(processed[key]) == npy_bytes(legacy[key]), key
+    else:
+        assert json.dumps(processed[key]) == json.dumps(legacy[key]), key
+print('Outputs are byte-identical.')
+
+entpairs = random.sample(list(legacy['entpair2scope']), min(10000, len(legacy['entpair2scope'])))
+start = time.time()
+json.loads(json.dumps(legacy['entpair2scope']))
+print('entpair2scope json round trip: {:.2f}s'.format(time.time() - start))
+start = time.time()
+for entpair in entpairs:
+    processed['data_entpair'].scope(entpair)
+print('entity pair index: {:.1f}us per lookup, {:.1f}MB vs {:.1f}MB of data_entpair and json entpair2scope'.format(
+    (time.time() - start) / len(entpairs) * 1e6, sum(column.nbytes for column in processed['data_entpair'].columns().values()) / 1e6,
+    (legacy['data_entpair'].nbytes + len(json.dumps(legacy['entpair2scope']))) / 1e6))
+
+if not os.path.isdir('_processed_data'):
+    os.mkdir('_processed_data')
+# the loaders stream the json files instead of loading them whole
+data_file = os.path.join('_processed_data', 'bench_data.json')
+word_vec_file = os.path.join('_processed_data', 'bench_word_vec.json')
+json.dump(ori_data, open(data_file, 'w'))
+json.dump(ori_word_vec, open(word_vec_file, 'w'))
+start = time.time()
+streamed_word2id, streamed_word_vec_mat = preprocess.build_word_vec(preprocess.iter_json_list(word_vec_file))
+streamed = preprocess.preprocess(preprocess.iter_json_data(data_file), streamed_word2id, args.max_length, distant=args.distant)
+print('streamed: {:.2f}s'.format(time.time() - start))
+assert npy_bytes(word_vec_mat) == npy_bytes(streamed_word_vec_mat)
+assert json.dumps(word2id) == json.dumps(streamed_word2id)
+assert_same(processed, streamed)
+print('Streamed outputs are byte-identical.')
+
+if args.num_workers > 1:
+    start = time.time()
+    main_start = time.process_time()
+    sharded = preprocess.preprocess(data_file, word2id, args.max_length, distant=args.distant,
+            num_workers=args.num_workers, shard_prefix=os.path.join('_processed_data', 'bench'))
+    sharded_time = time.time() - start
+    # the workers parse their parts of the file, what is left to this process doesn't scale with them
+    print('sharded ({} workers): {:.2f}s, speedup over vectorized: {:.1f}x, {:.2f}s in the main process'.format(
+        args.num_workers, sharded_time, vectorized_time / sharded_time, time.process_time() - main_start))
+    assert_same(processed, sharded)
+    print('Sharded outputs are byte-identical.')
+
+    # the workers find their instances from the brackets outside of strings, whatever cuts the blocks
+    tricky = {'r"{[': [{'tokens': ['a\\', '"]}', '\\"', '[{'], 'h': ['h\\', 'Q1', [[0]]], 't': ['}"', 'Q2', [[1]]]}] * 3, 'r2': [], '\u00e9': [{'tokens': ['\u00e9t\u00e9', 'w1'], 'h': ['\u00e9', 'Q3', [[0]]], 't': ['w', 'Q4', [[1]]]}] * 5}
+    tricky_file = os.path.join('_processed_data', 'bench_tricky.json')
+    with open(tricky_file, 'w') as f:
+        json.dump(tricky, f, indent=1)
+    for block_size in [1, 7, 1 << 22]:
+        scanned = preprocess.scan_json_data(tricky_file, block_size)
+        assert [(relation, len(starts)) for relation, starts, _ in scanned] == [(relation, len(tricky[relation])) for relation in tricky]
+    expected = preprocess.preprocess(tricky, word2id, args.max_length)
+    assert_same(expected, preprocess.preprocess(tricky_file, word2id, args.max_length, num_workers=args.num_workers,
+            shard_prefix=os.path.join('_processed_data', 'bench'), chunk_size=2))
+
+    # a part failing leaves no shard behind
+    tricky['r2'] = [{'h': ['h', 'Q1', [[0]]], 't': ['t', 'Q2', [[1]]]}]
+    with open(tricky_file, 'w') as f:
+        json.dump(tricky, f)
+    try:
+        preprocess.preprocess(tricky_file, word2id, args.max_length, num_workers=args.num_workers,
+                shard_prefix=os.path.join('_processed_data', 'bench'), chunk_size=2)
+        assert False
+    except KeyError:
+        pass
+    assert not any('.shard' in name for name in os.listdir('_processed_data'))
+    os.remove(tricky_file)
+    print('Sharded parts of tricky strings match, and a failing part leaves no shard.')
+os.remove(data_file)
+os.remove(word_vec_file)
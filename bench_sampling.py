@@ -0,0 +1,52 @@
+import argparse
+import collections
+import numpy as np
+from nrekit import sampling
+from bench_util import timeit
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--sizes', help='sizes of the relation scopes', type=int, nargs='+', default=[700, 10000, 100000, 1000000])
+parser.add_argument('--k', help='num of instances drawn', type=int, nargs='+', default=[5, 20, 100])
+parser.add_argument('--repeat', type=int, default=200)
+args = parser.parse_args()
+
+np.random.seed(0)
+for size in args.sizes:
+    start = 12345
+    for k in args.k:
+        if k > size:
+            continue
+        legacy = timeit(lambda: np.random.choice(list(range(start, start + size)), k, False), args.repeat) * 1e3
+        floyd = timeit(lambda: sampling.sample_scope(start, start + size, k), args.repeat) * 1e3
+        print('scope {:8d}, k {:4d}: np.random.choice(list(range)) {:10.1f}us, sample_scope {:6.1f}us ({:.0f}x)'.format(size, k, legacy, floyd, legacy / floyd))
+
+# every subset of 3 out of 13 (and every index at the first position) should come out equally often
+subsets = collections.Counter()
+positions = collections.Counter()
+for _ in range(286 * 200):
+    indices = sampling.sample_scope(100, 113, 3)
+    assert len(set(indices)) == 3 and indices.min() >= 100 and indices.max() < 113
+    subsets[tuple(sorted(indices))] += 1
+    positions[indices[0]] += 1
+print('subsets of 3 out of 13: {} seen, counts in [{}, {}] (200 expected)'.format(len(subsets), min(subsets.values()), max(subsets.values())))
+print('first index: counts in [{}, {}] ({} expected)'.format(min(positions.values()), max(positions.values()), 286 * 200 // 13))
+
+# sample_scopes draws the eval episodes of episode.draw_eval, with k close to the relation size
+for num_scopes, size, k in [(640, 700, 20), (640, 700, 605), (640, 100000, 20)]:
+    start = np.arange(num_scopes) * size
+    scope_size = np.full(num_scopes, size)
+    legacy = timeit(lambda: start[:, None] + np.stack([np.random.permutation(size)[:k] for _ in start]), 10) * 1e3
+    batched = timeit(lambda: sampling.sample_scopes(start, scope_size, k), 10) * 1e3
+    print('{} scopes {:8d}, k {:4d}: permutation per scope {:10.1f}us, sample_scopes {:8.1f}us ({:.1f}x)'.format(
+        num_scopes, size, k, legacy, batched, legacy / batched))
+
+# the permuted (3 out of 8) and the Floyd (3 out of 13) rows of one call: every subset equally often
+size = np.tile([13, 8], 20000)
+indices = sampling.sample_scopes(np.full(len(size), 100), size, 3)
+for scope_size in [13, 8]:
+    subsets = collections.Counter()
+    for row in indices[size == scope_size]:
+        assert len(set(row)) == 3 and row.min() >= 100 and row.max() < 100 + scope_size
+        subsets[tuple(sorted(row))] += 1
+    print('sample_scopes, subsets of 3 out of {}: {} seen, counts in [{}, {}] ({} expected)'.format(
+        scope_size, len(subsets), min(subsets.values()), max(subsets.values()), 20000 // len(subsets)))
@@ -0,0 +1,101 @@
+import time
+import random
+import argparse
+import numpy as np
+import torch
+from nrekit.data_loader import JSONFileDataLoader as DataLoader
+from nrekit import sampling
+from nrekit import uidset
+
+# The bookkeeping of Snowball._forward_train, with the siamese / classifier scores replaced by a
+# fixed score of each uid: the tensor-keyed dict of exist_id against uidset.UidSet.
+
+def score(uid):
+    return (uid * 2654435761 % 1000) / 1000.
+
+def snowball(loader, support, rel_scope, args, seen_set):
+    support_id = torch.from_numpy(loader.uid[support]).long()
+    support_entpair = list(loader.data_entpair[support])
+    exist_id = uidset.UidSet(int(loader.uid.max()) + 1) if seen_set else {}
+    seconds = 0
+    for _ in range(args.snowball_max_iter):
+        # phase 1: ins with the same entity pairs
+        start = time.time()
+        entpairs = list(dict.fromkeys(support_entpair))
+        if seen_set:
+            exist_id.add(support_id)
+            raw_all = loader.get_same_entpair_ins_batch(entpairs, exclude_id=exist_id)
+        else:
+            for i in range(len(support_id)):
+                exist_id[support_id[i]] = 1
+            raw_all = loader.get_same_entpair_ins_batch(entpairs)
+            keep = [i for i in range(raw_all['id'].size(0)) if raw_all['id'][i] not in exist_id]
+            segment = np.repeat(np.arange(len(entpairs)), np.diff(raw_all['offset']))[keep]
+            raw_all['offset'] = np.concatenate([[0], np.cumsum(np.bincount(segment, minlength=len(entpairs)))])
+            raw_all['id'] = raw_all['id'][keep]
+            raw_all['entpair'] = [raw_all['entpair'][i] for i in keep]
+        seconds += time.time() - start
+        added = []
+        for k in range(len(entpairs)):
+            begin, end = raw_all['offset'][k], raw_all['offset'][k + 1]
+            order = np.argsort([-score(int(uid)) for uid in raw_all['id'][begin:end]])
+            added += [begin + i for i in order[:args.phase1_add_num]]
+        start = time.time()
+        for i in added:
+            if seen_set:
+                exist_id.add(raw_all['id'][i])
+            else:
+                exist_id[raw_all['id'][i]] = 1
+        seconds += time.time() - start
+        support_id = torch.cat([support_id, raw_all['id'][added]])
+        support_entpair += [raw_all['entpair'][i] for i in added]
+
+        # phase 2: random candidates (all different), with as many of the positive relation as of each other one
+        index = np.unique(np.concatenate([sampling.sample_scope(rel_scope[0], rel_scope[1], min(args.candidate_num_ins, rel_scope[1] - rel_scope[0])),
+            np.random.randint(loader.instance_tot, size=args.candidate_num_ins * (args.candidate_num_class - 1))]))
+        candidate_id = torch.from_numpy(loader.uid[index]).long()
+        candidate_entpair = loader.data_entpair[index]
+        order = np.argsort([-score(int(uid)) for uid in candidate_id])[:args.phase2_add_num]
+        start = time.time()
+        added = []
+        if seen_set:
+            seen = exist_id.contains(candidate_id)
+        for iid in order:
+            if not (seen[iid] if seen_set else candidate_id[iid] in exist_id):
+                if seen_set:
+                    exist_id.add(candidate_id[iid])
+                else:
+                    exist_id[candidate_id[iid]] = 1
+                added.append(iid)
+        seconds += time.time() - start
+        support_id = torch.cat([support_id, candidate_id[added]])
+        support_entpair += list(candidate_entpair[added])
+    return support_id.numpy(), seconds
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--distant', default='./data/distant.json')
+parser.add_argument('--word_vec', default='./data/glove.6B.50d.json')
+parser.add_argument('--max_length', type=int, default=40)
+parser.add_argument('--support_size', type=int, default=5)
+parser.add_argument('--snowball_max_iter', type=int, default=5)
+parser.add_argument('--phase1_add_num', type=int, default=10)
+parser.add_argument('--phase2_add_num', type=int, default=200)
+parser.add_argument('--candidate_num_class', type=int, default=20)
+parser.add_argument('--candidate_num_ins', type=int, default=100)
+parser.add_argument('--num_runs', type=int, default=20)
+args = parser.parse_args()
+
+loader = DataLoader(args.distant, args.word_vec, max_length=args.max_length, cuda=False, mmap=True, distant=True)
+for seen_set in [False, True]:
+    random.seed(0)
+    np.random.seed(0)
+    sizes, duplicates, seconds = [], [], 0
+    for run in range(args.num_runs):
+        rel_scope = loader.rel_scope[np.random.randint(len(loader.rel_scope))]
+        support = sampling.sample_scope(rel_scope[0], rel_scope[1], args.support_size)
+        support_id, run_seconds = snowball(loader, support, rel_scope, args, seen_set)
+        sizes.append(len(support_id))
+        duplicates.append(len(support_id) - len(np.unique(support_id)))
+        seconds += run_seconds
+    print('{}: support set of {:.1f} ins on average, {:.1f} of them duplicates, bookkeeping {:.2f}ms per snowball'.format(
+        'uidset.UidSet' if seen_set else 'dict of tensors', np.mean(sizes), np.mean(duplicates), seconds / args.num_runs * 1e3))
@@ -0,0 +1,62 @@
+import argparse
+import numpy as np
+import torch
+from nrekit.support import SupportSet
+from nrekit.sentence_encoder import CNNSentenceEncoder
+from bench_util import timeit, random_dataset
+
+def dataset(num, max_length, device):
+    return dict(random_dataset(num, max_length, device), label=torch.zeros(num, dtype=torch.long, device=device),
+                entpair=['head{}#tail{}'.format(i, i) for i in range(num)])
+
+def cat_rows(support, candidate, index):
+    # the former Snowball._add_ins_to_vdata, once per picked instance
+    for i in index:
+        for key in ['word', 'pos1', 'pos2', 'mask', 'id']:
+            support[key] = torch.cat([support[key], candidate[key][i].unsqueeze(0)], 0)
+        support['entpair'].append(candidate['entpair'][i])
+        support['label'] = torch.cat([support['label'], torch.ones((1), dtype=torch.long, device=support['label'].device)], 0)
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--support_size', type=int, default=5)
+parser.add_argument('--max_length', type=int, default=40)
+parser.add_argument('--additions', help='num of ins picked at each snowball iteration', type=int, nargs='+', default=[10, 100, 1000])
+parser.add_argument('--snowball_max_iter', type=int, default=5)
+args = parser.parse_args()
+
+device = 'cuda' if torch.cuda.is_available() else 'cpu'
+for additions in args.additions:
+    candidate = dataset(4 * additions, args.max_length, device)
+    picks = [torch.randperm(len(candidate['id']))[:additions].tolist() for _ in range(args.snowball_max_iter)]
+    initial = dataset(args.support_size, args.max_length, device)
+    legacy = dict(initial, entpair=list(initial['entpair']))
+    legacy_time = timeit(lambda: [cat_rows(legacy, candidate, index) for index in picks])
+    support = SupportSet(initial)
+    support_time = timeit(lambda: [support.append(candidate, index, label=1) for index in picks])
+    for key in legacy:
+        if key == 'entpair':
+            assert support[key] == legacy[key]
+        else:
+            assert (support[key] == legacy[key]).all(), key
+    print('{} ins added per iteration: torch.cat per ins {:.1f}ms, SupportSet.append {:.1f}ms ({:.0f}x)'.format(
+        additions, legacy_time, support_time, legacy_time / support_time))
+
+# encoding the support set after each snowball iteration: all of it, or only the new ins
+encoder = CNNSentenceEncoder(np.random.randn(20000, 50).astype(np.float32), args.max_length).to(device).eval()
+def encode(dataset):
+    with torch.no_grad():
+        return encoder(dataset)
+for additions in args.additions:
+    candidate = dataset(4 * additions, args.max_length, device)
+    picks = [torch.randperm(len(candidate['id']))[:additions].tolist() for _ in range(args.snowball_max_iter)]
+    initial = dataset(args.support_size, args.max_length, device)
+    support = SupportSet(initial)
+    full_time = 0
+    cached_time = 0
+    for index in picks:
+        support.append(candidate, index, label=1)
+        full_time += timeit(lambda: encode(support))
+        cached_time += timeit(lambda: support.represent(encode))
+    assert (support.represent(encode) - encode(support)).abs().max() < 1e-4
+    print('{} ins added per iteration: encoding the whole support set {:.1f}ms, SupportSet.represent {:.1f}ms ({:.1f}x)'.format(
+        additions, full_time, cached_time, full_time / cached_time))
@@ -0,0 +1,49 @@
+import argparse
+import numpy as np
+import torch
+from models.snowball import Siamese
+from nrekit.sentence_encoder import CNNSentenceEncoder
+from bench_util import timeit, random_dataset
+
+# The candidates picked by the siamese network at phase 2 of the snowball: sorting a list of
+# (score, index) pairs against Siamese.forward_infer_topk.
+
+def list_sort(score, k, threshold):
+    # the former Siamese.forward_infer_sort and its caller
+    pred = []
+    for i in range(score.size(0)):
+        pred.append((score[i], i))
+    pred.sort(key=lambda x: x[0], reverse=True)
+    return [iid for s, iid in pred[:k] if s > threshold]
+
+def topk(score, k, threshold):
+    # Siamese.forward_infer_topk past the scoring
+    score, index = score.topk(min(k, score.size(0)))
+    keep = score > threshold
+    return index[keep]
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--max_length', type=int, default=40)
+parser.add_argument('--support_size', type=int, default=20)
+parser.add_argument('--candidate_nums', type=int, nargs='+', default=[50, 500, 2000])
+parser.add_argument('--k', help='phase2_add_num', type=int, default=5)
+parser.add_argument('--threshold', type=float, default=0.5)
+parser.add_argument('--repeat', type=int, default=10)
+args = parser.parse_args()
+
+device = 'cuda' if torch.cuda.is_available() else 'cpu'
+torch.manual_seed(0)
+siamese = Siamese(CNNSentenceEncoder(np.random.randn(20000, 50).astype(np.float32), args.max_length)).to(device).eval()
+support = random_dataset(args.support_size, args.max_length, device)
+for candidate_num in args.candidate_nums:
+    candidate = random_dataset(candidate_num, args.max_length, device)
+    with torch.no_grad():
+        score = siamese.score(support, candidate)
+    # the threshold at the median score, for some of the top k to be dropped
+    for threshold in [args.threshold, float(score.median())]:
+        _, index = siamese.forward_infer_topk(support, candidate, args.k, threshold=threshold)
+        assert index.tolist() == list_sort(score, args.k, threshold)
+        assert index.tolist() == [iid for s, iid in siamese.forward_infer_sort(support, candidate)[:args.k] if s > threshold]
+    legacy = timeit(lambda: list_sort(score, args.k, args.threshold), args.repeat)
+    fast = timeit(lambda: topk(score, args.k, args.threshold), args.repeat)
+    print('{} candidates: sorted list of (score, index) {:.2f}ms, torch.topk {:.3f}ms ({:.0f}x)'.format(candidate_num, legacy, fast, legacy / fast))
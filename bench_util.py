@@ -0,0 +1,44 @@
+import time
+import torch
+
+# Helpers shared by the bench_*.py scripts.
+
+def synchronize():
+    # wait for the cuda kernels queued so far, so that they are counted in the time measured
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+
+def timeit(fn, repeat=1):
+    '''
+    return: milliseconds per call of fn, over repeat calls
+    '''
+    start = time.time()
+    for _ in range(repeat):
+        fn()
+    synchronize()
+    return (time.time() - start) / repeat * 1e3
+
+def random_dataset(num, max_length, device='cpu'):
+    '''
+    return: num random instances as gathered by the loaders, with the uids 0 .. num - 1
+    '''
+    return {'word': torch.randint(0, 20000, (num, max_length), device=device), 'pos1': torch.randint(0, 80, (num, max_length), device=device),
+            'pos2': torch.randint(0, 80, (num, max_length), device=device), 'mask': torch.randint(0, 4, (num, max_length), device=device),
+            'id': torch.arange(num, device=device)}
+
+class Lookup(torch.nn.Module):
+    # representations given by uid, in place of an encoder
+    def __init__(self, repre):
+        torch.nn.Module.__init__(self)
+        self.repre = repre
+
+    def forward(self, dataset):
+        return self.repre[dataset['id']]
+
+def broadcast_logits(x, y, fc, euc):
+    '''
+    logits of all the pairs of x and y, by the former broadcast of (x - y)^2 or x * y into a (len(x), len(y), hidden_size) tensor
+    '''
+    x = x.unsqueeze(1)
+    y = y.unsqueeze(0)
+    return fc(torch.pow(x - y, 2) if euc else x * y).squeeze(-1)
@@ -8,11 +8,11 @@ import argparse
 import numpy as np
 
 max_length = 40
-train_data_loader = DataLoader('./data/train_train.json', './data/glove.6B.50d.json', max_length=max_length)
-train_val_data_loader = DataLoader('./data/train_val.json', './data/glove.6B.50d.json', max_length=max_length)
-val_data_loader = DataLoader('./data/val.json', './data/glove.6B.50d.json', max_length=max_length)
-test_data_loader = DataLoader('./data/test.json', './data/glove.6B.50d.json', max_length=max_length)
-distant = DataLoader('./data/distant.json', './data/glove.6B.50d.json', max_length=max_length, distant=True)
+train_data_loader = DataLoader('./data/train_train.json', './data/glove.6B.50d.json', max_length=max_length, mmap=True)
+train_val_data_loader = DataLoader('./data/train_val.json', './data/glove.6B.50d.json', max_length=max_length, mmap=True)
+val_data_loader = DataLoader('./data/val.json', './data/glove.6B.50d.json', max_length=max_length, mmap=True)
+test_data_loader = DataLoader('./data/test.json', './data/glove.6B.50d.json', max_length=max_length, mmap=True)
+distant = DataLoader('./data/distant.json', './data/glove.6B.50d.json', max_length=max_length, mmap=True, distant=True)
 
 framework = nrekit.framework.Framework(train_val_data_loader, val_data_loader, test_data_loader, distant)
 framework.neg_train_loader = train_data_loader
@@ -0,0 +1,33 @@
+import os
+import time
+import argparse
+import numpy as np
+from nrekit.data_loader import JSONFileDataLoader as DataLoader
+from nrekit import ann
+
+# The index holds the representations of the main encoder (the one Snowball._infer uses) for the
+# distant instances, and is searched for the phase 2 candidates given --phase2_index, e.g.
+#   python build_ann_index.py --repre ./_repre/cnn_encoder_on_fewrel.npy --output ./_repre/cnn_encoder_on_fewrel.distant.ivf
+#   python binary_cnn_fewrel-test.py --phase2_index ./_repre/cnn_encoder_on_fewrel.distant.ivf
+# The runs encode a few of the looked up ins again and stop if the index was built from other representations.
+parser = argparse.ArgumentParser()
+parser.add_argument('--distant', default='./data/distant.json')
+parser.add_argument('--word_vec', default='./data/glove.6B.50d.json')
+parser.add_argument('--max_length', type=int, default=40)
+parser.add_argument('--repre', help='representations by uid (_repre/*.npy), or of the distant ins in order (_repre_split/*.distant.npy)', default='./_repre/cnn_encoder_on_fewrel.npy')
+parser.add_argument('--nlist', help='num of lists, 4 * sqrt(num of distant ins) by default', type=int, default=None)
+parser.add_argument('--num_iter', help='num of k-means iterations', type=int, default=10)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--output', default='./_repre/cnn_encoder_on_fewrel.distant.ivf')
+args = parser.parse_args()
+
+distant = DataLoader(args.distant, args.word_vec, max_length=args.max_length, cuda=False, mmap=True, distant=True)
+repre = np.load(args.repre, mmap_mode='r')
+if len(repre) != distant.instance_tot:
+    repre = repre[distant.uid]
+start = time.time()
+index = ann.IVFIndex.build(repre, nlist=args.nlist, num_iter=args.num_iter, seed=args.seed)
+if os.path.dirname(args.output) and not os.path.isdir(os.path.dirname(args.output)):
+    os.makedirs(os.path.dirname(args.output))
+index.save(args.output, header={'repre': os.path.basename(args.repre), 'params': vars(args)})
+print('{} distant ins in {} lists, built in {:.1f}s, saved to {}'.format(len(index), len(index.centroids), time.time() - start, args.output))
@@ -0,0 +1,42 @@
+import os
+import time
+import argparse
+import numpy as np
+import torch
+from torch import nn
+from nrekit.data_loader import JSONFileDataLoader as DataLoader
+from nrekit import entpair_table
+
+# The table holds the representations of the siamese encoder (the one of Snowball.siamese_model) for
+# the distant instances, and is looked up at phase 1 given --entpair_table, e.g.
+#   python build_entpair_table.py --repre ./_repre/cnn_siamese_on_fewrel.npy --siamese_ckpt ./checkpoint/cnn_siamese_euc_on_fewrel.pth.tar.bak
+#   python binary_cnn_fewrel-test.py --entpair_table ./_repre/cnn_siamese_on_fewrel.distant.entpair
+# The runs encode a few of the looked up ins again and stop if the table was built from other representations.
+parser = argparse.ArgumentParser()
+parser.add_argument('--distant', default='./data/distant.json')
+parser.add_argument('--word_vec', default='./data/glove.6B.50d.json')
+parser.add_argument('--max_length', type=int, default=40)
+parser.add_argument('--repre', help='siamese representations by uid (_repre/*.npy), or of the distant ins in order (_repre_split/*.distant.npy)', default='./_repre/cnn_siamese_on_fewrel.npy')
+parser.add_argument('--siamese_ckpt', help='checkpoint of the siamese network, for the cohesion of the entity pairs (none if not given)', default=None)
+parser.add_argument('--dot', help='the siamese network scores x * y, not (x - y)^2', action='store_true')
+parser.add_argument('--output', default='./_repre/cnn_siamese_on_fewrel.distant.entpair')
+args = parser.parse_args()
+
+distant = DataLoader(args.distant, args.word_vec, max_length=args.max_length, cuda=False, mmap=True, distant=True)
+repre = np.load(args.repre, mmap_mode='r')
+if len(repre) != distant.instance_tot:
+    repre = repre[distant.uid]
+fc = None
+if args.siamese_ckpt is not None:
+    state_dict = torch.load(args.siamese_ckpt, map_location='cpu')['state_dict']
+    state_dict = {key.replace('siamese_model.', ''): value for key, value in state_dict.items()}
+    fc = nn.Linear(repre.shape[1], 1)
+    fc.load_state_dict({'weight': state_dict['fc.weight'], 'bias': state_dict['fc.bias']})
+    if torch.cuda.is_available():
+        fc.cuda()
+start = time.time()
+table = entpair_table.EntpairTable.build(distant.data_entpair, distant.uid, repre, fc=fc, euc=not args.dot)
+if os.path.dirname(args.output) and not os.path.isdir(os.path.dirname(args.output)):
+    os.makedirs(os.path.dirname(args.output))
+table.save(args.output, header={'repre': os.path.basename(args.repre), 'params': vars(args)})
+print('{} distant ins of {} entity pairs, built in {:.1f}s, saved to {}'.format(len(table), len(table.offset) - 1, time.time() - start, args.output))
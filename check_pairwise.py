@@ -0,0 +1,60 @@
+import torch
+from models import snowball, snowball_euc
+from bench_util import Lookup, broadcast_logits
+
+# Siamese.score / forward_infer / forward_infer_topk (models/snowball.py) and the forward_infer of the
+# euclidean variants (models/snowball_euc.py) against the former broadcast of all the pairs, for
+# several tile and support chunk sizes. Deterministic and on cpu: fixed seed, float64, and thresholds
+# halfway between two scores so that no score sits on them. Fails with an AssertionError.
+
+HIDDEN_SIZE = 16
+SIZES = [(1, 1), (1, 9), (7, 1), (5, 37), (64, 300)] # (support ins, candidates)
+TILE_SIZES = [0, 1, 8, 1000]
+SUPPORT_CHUNK_SIZES = [0, 1, 3, 1000]
+
+def between(values):
+    # a threshold halfway between the two middle values, or below the only one
+    values = values.flatten().sort()[0]
+    if values.size(0) == 1:
+        return float(values[0]) - 0.01
+    k = values.size(0) // 2
+    return float(values[k - 1] + values[k]) / 2
+
+def dataset(repre, ids):
+    return {'word': repre[ids], 'id': ids}
+
+torch.manual_seed(0)
+checked = 0
+for support_size, candidate_num in SIZES:
+    repre = torch.relu(torch.randn(support_size + candidate_num, HIDDEN_SIZE, dtype=torch.float64))
+    support = dataset(repre, torch.arange(support_size))
+    candidate = dataset(repre, torch.arange(support_size, support_size + candidate_num))
+    for euc in [True, False]:
+        siamese = snowball.Siamese(Lookup(repre), hidden_size=HIDDEN_SIZE, euc=euc).double().eval()
+        siamese_euc = snowball_euc.Siamese(Lookup(repre), hidden_size=HIDDEN_SIZE).double().eval()
+        siamese_euc.fc = siamese.fc
+        with torch.no_grad():
+            prob = torch.sigmoid(broadcast_logits(repre[support['id']], repre[candidate['id']], siamese.fc, euc)) # (support, candidates)
+            expected = prob.mean(0)
+            threshold = between(expected)
+            any_threshold = between(prob)
+            k = max(1, candidate_num // 3)
+            for tile_size in TILE_SIZES:
+                for chunk_size in SUPPORT_CHUNK_SIZES:
+                    case = (support_size, candidate_num, euc, tile_size, chunk_size)
+                    siamese.tile_size = tile_size
+                    siamese.support_chunk_size = chunk_size
+                    assert (siamese.score(support, candidate) - expected).abs().max() < 1e-12, case
+                    assert (siamese.forward_infer(support, candidate, threshold=threshold) == (expected > threshold).long()).all(), case
+                    score, index = siamese.forward_infer_topk(support, candidate, k)
+                    assert index.tolist() == expected.topk(k)[1].tolist(), case
+                    score, index = siamese.forward_infer_topk(support, candidate, k, threshold=threshold)
+                    assert (score > threshold).all() and len(index) == min(k, int((expected > threshold).sum())), case
+                    if euc:
+                        # the euclidean variants pick the candidates scoring > threshold against any support ins
+                        siamese_euc.tile_size = tile_size
+                        siamese_euc.support_chunk_size = chunk_size
+                        pred = siamese_euc.forward_infer(support, candidate, threshold=any_threshold)
+                        assert (pred == (prob > any_threshold).any(0).long()).all(), case
+                    checked += 1
+print('{} cases: Siamese.score, forward_infer and forward_infer_topk match the broadcast of all the pairs'.format(checked))
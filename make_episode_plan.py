@@ -0,0 +1,47 @@
+import os
+import random
+import argparse
+import numpy as np
+from nrekit.data_loader import JSONFileDataLoader as DataLoader
+from nrekit import episode
+
+# The plan only holds instance indices, so it is drawn with the CNN loaders and replayed by both
+# the CNN and the BERT models, e.g.
+#   python make_episode_plan.py --kind eval --seed 0 --output ./_episode/val.eval.seed0.nre
+#   framework.eval(model, plan='./_episode/val.eval.seed0.nre')
+parser = argparse.ArgumentParser()
+parser.add_argument('--kind', help='eval: episodes of Framework.eval and eval_baseline, selected: episodes of Framework.eval_selected', choices=['eval', 'selected'], default='eval')
+parser.add_argument('--eval_data', help='evaluated split (val or test)', default='./data/val.json')
+parser.add_argument('--train_data', help='train split of the framework', default='./data/train_val.json')
+parser.add_argument('--neg_train_data', help='split of the negative support sets (framework.neg_train_loader), for selected', default='./data/train_train.json')
+parser.add_argument('--word_vec', default='./data/glove.6B.50d.json')
+parser.add_argument('--max_length', type=int, default=40)
+parser.add_argument('--support_size', type=int, default=10)
+parser.add_argument('--query_size', type=int, default=50)
+parser.add_argument('--num_episodes', help='for eval', type=int, default=100)
+parser.add_argument('--no_query_train', help='for eval, no negative queries from the train split', action='store_true')
+parser.add_argument('--no_query_val', help='for eval, no negative queries from the other relations of the evaluated split', action='store_true')
+parser.add_argument('--support_neg_rate', help='for selected', type=int, default=10)
+parser.add_argument('--query_class', help='for selected, num of train relations of the negative queries', type=int, default=16)
+parser.add_argument('--seed', type=int, default=0)
+parser.add_argument('--output', required=True)
+args = parser.parse_args()
+
+random.seed(args.seed)
+np.random.seed(args.seed)
+eval_data_loader = DataLoader(args.eval_data, args.word_vec, max_length=args.max_length, cuda=False, mmap=True)
+train_data_loader = DataLoader(args.train_data, args.word_vec, max_length=args.max_length, cuda=False, mmap=True)
+params = vars(args)
+if args.kind == 'eval':
+    plan = episode.draw_eval(eval_data_loader, train_data_loader, args.support_size, args.query_size, args.num_episodes,
+            query_train=not args.no_query_train, query_val=not args.no_query_val)
+    loaders = [eval_data_loader, train_data_loader]
+else:
+    neg_train_loader = DataLoader(args.neg_train_data, args.word_vec, max_length=args.max_length, cuda=False, mmap=True)
+    plan = episode.draw_selected(eval_data_loader, train_data_loader, args.support_size, args.support_neg_rate, args.query_size, args.query_class,
+            use_train_neg=True, neg_train_loader=neg_train_loader)
+    loaders = [eval_data_loader, train_data_loader, neg_train_loader]
+if os.path.dirname(args.output) and not os.path.isdir(os.path.dirname(args.output)):
+    os.makedirs(os.path.dirname(args.output))
+episode.save(args.output, plan, loaders, params)
+print('{} episodes saved to {}'.format(len(plan['target_class']), args.output))
@@ -188,7 +188,7 @@ class Proto(nrekit.framework.Model):
         if 'entpair' in dataset_dst and 'entpair' in dataset_src:
             dataset_dst['entpair'].append(dataset_src['entpair'][ins_id])
         if 'label' in dataset_dst and label is not None:
-            dataset_dst['label'] = torch.cat([dataset_dst['label'], torch.ones((1)).long().cuda()], 0)
+            dataset_dst['label'] = torch.cat([dataset_dst['label'], dataset_dst['label'].new_full((1,), label)], 0)
 
     def _dataset_stack_and_cuda(self, dataset):
         '''
@@ -278,7 +278,8 @@ class Proto(nrekit.framework.Model):
         # self.max_dis = torch.pow(support_pos_rep - self.proto.unsqueeze(0), 2).sum(-1).max(0)[0].item() * 0.5
 
         # snowball
-        exist_id = {}
+        support_pos = nrekit.support.SupportSet(support_pos) # grows with the picked ins
+        exist_id = nrekit.uidset.UidSet(int(distant.uid.max()) + 1) # uids of the ins in the support set
         print('\n-------------------------------------------------------')
         for snowball_iter in range(snowball_max_iter): 
             print('###### snowball iter ' + str(snowball_iter)) 
@@ -286,38 +287,27 @@ class Proto(nrekit.framework.Model):
             # phase 1: expand positive support set from distant dataset (with same entity pairs) 
             ## get all entpairs and their ins in positive support set
             old_support_pos_label = support_pos['label'] + 0
-            entpair_support = {}
             entpair_distant = {}
-            for i in range(len(support_pos['id'])): # only positive support
-                entpair = support_pos['entpair'][i]
-                exist_id[support_pos['id'][i]] = 1
-                if entpair not in entpair_support:
-                    entpair_support[entpair] = {'word': [], 'pos1': [], 'pos2': [], 'mask': []}
-                self._add_ins_to_data(entpair_support[entpair], support_pos, i)
+            exist_id.add(support_pos['id'])
+            entpair_support = list(dict.fromkeys(support_pos['entpair'])) # only positive support
             
             ## pick all ins with the same entpairs in distant data and choose with siamese network
             self._phase1_add_num = 0 # total number of snowball instances
             self._phase1_total = 0
-            for entpair in entpair_support:
-                raw = distant.get_same_entpair_ins(entpair) # ins with the same entpair
-                if raw is None:
-                    continue
-                entpair_distant[entpair] = {'word': [], 'pos1': [], 'pos2': [], 'mask': [], 'id': [], 'entpair': []}
-                for i in range(raw['word'].size(0)):
-                    if raw['id'][i] not in exist_id: # don't pick sentences already in the support set
-                        self._add_ins_to_data(entpair_distant[entpair], raw, i)
-                self._dataset_stack_and_cuda(entpair_support[entpair])
-                self._dataset_stack_and_cuda(entpair_distant[entpair])
-                if len(entpair_support[entpair]['word']) == 0 or len(entpair_distant[entpair]['word']) == 0:
+            # ins with the same entpairs, for all the entpairs at once, but those already in the support set
+            raw_all = distant.get_same_entpair_ins_batch(entpair_support, exclude_id=exist_id)
+            for k, entpair in enumerate(entpair_support):
+                begin, end = raw_all['offset'][k], raw_all['offset'][k + 1]
+                if begin == end:
                     continue
+                entpair_distant[entpair] = {key: raw_all[key][begin:end] for key in raw_all if key != 'offset'}
                 # pick_or_not = self.siamese_model.forward_infer(entpair_support[entpair], entpair_distant[entpair], threshold=threshold_for_phase1)
                 # pick_or_not = self.siamese_model.forward_infer(original_support_pos, entpair_distant[entpair], threshold=threshold_for_phase1)
                 pick_or_not = self._infer(entpair_distant[entpair]) > 0
       
-                for i in range(pick_or_not.size(0)):
-                    if pick_or_not[i]:
-                        self._add_ins_to_vdata(support_pos, entpair_distant[entpair], i, label=1)
-                        exist_id[entpair_distant[entpair]['id'][i]] = 1
+                picked = pick_or_not.nonzero().view(-1)
+                support_pos.append(entpair_distant[entpair], picked, label=1)
+                exist_id.add(entpair_distant[entpair]['id'][picked])
                 self._phase1_add_num += pick_or_not.sum()
                 self._phase1_total += pick_or_not.size(0)
             
@@ -346,12 +336,12 @@ class Proto(nrekit.framework.Model):
             
             ## -- method 2: use siamese network --
             pick_or_not = self.siamese_model.forward_infer(support_pos, candidate, threshold=threshold_for_phase2)
-            for i in range(pick_or_not.size(0)):
-                if pick_or_not[i] == 1 and not (candidate['id'][i] in exist_id):
-                # if pick_or_not[i] == 1 and (candidate_prob[i] > 0) and not (candidate['id'][i] in exist_id):
-                    exist_id[candidate['id'][i]] = 1 
-                    self._phase2_add_num += 1
-                    self._add_ins_to_vdata(support_pos, candidate, i, label=1)
+            seen = exist_id.contains(candidate['id']) # candidates already in the support set
+            picked = ((pick_or_not == 1).cpu().numpy() & ~seen).nonzero()[0]
+            # picked = ((pick_or_not == 1).cpu().numpy() & (candidate_prob > 0).cpu().numpy() & ~seen).nonzero()[0]
+            support_pos.append(candidate, picked, label=1)
+            exist_id.add(candidate['id'][picked])
+            self._phase2_add_num += len(picked)
             self._phase2_total = pick_or_not.size(0)
 
             ## build new support set
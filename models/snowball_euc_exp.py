@@ -11,12 +11,10 @@ import sklearn.metrics
 import copy
 import json
 
-class Siamese(nn.Module):
+class Siamese(nrekit.snowball.SiameseBase):
 
     def __init__(self, sentence_encoder, hidden_size=230, drop_rate=0.5):
-        nn.Module.__init__(self)
-        self.sentence_encoder = sentence_encoder # Should be different from main sentence encoder
-        self.hidden_size = hidden_size
+        nrekit.snowball.SiameseBase.__init__(self, sentence_encoder, hidden_size, any_support=True)
         # self.fc1 = nn.Linear(hidden_size * 2, hidden_size * 2)
         # self.fc2 = nn.Linear(hidden_size * 2, 1)
         self.fc = nn.Linear(hidden_size, 1)
@@ -48,69 +46,14 @@ class Siamese(nn.Module):
         self._prec = float(np.logical_and(pred == 1, label == 1).sum()) / float((pred == 1).sum() + 1)
         self._recall = float(np.logical_and(pred == 1, label == 1).sum()) / float((label == 1).sum() + 1)
 
-    def encode(self, dataset, batch_size=0): 
-        if batch_size == 0:
-            x = self.sentence_encoder(dataset)
-        else:
-            total_length = dataset['word'].size(0)
-            max_iter = total_length // batch_size
-            if total_length % batch_size != 0:
-                max_iter += 1
-            x = []
-            for it in range(max_iter):
-                scope = list(range(batch_size * it, min(batch_size * (it + 1), total_length)))
-                with torch.no_grad():
-                    _ = {'word': dataset['word'][scope], 'mask': dataset['mask'][scope]}
-                    if 'pos1' in dataset:
-                        _['pos1'] = dataset['pos1'][scope]
-                        _['pos2'] = dataset['pos2'][scope]
-                    _x = self.sentence_encoder(_)
-                x.append(_x.detach())
-            x = torch.cat(x, 0)
-        return x
-
-    def forward_infer(self, x, y, threshold=0.5, batch_size=0):
-        x = self.encode(x, batch_size=batch_size)
-        support_size = x.size(0)
-        y = self.encode(y, batch_size=batch_size)
-        x = x.unsqueeze(1)
-        y = y.unsqueeze(0)
-
-        dis = torch.pow(x - y, 2).view(-1, self.hidden_size)
-        score = torch.sigmoid(self.fc(dis).squeeze(-1))
-
-        pred = torch.zeros((score.size(0))).long().cuda()
-        pred[score > threshold] = 1
-        pred = pred.view(support_size, -1).sum(0)
-        pred[pred < 1] = 0
-        pred[pred > 0] = 1
-        return pred
-
-    def forward_infer_sort(self, x, y, batch_size=0):
-        x = self.encode(x, batch_size=batch_size)
-        support_size = x.size(0)
-        y = self.encode(y, batch_size=batch_size)
-        x = x.unsqueeze(1)
-        y = y.unsqueeze(0)
-
-        dis = torch.pow(x - y, 2)
-        score = torch.sigmoid(self.fc(dis).squeeze(-1)).mean(0)
-
-        pred = []
-        for i in range(score.size(0)):
-            pred.append((score[i], i))
-        pred.sort(key=lambda x: x[0], reverse=True)
-        return pred
-
-class Snowball(nrekit.framework.Model):
+class Snowball(nrekit.snowball.SnowballBase):
     
     def __init__(self, sentence_encoder, base_class, siamese_model, hidden_size=230, drop_rate=0.5, weight_table=None, neg_loader=None):
-        nrekit.framework.Model.__init__(self, sentence_encoder)
+        nrekit.snowball.SnowballBase.__init__(self, sentence_encoder, siamese_model)
         self.hidden_size = hidden_size
         self.base_class = base_class
         self.fc = nn.Linear(hidden_size, base_class)
         self.drop = nn.Dropout(drop_rate)
-        self.siamese_model = siamese_model
         # self.cost = nn.BCEWithLogitsLoss()
         self.cost = nn.BCELoss(reduction="none")
         # self.cost = nn.CrossEntropyLoss()
@@ -136,7 +79,7 @@ class Snowball(nrekit.framework.Model):
         # inference batch_size
         self.parser.add_argument("--infer_batch_size", help="batch size when inference", type=int, default=0)
 
-        self.args = self.parser.parse_args()
+        self.args = self.parse_args()
 
     # def __loss__(self, logits, label):
     #     onehot_label = torch.zeros(logits.size()).cuda()
@@ -308,7 +251,7 @@ class Snowball(nrekit.framework.Model):
         if 'entpair' in dataset_dst and 'entpair' in dataset_src:
             dataset_dst['entpair'].append(dataset_src['entpair'][ins_id])
         if 'label' in dataset_dst and label is not None:
-            dataset_dst['label'] = torch.cat([dataset_dst['label'], torch.ones((1)).long().cuda()], 0)
+            dataset_dst['label'] = torch.cat([dataset_dst['label'], dataset_dst['label'].new_full((1,), label)], 0)
 
     def _dataset_stack_and_cuda(self, dataset):
         '''
@@ -323,27 +266,6 @@ class Snowball(nrekit.framework.Model):
             dataset['pos2'] = torch.stack(dataset['pos2'], 0).cuda()
         dataset['mask'] = torch.stack(dataset['mask'], 0).cuda()
 
-    def encode(self, dataset, batch_size=0):
-        if batch_size == 0:
-            x = self.sentence_encoder(dataset)
-        else:
-            total_length = dataset['word'].size(0)
-            max_iter = total_length // batch_size
-            if total_length % batch_size != 0:
-                max_iter += 1
-            x = []
-            for it in range(max_iter):
-                scope = list(range(batch_size * it, min(batch_size * (it + 1), total_length)))
-                with torch.no_grad():
-                    _ = {'word': dataset['word'][scope], 'mask': dataset['mask'][scope]}
-                    if 'pos1' in dataset:
-                        _['pos1'] = dataset['pos1'][scope]
-                        _['pos2'] = dataset['pos2'][scope]
-                    _x = self.sentence_encoder(_)
-                x.append(_x.detach())
-            x = torch.cat(x, 0)
-        return x
-
     def _infer(self, dataset, batch_size=0):
         '''
         get prob output of the finetune network with the input dataset
@@ -393,7 +315,8 @@ class Snowball(nrekit.framework.Model):
         original_support_pos = copy.deepcopy(support_pos)
 
         # snowball
-        exist_id = {}
+        support_pos = nrekit.support.SupportSet(support_pos) # grows with the picked ins
+        exist_id = nrekit.uidset.UidSet(int(distant.uid.max()) + 1) # uids of the ins in the support set
         print('\n-------------------------------------------------------')
         for snowball_iter in range(snowball_max_iter):
             print('###### snowball iter ' + str(snowball_iter))
@@ -401,17 +324,9 @@ class Snowball(nrekit.framework.Model):
 
             ## get all entpairs and their ins in positive support set
             old_support_pos_label = support_pos['label'] + 0
-            entpair_support = {}
             entpair_distant = {}
-            for i in range(len(support_pos['id'])): # only positive support
-                entpair = support_pos['entpair'][i]
-                exist_id[support_pos['id'][i]] = 1
-                if entpair not in entpair_support:
-                    if 'pos1' in support_pos:
-                        entpair_support[entpair] = {'word': [], 'pos1': [], 'pos2': [], 'mask': []}
-                    else:
-                        entpair_support[entpair] = {'word': [], 'mask': []}
-                self._add_ins_to_data(entpair_support[entpair], support_pos, i)
+            exist_id.add(support_pos['id'])
+            entpair_support = self._split_by_entpair(support_pos) # only positive support
 
             print('')
             print(entpair_support.keys())
@@ -420,32 +335,16 @@ class Snowball(nrekit.framework.Model):
             ## pick all ins with the same entpairs in distant data and choose with siamese network
             self._phase1_add_num = 0 # total number of snowball instances
             self._phase1_total = 0
-            for entpair in entpair_support:
-                raw = distant.get_same_entpair_ins(entpair) # ins with the same entpair
-                if raw is None:
-                    continue
-                if 'pos1' in support_pos:
-                    entpair_distant[entpair] = {'word': [], 'pos1': [], 'pos2': [], 'mask': [], 'id': [], 'entpair': []}
-                else:
-                    entpair_distant[entpair] = {'word': [], 'mask': [], 'id': [], 'entpair': []}
-                for i in range(raw['word'].size(0)):
-                    if raw['id'][i] not in exist_id: # don't pick sentences already in the support set
-                        self._add_ins_to_data(entpair_distant[entpair], raw, i)
-                self._dataset_stack_and_cuda(entpair_support[entpair])
-                self._dataset_stack_and_cuda(entpair_distant[entpair])
-                if len(entpair_support[entpair]['word']) == 0 or len(entpair_distant[entpair]['word']) == 0:
-                    continue
-                pick_or_not = self.siamese_model.forward_infer_sort(entpair_support[entpair], entpair_distant[entpair], batch_size=self.args.infer_batch_size)
+            for entpair, raw in self._same_entpair_ins(distant, entpair_support, exist_id):
+                entpair_distant[entpair] = raw
+                _, picked = self.siamese_model.forward_infer_topk(entpair_support[entpair], entpair_distant[entpair], sort_num1, threshold=sort_threshold1, batch_size=self.args.infer_batch_size)
                 # pick_or_not = self.siamese_model.forward_infer_sort(original_support_pos, entpair_distant[entpair], threshold=threshold_for_phase1)
                 # pick_or_not = self._infer(entpair_distant[entpair]) > threshold
       
                 # -- method B: use sort --
-                for i in range(min(len(pick_or_not), sort_num1)):
-                    if pick_or_not[i][0] > sort_threshold1:
-                        iid = pick_or_not[i][1]
-                        self._add_ins_to_vdata(support_pos, entpair_distant[entpair], iid, label=1)
-                        exist_id[entpair_distant[entpair]['id'][iid]] = 1
-                        self._phase1_add_num += 1
+                support_pos.append(entpair_distant[entpair], picked, label=1)
+                exist_id.add(entpair_distant[entpair]['id'][picked])
+                self._phase1_add_num += len(picked)
                 self._phase1_total += entpair_distant[entpair]['word'].size(0)
             '''
             if 'pos1' in support_pos:
@@ -480,7 +379,7 @@ class Snowball(nrekit.framework.Model):
             # for i in range(len(support_pos['id'])):
             #     print(support_pos['entpair'][i])
 
-            support_pos_rep = self.encode(support_pos, batch_size=self.args.infer_batch_size)
+            support_pos_rep = support_pos.represent(lambda dataset: self.encode(dataset, batch_size=self.args.infer_batch_size)) # only the new ins are encoded
             support_rep = torch.cat([support_pos_rep, support_neg_rep], 0)
             support_label = torch.cat([support_pos['label'], support_neg['label']], 0)
             
@@ -494,12 +393,12 @@ class Snowball(nrekit.framework.Model):
 
             # phase 2: use the new classifier to pick more extended support ins
             self._phase2_add_num = 0
-            candidate = distant.get_random_candidate(self.pos_class, candidate_num_class, candidate_num_ins_per_class)
+            candidate = self._phase2_candidate(distant, support_pos_rep, candidate_num_class, candidate_num_ins_per_class)
 
             ## -- method 1: directly use the classifier --
             candidate_prob = self._infer(candidate, batch_size=self.args.infer_batch_size)
             ## -- method 2: use siamese network --
-            pick_or_not = self.siamese_model.forward_infer_sort(support_pos, candidate, batch_size=self.args.infer_batch_size)
+            _, index = self.siamese_model.forward_infer_topk(support_pos, candidate, sort_num2, threshold=sort_threshold2, batch_size=self.args.infer_batch_size)
 
             ## -- method A: use threshold --
             '''
@@ -514,15 +413,14 @@ class Snowball(nrekit.framework.Model):
 
             ## -- method B: use sort --
             self._phase2_total = candidate['word'].size(0)
-            for i in range(min(len(candidate_prob), sort_num2)):
-                iid = pick_or_not[i][1]
-                if (pick_or_not[i][0] > sort_threshold2) and (candidate_prob[iid] > sort_ori_threshold) and not (candidate['id'][iid] in exist_id):
-                    exist_id[candidate['id'][iid]] = 1 
-                    self._phase2_add_num += 1
-                    self._add_ins_to_vdata(support_pos, candidate, iid, label=1)
+            seen = torch.from_numpy(exist_id.contains(candidate['id'])).to(index.device) # candidates already in the support set
+            picked = index[(candidate_prob[index] > sort_ori_threshold) & ~seen[index]]
+            support_pos.append(candidate, picked, label=1)
+            exist_id.add(candidate['id'][picked])
+            self._phase2_add_num += len(picked)
 
             ## build new support set
-            support_pos_rep = self.encode(support_pos, self.args.infer_batch_size)
+            support_pos_rep = support_pos.represent(lambda dataset: self.encode(dataset, batch_size=self.args.infer_batch_size)) # only the new ins are encoded
             support_rep = torch.cat([support_pos_rep, support_neg_rep], 0)
             support_label = torch.cat([support_pos['label'], support_neg['label']], 0)
 
@@ -586,6 +484,7 @@ class Snowball(nrekit.framework.Model):
         threshold_for_snowball: distant ins with prob > th_for_snowball will be added to extended support set
         '''
         self.pos_class = pos_class 
+        self.start_episode()
 
         self._forward_train(support_pos, support_neg, query, distant, threshold=threshold)
 
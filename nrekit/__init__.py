@@ -1,5 +1,17 @@
 from nrekit import data_loader 
 from nrekit import framework
 from nrekit import framework_exp
+from nrekit import preprocess
+from nrekit import container
+from nrekit import prefetch
+from nrekit import sampling
+from nrekit import episode
+from nrekit import uidset
+from nrekit import support
+from nrekit import cache
+from nrekit import pairwise
+from nrekit import ann
+from nrekit import entpair_table
+from nrekit import snowball
 from nrekit import sentence_encoder
 
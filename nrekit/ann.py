@@ -0,0 +1,169 @@
+'''
+Nearest-neighbour search over the precomputed representations of the distant instances.
+
+Phase 2 of the snowball scores a pool of candidates against the support set. Drawn at random, most of
+the pool is unrelated to the relation and most of the distant data is never looked at; retrieved as
+the distant instances nearest to the prototype (mean representation) of the support set, the pool
+is spent on the likely ones.
+
+search_exact scans all the representations a block at a time. IVFIndex is an inverted file: the
+representations are clustered by k-means, stored contiguously list by list, and a query only scans
+the lists of its nprobe nearest centroids. The index is saved as a container (see container.py), so it
+is memory-mapped and shared by the runs instead of being loaded in each of them.
+'''
+
+import numpy as np
+from . import container
+
+KIND = 'ivf'
+
+def _sq_norm(x):
+    return np.einsum('ij,ij->i', x, x)
+
+def _top(dist, n):
+    '''
+    return: indices of the n smallest distances, in ascending order of distance
+    '''
+    if n < len(dist):
+        top = np.argpartition(dist, n - 1)[:n]
+    else:
+        top = np.arange(len(dist))
+    return top[np.argsort(dist[top], kind='stable')]
+
+def search_exact(vectors, query, n, block_size=1 << 16):
+    '''
+    brute-force search, a block of vectors at a time
+    vectors: (num of vectors, hidden_size), e.g. a memory-mapped .npy
+    query: (hidden_size)
+    n: num of neighbours
+    return: indices of the n nearest vectors (ascending distance), their squared euclidean distances
+    '''
+    query = np.asarray(query, dtype=np.float32)
+    index = np.zeros(0, dtype=np.int64)
+    dist = np.zeros(0, dtype=np.float32)
+    for start in range(0, len(vectors), block_size):
+        block = np.asarray(vectors[start:start + block_size], dtype=np.float32)
+        block_dist = _sq_norm(block) - 2 * block.dot(query)
+        index = np.concatenate([index, start + np.arange(len(block))])
+        dist = np.concatenate([dist, block_dist])
+        top = _top(dist, n)
+        index, dist = index[top], dist[top]
+    return index, dist + query.dot(query)
+
+def _assign(vectors, centroids, block_size=1 << 16):
+    '''
+    return: nearest centroid of each vector
+    '''
+    centroid_norm = _sq_norm(centroids)
+    assign = np.zeros(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), block_size):
+        block = np.asarray(vectors[start:start + block_size], dtype=np.float32)
+        assign[start:start + len(block)] = np.argmin(centroid_norm - 2 * block.dot(centroids.T), 1)
+    return assign
+
+def kmeans(vectors, num_clusters, num_iter=10, seed=0):
+    '''
+    Lloyd's algorithm, clusters emptied by an iteration get a random vector as centroid again
+    vectors: (num of vectors, hidden_size), float32
+    return: centroids (num_clusters, hidden_size)
+    '''
+    rng = np.random.RandomState(seed)
+    centroids = vectors[rng.choice(len(vectors), num_clusters, replace=False)].copy()
+    for _ in range(num_iter):
+        assign = _assign(vectors, centroids)
+        count = np.bincount(assign, minlength=num_clusters)
+        order = np.argsort(assign, kind='stable')
+        nonempty = np.flatnonzero(count)
+        start = np.concatenate([[0], np.cumsum(count)])[nonempty]
+        centroids[nonempty] = np.add.reduceat(vectors[order], start, axis=0) / count[nonempty, None]
+        empty = np.flatnonzero(count == 0)
+        centroids[empty] = vectors[rng.choice(len(vectors), len(empty), replace=False)]
+    return centroids
+
+class IVFIndex:
+    '''
+    centroids: (nlist, hidden_size)
+    offset: the vectors of list l are [offset[l], offset[l + 1])
+    vectors: (num of vectors, hidden_size), grouped by list
+    norm: squared norms of the vectors
+    order: position of each of the vectors in the indexed array
+    '''
+    def __init__(self, centroids, offset, vectors, norm, order):
+        self.centroids = centroids
+        self.offset = offset
+        self.vectors = vectors
+        self.norm = norm
+        self.order = order
+        self._position = None # position of each vector of the indexed array in self.vectors, see reconstruct
+
+    @classmethod
+    def build(cls, vectors, nlist=None, num_iter=10, sample_size=None, seed=0):
+        '''
+        vectors: (num of vectors, hidden_size), e.g. a memory-mapped .npy
+        nlist: num of lists (k-means clusters), 4 * sqrt(num of vectors) by default
+        sample_size: num of vectors k-means is trained on, 64 per list by default
+        '''
+        num = len(vectors)
+        if nlist is None:
+            nlist = max(1, int(4 * np.sqrt(num)))
+        nlist = min(nlist, num)
+        if sample_size is None:
+            sample_size = 64 * nlist
+        rng = np.random.RandomState(seed)
+        sample = np.sort(rng.choice(num, min(sample_size, num), replace=False))
+        centroids = kmeans(np.asarray(vectors[sample], dtype=np.float32), nlist, num_iter=num_iter, seed=seed)
+        assign = _assign(vectors, centroids)
+        order = np.argsort(assign, kind='stable')
+        offset = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=nlist))]).astype(np.int64)
+        grouped = np.asarray(vectors, dtype=np.float32)[order]
+        return cls(centroids, offset, grouped, _sq_norm(grouped), order.astype(np.int64))
+
+    def columns(self):
+        return {'ivf_centroids': self.centroids, 'ivf_offset': self.offset, 'ivf_vectors': self.vectors,
+                'ivf_norm': self.norm, 'ivf_order': self.order}
+
+    def save(self, file_name, header=None):
+        '''
+        header: json-serializable dict stored along (e.g. the representations the index was built on)
+        '''
+        container.save(file_name, dict(header or {}, kind=KIND), self.columns(), {})
+
+    @classmethod
+    def load(cls, file_name, copy=False):
+        '''
+        copy: read the index into memory instead of mapping it
+        return: the index, or None if the file is missing or not an index
+        '''
+        loaded = container.load(file_name, copy=copy)
+        if loaded is None or loaded[0].get('kind') != KIND:
+            return None
+        columns = loaded[1]
+        return cls(columns['ivf_centroids'], columns['ivf_offset'], columns['ivf_vectors'], columns['ivf_norm'], columns['ivf_order'])
+
+    def __len__(self):
+        return len(self.order)
+
+    def reconstruct(self, index):
+        '''
+        index: indices of vectors in the indexed array
+        return: these vectors (len(index), hidden_size), float32
+        '''
+        if self._position is None:
+            self._position = np.empty_like(self.order)
+            self._position[self.order] = np.arange(len(self.order))
+        return np.asarray(self.vectors[self._position[index]], dtype=np.float32)
+
+    def search(self, query, n, nprobe=8):
+        '''
+        query: (hidden_size)
+        n: num of neighbours
+        nprobe: num of lists scanned, those of the nearest centroids
+        return: indices of the (at most) n nearest vectors among those of the lists (ascending
+                distance), their squared euclidean distances
+        '''
+        query = np.asarray(query, dtype=np.float32)
+        lists = _top(_sq_norm(self.centroids) - 2 * self.centroids.dot(query), nprobe)
+        position = np.concatenate([np.arange(self.offset[l], self.offset[l + 1]) for l in lists])
+        dist = self.norm[position] - 2 * self.vectors[position].dot(query)
+        top = _top(dist, n)
+        return self.order[position[top]], dist[top] + query.dot(query)
@@ -0,0 +1,157 @@
+'''
+Representations of the instances, cached by uid.
+
+In a snowball episode the same instances go through the same encoders again and again: the candidates
+are encoded by the classifier and by the siamese network, the support set at every iteration, the query
+set at every evaluation. While an encoder is frozen the representation of an instance only depends on
+its uid (see uidset.py), so each encoder keeps the representations it has computed and only encodes the
+instances it has not seen. This holds whatever the train / eval mode of the encoder, unless its dropout
+is active (see deterministic): e.g. BERT in train mode is not cached, so that its dropout is still
+drawn at every call.
+
+A cache is either cleared at the start of every episode (nothing to evict then), or kept across the
+episodes, holding at most a given num of representations and evicting the least recently used ones.
+Either way it is cleared whenever the weights of the encoder change (see weights_version), e.g. by a
+training step or by loading a checkpoint between two evaluations.
+'''
+
+import numpy as np
+import torch
+from torch import nn
+from .uidset import _as_array
+
+KEYS = ['word', 'pos1', 'pos2', 'mask', 'id']
+
+def deterministic(module):
+    '''
+    return: whether the outputs of module only depend on its inputs and weights, i.e. none of its
+            dropout layers is active (in train mode with p > 0)
+    '''
+    return not any(isinstance(m, nn.modules.dropout._DropoutNd) and m.training and m.p > 0 for m in module.modules())
+
+def weights_version(module):
+    '''
+    return: a key that changes whenever a parameter of module is updated in place (optimizer step,
+            load_state_dict) or replaced (e.g. moved to another device)
+    '''
+    return tuple((p.data_ptr(), p._version) for p in module.parameters())
+
+class EmbeddingCache:
+    '''
+    capacity: max num of representations kept, the least recently used ones are evicted beyond it
+              (None: no limit)
+    '''
+    def __init__(self, capacity=None):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.version = None # weights_version of the encoder the representations come from
+        self.clear()
+
+    def clear(self):
+        '''
+        drop all the representations (the hit and miss counters are kept)
+        '''
+        self.slot = np.full(0, -1, dtype=np.int64) # uid -> row of self.repre, -1 if not cached
+        self.uid = np.zeros(0, dtype=np.int64) # row -> uid
+        self.stamp = np.zeros(0, dtype=np.int64) # row -> time of its last use
+        self.repre = None
+        self.size = 0
+        self.clock = 0
+
+    def sync(self, version):
+        '''
+        clear the cache if the representations come from other weights of the encoder
+        version: weights_version of the encoder
+        '''
+        if version != self.version:
+            self.clear()
+            self.version = version
+
+    def __len__(self):
+        return self.size
+
+    def lookup(self, uid):
+        '''
+        uid: int array
+        return: rows of the cached representations (int array), -1 for the uids not cached
+        '''
+        row = np.full(len(uid), -1, dtype=np.int64)
+        inside = uid < len(self.slot)
+        row[inside] = self.slot[uid[inside]]
+        return row
+
+    def _reserve(self, size, repre):
+        capacity = 0 if self.repre is None else len(self.repre)
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity)
+        if self.capacity is not None:
+            capacity = min(capacity, self.capacity)
+        buffer = repre.new_empty((capacity,) + tuple(repre.shape[1:]))
+        if self.repre is not None:
+            buffer[:self.size] = self.repre[:self.size]
+        self.repre = buffer
+        self.uid = np.resize(self.uid, capacity)
+        self.stamp = np.resize(self.stamp, capacity)
+
+    def store(self, uid, repre):
+        '''
+        uid: uids not in the cache, all different (int array)
+        repre: their representations
+        '''
+        if self.capacity is not None and len(uid) > self.capacity:
+            uid, repre = uid[-self.capacity:], repre[-self.capacity:]
+        num = len(uid)
+        if num == 0:
+            return
+        self.clock += 1
+        self._reserve(self.size + num, repre)
+        fill = min(len(self.repre) - self.size, num)
+        row = np.arange(self.size, self.size + fill)
+        if fill < num:
+            # evict the least recently used ones
+            victim = np.argpartition(self.stamp[:self.size], num - fill - 1)[:num - fill]
+            self.slot[self.uid[victim]] = -1
+            row = np.concatenate([row, victim])
+        self.size += fill
+        if int(uid.max()) >= len(self.slot):
+            slot = np.full(max(int(uid.max()) + 1, 2 * len(self.slot)), -1, dtype=np.int64)
+            slot[:len(self.slot)] = self.slot
+            self.slot = slot
+        self.slot[uid] = row
+        self.uid[row] = uid
+        self.stamp[row] = self.clock
+        self.repre[torch.from_numpy(row).to(self.repre.device)] = repre
+
+    def encode(self, dataset, encode):
+        '''
+        representations of the instances of dataset, encoding only the uncached ones
+        dataset: input dataset, with the uids of the instances in dataset['id']
+        encode: dataset -> representations (num of instances, hidden_size), the same frozen encoder at every call
+        return: representations (num of instances, hidden_size)
+        '''
+        if 'id' not in dataset:
+            return encode(dataset)
+        uid = _as_array(dataset['id'])
+        if len(uid) == 0:
+            return encode(dataset)
+        row = self.lookup(uid)
+        hit = row >= 0
+        self.clock += 1
+        self.stamp[row[hit]] = self.clock
+        miss = np.flatnonzero(~hit)
+        new_uid, first, inverse = np.unique(uid[miss], return_index=True, return_inverse=True)
+        self.hits += len(uid) - len(new_uid)
+        self.misses += len(new_uid)
+        if len(new_uid) == 0:
+            return self.repre[torch.from_numpy(row).to(self.repre.device)]
+        device = dataset['word'].device
+        index = torch.from_numpy(miss[first]).to(device)
+        repre = encode({key: dataset[key][index] for key in KEYS if key in dataset}).detach()
+        x = repre.new_empty((len(uid),) + tuple(repre.shape[1:]))
+        x[torch.from_numpy(miss).to(device)] = repre[torch.from_numpy(inverse.reshape(-1)).to(device)]
+        if hit.any():
+            x[torch.from_numpy(np.flatnonzero(hit)).to(device)] = self.repre[torch.from_numpy(row[hit]).to(self.repre.device)]
+        self.store(new_uid, repre)
+        return x
@@ -0,0 +1,125 @@
+'''
+Single-file container for pre-processed data.
+
+layout:
+    MAGIC (8 bytes) | header length (uint64, little endian) | header (json) | padding | data region
+The header records the format version, the signature of the source file, the pre-processing
+parameters and the offsets (relative to the data region) of
+    columns: typed arrays, each aligned to ALIGN bytes
+    sections: json blobs, e.g. rel2scope, rel2id
+'''
+
+import os
+import json
+import mmap
+import hashlib
+import numpy as np
+
+MAGIC = b'NREDATA\0'
+VERSION = 1
+ALIGN = 64
+
+def _align(offset):
+    return (offset + ALIGN - 1) // ALIGN * ALIGN
+
+def file_hash(file_name, block_size=1 << 20):
+    '''
+    return: sha1 hex digest of the content of the file
+    '''
+    h = hashlib.sha1()
+    with open(file_name, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            h.update(block)
+    return h.hexdigest()
+
+def source_signature(file_name):
+    '''
+    return: {'size', 'mtime', 'sha1'} of the source file, stored in the header
+    '''
+    stat = os.stat(file_name)
+    return {'size': stat.st_size, 'mtime': stat.st_mtime, 'sha1': file_hash(file_name)}
+
+def source_matches(signature, file_name):
+    '''
+    check the source file against the signature in a header. The content is only hashed again
+    when size or mtime changed, so that an untouched file costs a single stat.
+    '''
+    stat = os.stat(file_name)
+    if stat.st_size != signature['size']:
+        return False
+    if stat.st_mtime == signature['mtime']:
+        return True
+    return file_hash(file_name) == signature['sha1']
+
+def save(file_name, header, columns, sections):
+    '''
+    file_name: path of the container
+    header: json-serializable dict (e.g. source signature and parameters)
+    columns: {name: np.ndarray}
+    sections: {name: json-serializable object}
+    The file is written under a temporary name and renamed, so readers never see half of it.
+    '''
+    header = dict(header)
+    header['version'] = VERSION
+    header['columns'] = {}
+    header['sections'] = {}
+    blobs = []
+    offset = 0
+    for name in columns:
+        array = np.ascontiguousarray(columns[name])
+        offset = _align(offset)
+        header['columns'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        blobs.append((offset, array))
+        offset += array.nbytes
+    for name in sections:
+        blob = json.dumps(sections[name]).encode('utf-8')
+        header['sections'][name] = {'offset': offset, 'length': len(blob)}
+        blobs.append((offset, blob))
+        offset += len(blob)
+    data_length = offset
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(header_bytes))
+
+    tmp_file_name = file_name + '.tmp'
+    with open(tmp_file_name, 'wb') as f:
+        f.write(MAGIC)
+        f.write(np.uint64(len(header_bytes)).tobytes())
+        f.write(header_bytes)
+        for offset, blob in blobs:
+            f.seek(data_start + offset)
+            f.write(blob.tobytes() if isinstance(blob, np.ndarray) else blob)
+        f.truncate(data_start + data_length)
+    os.replace(tmp_file_name, file_name)
+
+def load(file_name, copy=False):
+    '''
+    open a container with a single open and mmap
+    copy: read the columns into memory instead of keeping read-only views on the mapping
+    return: header, columns ({name: np.ndarray}), sections ({name: object}),
+            or None if the file is missing or not a container of this version
+    '''
+    if not os.path.isfile(file_name) or os.path.getsize(file_name) < len(MAGIC) + 8:
+        return None
+    with open(file_name, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if buf[:len(MAGIC)] != MAGIC:
+        return None
+    header_length = int(np.frombuffer(buf, dtype=np.uint64, count=1, offset=len(MAGIC))[0])
+    header_start = len(MAGIC) + 8
+    header = json.loads(buf[header_start:header_start + header_length].decode('utf-8'))
+    if header.get('version') != VERSION:
+        return None
+    data_start = _align(header_start + header_length)
+
+    columns = {}
+    for name, column in header['columns'].items():
+        array = np.ndarray(column['shape'], dtype=np.dtype(column['dtype']), buffer=buf, offset=data_start + column['offset'])
+        columns[name] = array.copy() if copy else array
+    sections = {}
+    for name, section in header['sections'].items():
+        start = data_start + section['offset']
+        sections[name] = json.loads(buf[start:start + section['length']].decode('utf-8'))
+    return header, columns, sections
@@ -1,10 +1,50 @@
 import json
 import os
+import collections
 import multiprocessing
 import numpy as np
 import random
 import torch
 from torch.autograd import Variable
+from . import preprocess
+from . import container
+from . import prefetch
+from . import sampling
+from . import episode
+from . import uidset
+
+def to_tensor(array, cuda=False):
+    '''
+    numpy array -> LongTensor (Variable)
+    The pre-processed arrays are stored with compact dtypes, so they are moved to the GPU as they
+    are and widened to int64 there, instead of on the host for every batch.
+    In the worker of a prefetch.Prefetcher, the array is pinned and copied without blocking.
+    '''
+    tensor = torch.from_numpy(array)
+    if cuda:
+        if prefetch.pinned():
+            tensor = tensor.pin_memory()
+        tensor = tensor.cuda(non_blocking=True)
+    return Variable(tensor.long())
+
+def to_tensors(arrays, cuda=False):
+    '''
+    {name: numpy array} -> {name: LongTensor (Variable)}, for arrays of the same num of rows
+    The arrays of each dtype are packed side by side into one buffer, so that they reach the GPU in a
+    single copy per dtype, at the width they are stored with, and are split there again.
+    '''
+    groups = collections.OrderedDict()
+    for key in arrays:
+        groups.setdefault(arrays[key].dtype, []).append(key)
+    tensors = {}
+    for keys in groups.values():
+        columns = [arrays[key].reshape(len(arrays[key]), int(np.prod(arrays[key].shape[1:]))) for key in keys]
+        packed = to_tensor(np.concatenate(columns, 1), cuda)
+        start = 0
+        for key, column in zip(keys, columns):
+            tensors[key] = packed[:, start:start + column.shape[1]].contiguous().view(arrays[key].shape)
+            start += column.shape[1]
+    return {key: tensors[key] for key in arrays}
 
 class FileDataLoader:
     def next_batch(self, B, N, K, Q):
@@ -20,58 +60,40 @@ class FileDataLoader:
 class JSONFileDataLoader(FileDataLoader):
     def _load_preprocessed_file(self): 
         name_prefix = '.'.join(self.file_name.split('/')[-1].split('.')[:-1])
-        self.uid = np.load('./data/' + name_prefix + '_uid.npy')
+        # read-only memory maps share their pages across processes through the page cache
+        mmap_mode = 'r' if self.mmap else None
+        self.uid = np.load('./data/' + name_prefix + '_uid.npy', mmap_mode=mmap_mode)
         word_vec_name_prefix = '.'.join(self.word_vec_file_name.split('/')[-1].split('.')[:-1])
         processed_data_dir = '_processed_data'
-        if not os.path.isdir(processed_data_dir):
-            return False
-        word_npy_file_name = os.path.join(processed_data_dir, name_prefix + '_word.npy')
-        pos1_npy_file_name = os.path.join(processed_data_dir, name_prefix + '_pos1.npy')
-        pos2_npy_file_name = os.path.join(processed_data_dir, name_prefix + '_pos2.npy')
-        mask_npy_file_name = os.path.join(processed_data_dir, name_prefix + '_mask.npy')
-        length_npy_file_name = os.path.join(processed_data_dir, name_prefix + '_length.npy')
-        label_npy_file_name = os.path.join(processed_data_dir, name_prefix + '_label.npy')
-        entpair_npy_file_name = os.path.join(processed_data_dir, name_prefix + '_entpair.npy')
-        rel2scope_file_name = os.path.join(processed_data_dir, name_prefix + '_rel2scope.json')
-        word_vec_mat_file_name = os.path.join(processed_data_dir, word_vec_name_prefix + '_mat.npy')
-        word2id_file_name = os.path.join(processed_data_dir, word_vec_name_prefix + '_word2id.json')
-        rel2id_file_name = os.path.join(processed_data_dir, name_prefix + '_rel2id.json')
-        entpair2scope_file_name = os.path.join(processed_data_dir, name_prefix + '_entpair2scope.json')
-        if not os.path.exists(word_npy_file_name) or \
-           not os.path.exists(pos1_npy_file_name) or \
-           not os.path.exists(pos2_npy_file_name) or \
-           not os.path.exists(mask_npy_file_name) or \
-           not os.path.exists(length_npy_file_name) or \
-           not os.path.exists(label_npy_file_name) or \
-           not os.path.exists(entpair_npy_file_name) or \
-           not os.path.exists(rel2scope_file_name) or \
-           not os.path.exists(word_vec_mat_file_name) or \
-           not os.path.exists(word2id_file_name) or \
-           not os.path.exists(rel2id_file_name) or \
-           not os.path.exists(entpair2scope_file_name):
+        # the word vectors are shared by all the splits, so they have a container of their own
+        word_vec = container.load(os.path.join(processed_data_dir, word_vec_name_prefix + '.nre'), copy=True)
+        data = container.load(os.path.join(processed_data_dir, name_prefix + '.nre'), copy=not self.mmap)
+        if word_vec is None or data is None:
             return False
         print("Pre-processed files exist. Loading them...")
-        self.data_word = np.load(word_npy_file_name)
-        self.data_pos1 = np.load(pos1_npy_file_name)
-        self.data_pos2 = np.load(pos2_npy_file_name)
-        self.data_mask = np.load(mask_npy_file_name)
-        self.data_length = np.load(length_npy_file_name)
-        self.data_label = np.load(label_npy_file_name)
-        self.data_entpair = np.load(entpair_npy_file_name)
-        self.rel2scope = json.load(open(rel2scope_file_name))
-        self.word_vec_mat = np.load(word_vec_mat_file_name)
-        self.word2id = json.load(open(word2id_file_name))
-        self.rel2id = json.load(open(rel2id_file_name))
-        self.entpair2scope = json.load(open(entpair2scope_file_name))
+        word_vec_header, word_vec_columns, word_vec_sections = word_vec
+        header, columns, sections = data
+        if word_vec_header['params'] != {'case_sensitive': self.case_sensitive} or \
+           header['params'] != dict(self.params, vocab=word_vec_header['source']['sha1']) or \
+           (os.path.isfile(self.word_vec_file_name) and not container.source_matches(word_vec_header['source'], self.word_vec_file_name)) or \
+           (os.path.isfile(self.file_name) and not container.source_matches(header['source'], self.file_name)) or \
+           'entpair_id' not in columns:
+            print("Pre-processed files don't match current settings or source files. Reprocessing...")
+            return False
+        for key in columns:
+            if not key.startswith('entpair_'):
+                setattr(self, 'data_' + key, columns[key])
+        self.data_entpair = preprocess.EntpairIndex.from_columns(columns)
+        self.rel2scope = sections['rel2scope']
+        self.word_vec_mat = word_vec_columns['mat']
+        self.word2id = word_vec_sections['word2id']
+        self.rel2id = sections['rel2id']
         self.instance_tot = self.data_word.shape[0]
         self.rel_tot = len(self.rel2id)
-        if self.data_word.shape[1] != self.max_length:
-            print("Pre-processed files don't match current settings. Reprocessing...")
-            return False
         print("Finish loading")
         return True
 
-    def __init__(self, file_name, word_vec_file_name, max_length=40, case_sensitive=False, reprocess=False, cuda=True, distant=False, rel2id=None, shuffle=True):
+    def __init__(self, file_name, word_vec_file_name, max_length=40, case_sensitive=False, reprocess=False, cuda=True, distant=False, rel2id=None, shuffle=True, num_workers=1, mmap=False, compact=True, expand_positions=True):
         '''
         file_name: Json file storing the data in the following format
             {
@@ -100,6 +122,10 @@ class JSONFileDataLoader(FileDataLoader):
         case_sensitive: Whether the data processing is case-sensitive, default as False.
         reprocess: Do the pre-processing whether there exist pre-processed files, default as False.
         cuda: Use cuda or not, default as True.
+        num_workers: Num of processes for pre-processing, default as 1. With more than one, the processes parse and encode parts of the data file in parallel.
+        mmap: Memory-map the pre-processed files instead of reading them into memory, default as False.
+        compact: Store the pre-processed arrays with the smallest dtypes holding them (widened to int64 on the device), default as True.
+        expand_positions: Store the pos1 / pos2 / mask matrices, default as True. Otherwise only the head / tail positions and lengths are stored and the matrices are computed when gathering a batch.
         '''
         self.file_name = file_name
         self.word_vec_file_name = word_vec_file_name
@@ -107,6 +133,9 @@ class JSONFileDataLoader(FileDataLoader):
         self.max_length = max_length
         self.cuda = cuda
         self.shuffle = shuffle
+        self.mmap = mmap
+        # everything the pre-processed data depends on besides the source files, checked when loading it
+        self.params = {'max_length': max_length, 'case_sensitive': case_sensitive, 'distant': distant, 'compact': compact, 'expand_positions': expand_positions, 'rel2id': None if rel2id is None else dict(rel2id)}
 
         if reprocess or not self._load_preprocessed_file(): # Try to load pre-processed files:
             # Check files
@@ -115,148 +144,52 @@ class JSONFileDataLoader(FileDataLoader):
             if word_vec_file_name is None or not os.path.isfile(word_vec_file_name):
                 raise Exception("[ERROR] Word vector file doesn't exist")
 
-            # Load files
-            print("Loading data file...")
-            self.ori_data = json.load(open(self.file_name, "r"))
-            print("Finish loading")
-            print("Loading word vector file...")
-            self.ori_word_vec = json.load(open(self.word_vec_file_name, "r"))
-            print("Finish loading")
-            
-            # Eliminate case sensitive
-            if not case_sensitive:
-                print("Elimiating case sensitive problem...")
-                for relation in self.ori_data:
-                    for ins in self.ori_data[relation]:
-                        for i in range(len(ins['tokens'])):
-                            ins['tokens'][i] = ins['tokens'][i].lower()
-                print("Finish eliminating")
-
-      
             # Pre-process word vec
-            self.word2id = {}
-            self.word_vec_tot = len(self.ori_word_vec)
-            UNK = self.word_vec_tot
-            BLANK = self.word_vec_tot + 1
-            self.word_vec_dim = len(self.ori_word_vec[0]['vec'])
-            print("Got {} words of {} dims".format(self.word_vec_tot, self.word_vec_dim))
+            # Both json files are streamed, so the raw objects never need to be in memory at once
             print("Building word vector matrix and mapping...")
-            self.word_vec_mat = np.zeros((self.word_vec_tot, self.word_vec_dim), dtype=np.float32)
-            for cur_id, word in enumerate(self.ori_word_vec):
-                w = word['word']
-                if not case_sensitive:
-                    w = w.lower()
-                self.word2id[w] = cur_id
-                self.word_vec_mat[cur_id, :] = word['vec']
-                self.word_vec_mat[cur_id] = self.word_vec_mat[cur_id] / np.sqrt(np.sum(self.word_vec_mat[cur_id] ** 2))
-            self.word2id['UNK'] = UNK
-            self.word2id['BLANK'] = BLANK
+            self.word2id, self.word_vec_mat = preprocess.build_word_vec(preprocess.iter_json_list(self.word_vec_file_name), case_sensitive)
+            self.word_vec_tot, self.word_vec_dim = self.word_vec_mat.shape
+            print("Got {} words of {} dims".format(self.word_vec_tot, self.word_vec_dim))
             print("Finish building")
 
             # Pre-process data
             print("Pre-processing data...")
-            self.instance_tot = 0
-            for relation in self.ori_data:
-                self.instance_tot += len(self.ori_data[relation])
-            self.data_word = np.zeros((self.instance_tot, self.max_length), dtype=np.int32)
-            self.data_pos1 = np.zeros((self.instance_tot, self.max_length), dtype=np.int32)
-            self.data_pos2 = np.zeros((self.instance_tot, self.max_length), dtype=np.int32)
-            self.data_mask = np.zeros((self.instance_tot, self.max_length), dtype=np.int32)
-            self.data_length = np.zeros((self.instance_tot), dtype=np.int32)
-            self.data_label = np.zeros((self.instance_tot), dtype=np.int32)
-            self.data_entpair =[]
-            self.rel2scope = {} # left close right open
-            self.entpair2scope = {}
-            if rel2id is not None:
-                self.rel2id = rel2id
-                self.rel_tot = len(self.rel2id)
-            else:
-                self.rel2id = {}
-                self.rel_tot = 0
-            i = 0
-            for relation in self.ori_data:
-                self.rel2scope[relation] = [i, i]
-                if relation not in self.rel2id:
-                    self.rel2id[relation] = self.rel_tot
-                    self.rel_tot += 1
-                for ins in self.ori_data[relation]:
-                    if distant:
-                        head = ins['h']['name']
-                        tail = ins['t']['name']
-                        pos1 = ins['h']['pos'][0][0]
-                        pos2 = ins['t']['pos'][0][0]
-                    else:
-                        head = ins['h'][0]
-                        tail = ins['t'][0]
-                        pos1 = ins['h'][2][0][0]
-                        pos2 = ins['t'][2][0][0]
-                    words = ins['tokens']
-                    cur_ref_data_word = self.data_word[i]         
-                    entpair = head + '#' + tail
-                    self.data_entpair.append(entpair)
-
-                    for j, word in enumerate(words):
-                        if j < max_length:
-                            if word in self.word2id:
-                                cur_ref_data_word[j] = self.word2id[word]
-                            else:
-                                cur_ref_data_word[j] = UNK
-                    for j in range(j + 1, max_length):
-                        cur_ref_data_word[j] = BLANK
-                    self.data_length[i] = len(words)
-                    self.data_label[i] = self.rel2id[relation]
-                    if len(words) > max_length:
-                        self.data_length[i] = max_length
-                    if pos1 >= max_length:
-                        pos1 = max_length - 1
-                    if pos2 >= max_length:
-                        pos2 = max_length - 1
-                    pos_min = min(pos1, pos2)
-                    pos_max = max(pos1, pos2)
-                    for j in range(max_length):
-                        self.data_pos1[i][j] = j - pos1 + max_length
-                        self.data_pos2[i][j] = j - pos2 + max_length
-                        if j >= self.data_length[i]:
-                            self.data_mask[i][j] = 0
-                        elif j <= pos_min:
-                            self.data_mask[i][j] = 1
-                        elif j <= pos_max:
-                            self.data_mask[i][j] = 2
-                        else:
-                            self.data_mask[i][j] = 3
-                    if not entpair in self.entpair2scope:
-                        self.entpair2scope[entpair] = [i]
-                    else:
-                        self.entpair2scope[entpair].append(i)
-                    i += 1
-                self.rel2scope[relation][1] = i 
-
-            print("Finish pre-processing")     
-
-            print("Storing processed files...")
             name_prefix = '.'.join(file_name.split('/')[-1].split('.')[:-1])
-            word_vec_name_prefix = '.'.join(word_vec_file_name.split('/')[-1].split('.')[:-1])
             processed_data_dir = '_processed_data'
             if not os.path.isdir(processed_data_dir):
                 os.mkdir(processed_data_dir)
-            self.data_entpair = np.array(self.data_entpair)
-            np.save(os.path.join(processed_data_dir, name_prefix + '_word.npy'), self.data_word)
-            np.save(os.path.join(processed_data_dir, name_prefix + '_pos1.npy'), self.data_pos1)
-            np.save(os.path.join(processed_data_dir, name_prefix + '_pos2.npy'), self.data_pos2)
-            np.save(os.path.join(processed_data_dir, name_prefix + '_mask.npy'), self.data_mask)
-            np.save(os.path.join(processed_data_dir, name_prefix + '_length.npy'), self.data_length)
-            np.save(os.path.join(processed_data_dir, name_prefix + '_label.npy'), self.data_label)
-            np.save(os.path.join(processed_data_dir, name_prefix + '_entpair.npy'), self.data_entpair)
-            json.dump(self.rel2scope, open(os.path.join(processed_data_dir, name_prefix + '_rel2scope.json'), 'w'))
-            np.save(os.path.join(processed_data_dir, word_vec_name_prefix + '_mat.npy'), self.word_vec_mat)
-            json.dump(self.word2id, open(os.path.join(processed_data_dir, word_vec_name_prefix + '_word2id.json'), 'w'))
-            json.dump(self.rel2id, open(os.path.join(processed_data_dir, name_prefix + '_rel2id.json'), 'w'))
-            json.dump(self.entpair2scope, open(os.path.join(processed_data_dir, name_prefix + '_entpair2scope.json'), 'w'))
+            processed = preprocess.preprocess(self.file_name, self.word2id, max_length, case_sensitive=case_sensitive,
+                    distant=distant, rel2id=rel2id, num_workers=num_workers, shard_prefix=os.path.join(processed_data_dir, name_prefix), compact=compact,
+                    expand_positions=expand_positions)
+            for key in processed:
+                setattr(self, key, processed[key])
+            self.instance_tot = self.data_word.shape[0]
+            self.rel_tot = len(self.rel2id)
+            print("Finish pre-processing")     
+
+            print("Storing processed files...")
+            word_vec_name_prefix = '.'.join(word_vec_file_name.split('/')[-1].split('.')[:-1])
+            word_vec_source = container.source_signature(word_vec_file_name)
+            container.save(os.path.join(processed_data_dir, word_vec_name_prefix + '.nre'),
+                    {'source': word_vec_source, 'params': {'case_sensitive': case_sensitive}},
+                    {'mat': self.word_vec_mat}, {'word2id': self.word2id})
+            container.save(os.path.join(processed_data_dir, name_prefix + '.nre'),
+                    {'source': container.source_signature(file_name), 'params': dict(self.params, vocab=word_vec_source['sha1'])},
+                    dict({key[5:]: processed[key] for key in processed if key.startswith('data_') and key != 'data_entpair'}, **self.data_entpair.columns()),
+                    {'rel2scope': self.rel2scope, 'rel2id': self.rel2id})
             print("Finish storing")
+
+        if not expand_positions:
+            dtype = preprocess.compact_dtype(2 * max_length) if compact else np.int32
+            self.data_pos1 = preprocess.PositionFeature('pos1', self.data_head, self.data_tail, self.data_length, max_length, dtype)
+            self.data_pos2 = preprocess.PositionFeature('pos2', self.data_head, self.data_tail, self.data_length, max_length, dtype)
+            self.data_mask = preprocess.PositionFeature('mask', self.data_head, self.data_tail, self.data_length, max_length, np.uint8 if compact else np.int32)
         
         self.id2rel = {}
         for rel in self.rel2id:
             self.id2rel[self.rel2id[rel]] = rel
+        # [start, end) of each relation in rel2scope order, for sampling several relations at once
+        self.rel_scope = np.array([self.rel2scope[rel] for rel in self.rel2scope], dtype=np.int64).reshape(-1, 2)
         self.index = list(range(self.instance_tot))
         if self.shuffle:
             random.shuffle(self.index)
@@ -274,17 +207,12 @@ class JSONFileDataLoader(FileDataLoader):
         current_index = self.index[self.current:self.current+batch_size]
         self.current += batch_size
 
-        batch['word'] = Variable(torch.from_numpy(self.data_word[current_index]).long()) 
-        batch['pos1'] = Variable(torch.from_numpy(self.data_pos1[current_index]).long())
-        batch['pos2'] = Variable(torch.from_numpy(self.data_pos2[current_index]).long())
-        batch['mask'] = Variable(torch.from_numpy(self.data_mask[current_index]).long())
-        batch['label']= Variable(torch.from_numpy(self.data_label[current_index]).long())
-        batch['id'] = Variable(torch.from_numpy(self.uid[current_index]).long())
-
-        # To cuda
-        if self.cuda:
-            for key in batch:
-                batch[key] = batch[key].cuda()
+        batch['word'] = to_tensor(self.data_word[current_index], self.cuda) 
+        batch['pos1'] = to_tensor(self.data_pos1[current_index], self.cuda)
+        batch['pos2'] = to_tensor(self.data_pos2[current_index], self.cuda)
+        batch['mask'] = to_tensor(self.data_mask[current_index], self.cuda)
+        batch['label']= to_tensor(self.data_label[current_index], self.cuda)
+        batch['id'] = to_tensor(self.uid[current_index], self.cuda)
 
         return batch
 
@@ -298,17 +226,46 @@ class JSONFileDataLoader(FileDataLoader):
         current_index = self.index[self.current:self.current+batch_size]
         self.current += batch_size
 
-        batch['word'] = Variable(torch.from_numpy(self.data_word[current_index]).long()) 
-        batch['pos1'] = Variable(torch.from_numpy(self.data_pos1[current_index]).long())
-        batch['pos2'] = Variable(torch.from_numpy(self.data_pos2[current_index]).long())
-        batch['mask'] = Variable(torch.from_numpy(self.data_mask[current_index]).long())
-        batch['id'] = Variable(torch.from_numpy(self.uid[current_index]).long())
-        batch['label']= Variable(torch.from_numpy(self.data_label[current_index]).long())
+        batch['word'] = to_tensor(self.data_word[current_index], self.cuda) 
+        batch['pos1'] = to_tensor(self.data_pos1[current_index], self.cuda)
+        batch['pos2'] = to_tensor(self.data_pos2[current_index], self.cuda)
+        batch['mask'] = to_tensor(self.data_mask[current_index], self.cuda)
+        batch['id'] = to_tensor(self.uid[current_index], self.cuda)
+        batch['label']= to_tensor(self.data_label[current_index], self.cuda)
 
-        # To cuda
-        if self.cuda:
-            for key in batch:
-                batch[key] = batch[key].cuda()
+        return batch
+
+    def gather(self, index):
+        '''
+        index: int array of instance indices
+        return: dict of the numpy arrays of the instances (word, pos1, pos2, mask, id, entpair)
+        '''
+        data = {}
+        data['word'] = self.data_word[index]
+        data['pos1'] = self.data_pos1[index]
+        data['pos2'] = self.data_pos2[index]
+        data['mask'] = self.data_mask[index]
+        data['id'] = self.uid[index]
+        data['entpair'] = self.data_entpair[index]
+        return data
+
+    def next_multi_class(self, num_size, num_class):
+        '''
+        sample instances of several relations for training the siamese models
+        num_size: num of instances for each relation
+        num_class: num of relations, all different
+        return: batch of num_class * num_size instances, those of the same relation next to each other
+        '''
+        size = self.rel_scope[:, 1] - self.rel_scope[:, 0]
+        target_classes = np.random.choice(np.flatnonzero(size >= num_size), num_class, False)
+        indices = sampling.sample_scopes(self.rel_scope[target_classes, 0], size[target_classes], num_size).reshape(-1)
+        batch = {}
+        batch['word'] = to_tensor(self.data_word[indices], self.cuda)
+        batch['pos1'] = to_tensor(self.data_pos1[indices], self.cuda)
+        batch['pos2'] = to_tensor(self.data_pos2[indices], self.cuda)
+        batch['mask'] = to_tensor(self.data_mask[indices], self.cuda)
+        batch['label'] = to_tensor(self.data_label[indices], self.cuda)
+        batch['id'] = to_tensor(self.uid[indices], self.cuda)
 
         return batch
 
@@ -317,22 +274,63 @@ class JSONFileDataLoader(FileDataLoader):
         return instances with the same entpair
         entpair: a string with the format '$head_entity#$tail_entity'
         '''
-        if not entpair in self.entpair2scope:
+        # a contiguous slice of the entity pair index, found by binary search
+        scope = self.data_entpair.scope(entpair)
+        if scope is None:
             return None
-        scope = self.entpair2scope[entpair]
         batch = {}
-        batch['word'] = Variable(torch.from_numpy(self.data_word[scope]).long()) 
-        batch['pos1'] = Variable(torch.from_numpy(self.data_pos1[scope]).long())
-        batch['pos2'] = Variable(torch.from_numpy(self.data_pos2[scope]).long())
-        batch['mask'] = Variable(torch.from_numpy(self.data_mask[scope]).long())
-        batch['label']= Variable(torch.from_numpy(self.data_label[scope]).long())
-        batch['id'] = Variable(torch.from_numpy(self.uid[scope]).long())
+        batch['word'] = to_tensor(self.data_word[scope], self.cuda) 
+        batch['pos1'] = to_tensor(self.data_pos1[scope], self.cuda)
+        batch['pos2'] = to_tensor(self.data_pos2[scope], self.cuda)
+        batch['mask'] = to_tensor(self.data_mask[scope], self.cuda)
+        batch['label']= to_tensor(self.data_label[scope])
+        batch['id'] = to_tensor(self.uid[scope], self.cuda)
         batch['entpair'] = [entpair] * len(scope)
 
-        # To cuda
-        if self.cuda:
-            for key in ['word', 'pos1', 'pos2', 'mask', 'id']:
-                batch[key] = batch[key].cuda()
+        return batch
+
+    def get_same_entpair_ins_batch(self, entpairs, exclude_id=None, table=None):
+        '''
+        return the instances of several entpairs at once, as one batch gathered and moved to the device together
+        entpairs: list of strings with the format '$head_entity#$tail_entity'
+        exclude_id: uids of instances to leave out (e.g. those already in the support set), array or uidset.UidSet
+        table: entpair_table.EntpairTable of this data, the precomputed representations of the instances
+               are added as batch['repre']
+        return: batch of the instances of entpairs[0], then of entpairs[1], ..., and
+                batch['offset'], such that those of entpairs[i] are [offset[i], offset[i + 1])
+        '''
+        position, offset = self.data_entpair.positions(entpairs)
+        index = self.data_entpair.member[position].astype(np.int64)
+        if exclude_id is not None:
+            if isinstance(exclude_id, uidset.UidSet):
+                keep = ~exclude_id.contains(self.uid[index])
+            else:
+                keep = ~np.isin(self.uid[index], np.asarray(exclude_id, dtype=np.int64))
+            segment = np.repeat(np.arange(len(entpairs)), np.diff(offset))
+            position = position[keep]
+            index = index[keep]
+            offset = np.concatenate([[0], np.cumsum(np.bincount(segment[keep], minlength=len(entpairs)))]).astype(np.int64)
+        data = self.gather(index)
+        entpair = data.pop('entpair')
+        data['label'] = self.data_label[index]
+        batch = to_tensors(data, self.cuda)
+        batch['entpair'] = list(entpair)
+        batch['offset'] = offset
+        if table is not None:
+            batch['repre'] = table.lookup(position, self.uid[index], self.cuda)
+
+        return batch
+
+    def get_ins(self, index):
+        '''
+        return the instances of the given indices as a batch (e.g. the candidates of snowball phase 2
+        retrieved by an ann.IVFIndex)
+        index: int array of instance indices
+        '''
+        data = self.gather(index)
+        entpair = data.pop('entpair')
+        batch = to_tensors(data, self.cuda)
+        batch['entpair'] = list(entpair)
 
         return batch
 
@@ -352,7 +350,7 @@ class JSONFileDataLoader(FileDataLoader):
 
         for i, class_name in enumerate(target_classes):
             scope = self.rel2scope[class_name]
-            indices = np.random.choice(list(range(scope[0], scope[1])), min(num_ins_per_class, scope[1] - scope[0]), False)
+            indices = sampling.sample_scope(scope[0], scope[1], min(num_ins_per_class, scope[1] - scope[0]))
             candidate['word'].append(self.data_word[indices])
             candidate['pos1'].append(self.data_pos1[indices])
             candidate['pos2'].append(self.data_pos2[indices])
@@ -366,16 +364,11 @@ class JSONFileDataLoader(FileDataLoader):
         candidate['mask'] = np.concatenate(candidate['mask'], 0)
         candidate['id'] = np.concatenate(candidate['id'], 0)
 
-        candidate['word'] = Variable(torch.from_numpy(candidate['word']).long()) 
-        candidate['pos1'] = Variable(torch.from_numpy(candidate['pos1']).long())
-        candidate['pos2'] = Variable(torch.from_numpy(candidate['pos2']).long())
-        candidate['mask'] = Variable(torch.from_numpy(candidate['mask']).long())
-        candidate['id'] = Variable(torch.from_numpy(candidate['id']).long())
-
-        # To cuda
-        if self.cuda:
-            for key in ['word', 'pos1', 'pos2', 'mask', 'id']:
-                candidate[key] = candidate[key].cuda()
+        candidate['word'] = to_tensor(candidate['word'], self.cuda) 
+        candidate['pos1'] = to_tensor(candidate['pos1'], self.cuda)
+        candidate['pos2'] = to_tensor(candidate['pos2'], self.cuda)
+        candidate['mask'] = to_tensor(candidate['mask'], self.cuda)
+        candidate['id'] = to_tensor(candidate['id'], self.cuda)
 
         return candidate
    
@@ -396,7 +389,7 @@ class JSONFileDataLoader(FileDataLoader):
 
         # New relation
         scope = self.rel2scope[target_classes[0]]
-        indices = np.random.choice(list(range(scope[0], scope[1])), support_pos_size + query_size, False)
+        indices = sampling.sample_scope(scope[0], scope[1], support_pos_size + query_size)
         support_word, query_word, _ = np.split(self.data_word[indices], [support_pos_size, support_pos_size + query_size])
         support_pos1, query_pos1, _ = np.split(self.data_pos1[indices], [support_pos_size, support_pos_size + query_size])
         support_pos2, query_pos2, _ = np.split(self.data_pos2[indices], [support_pos_size, support_pos_size + query_size])
@@ -433,7 +426,7 @@ class JSONFileDataLoader(FileDataLoader):
 
         for i, class_name in enumerate(target_classes[1:]):
             scope = neg_loader.rel2scope[class_name]
-            indices = np.random.choice(list(range(scope[0], scope[1])), query_size, False)
+            indices = sampling.sample_scope(scope[0], scope[1], query_size)
             query['word'].append(neg_loader.data_word[indices])  
             query['pos1'].append(neg_loader.data_pos1[indices])    
             query['pos2'].append(neg_loader.data_pos2[indices])    
@@ -448,29 +441,25 @@ class JSONFileDataLoader(FileDataLoader):
         query['id'] = np.concatenate(query['id'], 0)
         query['label'] = np.array(query['label'])
 
-        support_pos['word'] = Variable(torch.from_numpy(support_pos['word']).long()) 
-        support_pos['pos1'] = Variable(torch.from_numpy(support_pos['pos1']).long())
-        support_pos['pos2'] = Variable(torch.from_numpy(support_pos['pos2']).long())
-        support_pos['mask'] = Variable(torch.from_numpy(support_pos['mask']).long())
-        support_pos['id'] = Variable(torch.from_numpy(support_pos['id']).long())
-        support_pos['label'] = Variable(torch.from_numpy(support_pos['label']).long())
-
-        support_neg['label'] = Variable(torch.from_numpy(support_neg['label']).long())
-
-        query['word'] = Variable(torch.from_numpy(query['word']).long()) 
-        query['pos1'] = Variable(torch.from_numpy(query['pos1']).long())
-        query['pos2'] = Variable(torch.from_numpy(query['pos2']).long())
-        query['mask'] = Variable(torch.from_numpy(query['mask']).long())
-        query['id'] = Variable(torch.from_numpy(query['id']).long())
-        query['label'] = Variable(torch.from_numpy(query['label']).long())
+        support_pos['word'] = to_tensor(support_pos['word'], self.cuda) 
+        support_pos['pos1'] = to_tensor(support_pos['pos1'], self.cuda)
+        support_pos['pos2'] = to_tensor(support_pos['pos2'], self.cuda)
+        support_pos['mask'] = to_tensor(support_pos['mask'], self.cuda)
+        support_pos['id'] = to_tensor(support_pos['id'], self.cuda)
+        support_pos['label'] = to_tensor(support_pos['label'], self.cuda)
 
-        # To cuda
+        support_neg['label'] = to_tensor(support_neg['label'], self.cuda)
+        # support_neg comes from the batches of neg_train_loader
         if self.cuda:
-            for key in ['word', 'pos1', 'pos2', 'mask', 'label', 'id']:
-                support_pos[key] = support_pos[key].cuda()
+            for key in ['word', 'pos1', 'pos2', 'mask', 'id']:
                 support_neg[key] = support_neg[key].cuda()
-                query[key] = query[key].cuda()
-            support_neg[key] = support_neg[key].cuda()
+
+        query['word'] = to_tensor(query['word'], self.cuda) 
+        query['pos1'] = to_tensor(query['pos1'], self.cuda)
+        query['pos2'] = to_tensor(query['pos2'], self.cuda)
+        query['mask'] = to_tensor(query['mask'], self.cuda)
+        query['id'] = to_tensor(query['id'], self.cuda)
+        query['label'] = to_tensor(query['label'], self.cuda)
 
         return support_pos, support_neg, query, target_classes[0]
 
@@ -484,113 +473,9 @@ class JSONFileDataLoader(FileDataLoader):
         query_class: num of classes in query set
         return: support_pos, support_neg, query, name_of_pos_class
         '''
-        target_classes = self.rel2scope.keys()
-        support_pos = {'word': [], 'pos1': [], 'pos2': [], 'mask': [], 'id': [], 'entpair': []}
-        support_neg = {'word': [], 'pos1': [], 'pos2': [], 'mask': [], 'id': [], 'entpair': [], 'label': []}
-        query = {'word': [], 'pos1': [], 'pos2': [], 'mask': [], 'label': [], 'entpair': [], 'id': []}
-
-        # New relation
-        scope = self.rel2scope[main_class]
-        indices = list(range(scope[0], scope[0] + support_pos_size + query_size))
-        support_word, query_word, _ = np.split(self.data_word[indices], [support_pos_size, support_pos_size + query_size])
-        support_pos1, query_pos1, _ = np.split(self.data_pos1[indices], [support_pos_size, support_pos_size + query_size])
-        support_pos2, query_pos2, _ = np.split(self.data_pos2[indices], [support_pos_size, support_pos_size + query_size])
-        support_mask, query_mask, _ = np.split(self.data_mask[indices], [support_pos_size, support_pos_size + query_size])
-        support_id, query_id, _ = np.split(self.uid[indices], [support_pos_size, support_pos_size + query_size])
-        support_entpair = list(self.data_entpair[indices[:support_pos_size]])
-        query['entpair'] += list(self.data_entpair[indices[support_pos_size:]])
-
-        # support_neg = train_data_loader.next_batch(support_pos_size * support_neg_rate)
-        # support_neg['label'] = np.zeros((support_neg_rate * support_pos_size), dtype=np.int32)
-        
-        if neg_train_loader is None:
-            neg_train_loader = train_data_loader
-        for i, class_name in enumerate(neg_train_loader.rel2scope.keys()[:support_neg_rate]):
-            scope = neg_train_loader.rel2scope[class_name]
-            support_neg['word'].append(neg_train_loader.data_word[scope[0]:scope[0]+support_pos_size])  
-            support_neg['pos1'].append(neg_train_loader.data_pos1[scope[0]:scope[0]+support_pos_size])    
-            support_neg['pos2'].append(neg_train_loader.data_pos2[scope[0]:scope[0]+support_pos_size])    
-            support_neg['mask'].append(neg_train_loader.data_mask[scope[0]:scope[0]+support_pos_size])
-            support_neg['id'].append(neg_train_loader.uid[scope[0]:scope[0]+support_pos_size])
-            support_neg['label'] += [0] * support_pos_size
-
-        support_neg['word'] = np.concatenate(support_neg['word'], 0)
-        support_neg['pos1'] = np.concatenate(support_neg['pos1'], 0)
-        support_neg['pos2'] = np.concatenate(support_neg['pos2'], 0)
-        support_neg['mask'] = np.concatenate(support_neg['mask'], 0)
-        support_neg['id'] = np.concatenate(support_neg['id'], 0)
-        support_neg['label'] = np.array(support_neg['label'])
-
-        support_pos['word'] = support_word
-        support_pos['pos1'] = support_pos1
-        support_pos['pos2'] = support_pos2
-        support_pos['mask'] = support_mask
-        support_pos['label'] = np.ones((support_pos_size), dtype=np.int32)
-        support_pos['id'] = support_id
-        support_pos['entpair'] = support_entpair
-
-        query['word'].append(query_word)
-        query['pos1'].append(query_pos1) 
-        query['pos2'].append(query_pos2)
-        query['mask'].append(query_mask)
-        query['id'].append(query_id)
-        query['label'] += [1] * query_size
-
-        # Other query classes (negative)
-        if use_train_neg:
-            neg_loader = train_data_loader
-            target_classes = random.sample(neg_loader.rel2scope.keys(), query_class) # discard 0 class 
-        else:
-            neg_loader = self
-
-        for i, class_name in enumerate(target_classes):
-            if class_name == main_class:
-                continue
-            scope = neg_loader.rel2scope[class_name]
-            query['word'].append(neg_loader.data_word[scope[0]+support_pos_size:scope[0]+support_pos_size+query_size])  
-            query['pos1'].append(neg_loader.data_pos1[scope[0]+support_pos_size:scope[0]+support_pos_size+query_size])    
-            query['pos2'].append(neg_loader.data_pos2[scope[0]+support_pos_size:scope[0]+support_pos_size+query_size])    
-            query['mask'].append(neg_loader.data_mask[scope[0]+support_pos_size:scope[0]+support_pos_size+query_size])
-            query['id'].append(neg_loader.uid[scope[0]+support_pos_size:scope[0]+support_pos_size+query_size])
-            query['label'] += [0] * query_size
-            query['entpair'] += list(neg_loader.data_entpair[scope[0]+support_pos_size:scope[0]+support_pos_size+query_size])
-
-        query['word'] = np.concatenate(query['word'], 0)
-        query['pos1'] = np.concatenate(query['pos1'], 0)
-        query['pos2'] = np.concatenate(query['pos2'], 0)
-        query['mask'] = np.concatenate(query['mask'], 0)
-        query['id'] = np.concatenate(query['id'], 0)
-        query['label'] = np.array(query['label'])
-
-        support_pos['word'] = Variable(torch.from_numpy(support_pos['word']).long()) 
-        support_pos['pos1'] = Variable(torch.from_numpy(support_pos['pos1']).long())
-        support_pos['pos2'] = Variable(torch.from_numpy(support_pos['pos2']).long())
-        support_pos['mask'] = Variable(torch.from_numpy(support_pos['mask']).long())
-        support_pos['id'] = Variable(torch.from_numpy(support_pos['id']).long())
-        support_pos['label'] = Variable(torch.from_numpy(support_pos['label']).long())
-
-        support_neg['word'] = Variable(torch.from_numpy(support_neg['word']).long()) 
-        support_neg['pos1'] = Variable(torch.from_numpy(support_neg['pos1']).long())
-        support_neg['pos2'] = Variable(torch.from_numpy(support_neg['pos2']).long())
-        support_neg['mask'] = Variable(torch.from_numpy(support_neg['mask']).long())
-        support_neg['id'] = Variable(torch.from_numpy(support_neg['id']).long())
-        support_neg['label'] = Variable(torch.from_numpy(support_neg['label']).long())
-
-        query['word'] = Variable(torch.from_numpy(query['word']).long()) 
-        query['pos1'] = Variable(torch.from_numpy(query['pos1']).long())
-        query['pos2'] = Variable(torch.from_numpy(query['pos2']).long())
-        query['mask'] = Variable(torch.from_numpy(query['mask']).long())
-        query['id'] = Variable(torch.from_numpy(query['id']).long())
-        query['label'] = Variable(torch.from_numpy(query['label']).long())
-
-        # To cuda
-        if self.cuda:
-            for key in ['word', 'pos1', 'pos2', 'mask', 'label', 'id']:
-                support_pos[key] = support_pos[key].cuda()
-                support_neg[key] = support_neg[key].cuda()
-                query[key] = query[key].cuda()
-
-        return support_pos, support_neg, query, main_class
+        plan = episode.draw_selected(self, train_data_loader, support_pos_size, support_neg_rate, query_size, query_class, [main_class],
+                use_train_neg=use_train_neg, neg_train_loader=neg_train_loader)
+        return episode.gather(plan, [self, train_data_loader, neg_train_loader or train_data_loader], cuda=self.cuda)[0]
 
     def next_fewshot_one(self, N, K, Q):
         target_classes = random.sample(self.rel2scope.keys(), N)
@@ -600,7 +485,7 @@ class JSONFileDataLoader(FileDataLoader):
 
         for i, class_name in enumerate(target_classes):
             scope = self.rel2scope[class_name]
-            indices = np.random.choice(list(range(scope[0], scope[1])), K + Q, False)
+            indices = sampling.sample_scope(scope[0], scope[1], K + Q)
             word = self.data_word[indices]
             pos1 = self.data_pos1[indices]
             pos2 = self.data_pos2[indices]
@@ -661,110 +546,32 @@ class JSONFileDataLoader(FileDataLoader):
             query['pos2'].append(current_query['pos2'])
             query['id'].append(current_query['id'])
             label.append(current_label)
-        support['word'] = Variable(torch.from_numpy(np.stack(support['word'], 0)).long().view(-1, self.max_length))
-        support['pos1'] = Variable(torch.from_numpy(np.stack(support['pos1'], 0)).long().view(-1, self.max_length)) 
-        support['pos2'] = Variable(torch.from_numpy(np.stack(support['pos2'], 0)).long().view(-1, self.max_length)) 
-        support['mask'] = Variable(torch.from_numpy(np.stack(support['mask'], 0)).long().view(-1, self.max_length)) 
-        support['id'] = Variable(torch.from_numpy(np.stack(support['id'], 0)).long().view(-1, self.max_length)) 
-        query['word'] = Variable(torch.from_numpy(np.stack(query['word'], 0)).long().view(-1, self.max_length)) 
-        query['pos1'] = Variable(torch.from_numpy(np.stack(query['pos1'], 0)).long().view(-1, self.max_length)) 
-        query['pos2'] = Variable(torch.from_numpy(np.stack(query['pos2'], 0)).long().view(-1, self.max_length)) 
-        query['mask'] = Variable(torch.from_numpy(np.stack(query['mask'], 0)).long().view(-1, self.max_length)) 
-        query['id'] = Variable(torch.from_numpy(np.stack(query['id'], 0)).long().view(-1, self.max_length)) 
-        label = Variable(torch.from_numpy(np.stack(label, 0).astype(np.int64)).long())
+        support['word'] = to_tensor(np.stack(support['word'], 0), self.cuda).view(-1, self.max_length)
+        support['pos1'] = to_tensor(np.stack(support['pos1'], 0), self.cuda).view(-1, self.max_length) 
+        support['pos2'] = to_tensor(np.stack(support['pos2'], 0), self.cuda).view(-1, self.max_length) 
+        support['mask'] = to_tensor(np.stack(support['mask'], 0), self.cuda).view(-1, self.max_length) 
+        support['id'] = to_tensor(np.stack(support['id'], 0), self.cuda).view(-1, self.max_length) 
+        query['word'] = to_tensor(np.stack(query['word'], 0), self.cuda).view(-1, self.max_length) 
+        query['pos1'] = to_tensor(np.stack(query['pos1'], 0), self.cuda).view(-1, self.max_length) 
+        query['pos2'] = to_tensor(np.stack(query['pos2'], 0), self.cuda).view(-1, self.max_length) 
+        query['mask'] = to_tensor(np.stack(query['mask'], 0), self.cuda).view(-1, self.max_length) 
+        query['id'] = to_tensor(np.stack(query['id'], 0), self.cuda).view(-1, self.max_length) 
+        label = to_tensor(np.stack(label, 0).astype(np.int64), self.cuda)
         
-        # To cuda
-        if self.cuda:
-            for key in support:
-                support[key] = support[key].cuda()
-            for key in query:
-                query[key] = query[key].cuda()
-            label = label.cuda()
 
         return support, query, label
 
-    def sample_for_eval(self, train_data_loader, support_pos_size, query_size, target_class=None, query_train=True, query_val=True): 
-        if target_class is None:
-            target_class = random.sample(self.rel2scope.keys(), 1)[0] 
-        support_pos = {'word': [], 'pos1': [], 'pos2': [], 'mask': [], 'id': [], 'entpair': []}
-        query = {'word': [], 'pos1': [], 'pos2': [], 'mask': [], 'id': [], 'label': []}
-
-        # New relation
-        scope = self.rel2scope[target_class]
-        indices = np.random.choice(list(range(scope[0], scope[1])), support_pos_size + query_size, False)
-        support_word, query_word, _ = np.split(self.data_word[indices], [support_pos_size, support_pos_size + query_size])
-        support_pos1, query_pos1, _ = np.split(self.data_pos1[indices], [support_pos_size, support_pos_size + query_size])
-        support_pos2, query_pos2, _ = np.split(self.data_pos2[indices], [support_pos_size, support_pos_size + query_size])
-        support_mask, query_mask, _ = np.split(self.data_mask[indices], [support_pos_size, support_pos_size + query_size])
-        support_id, query_id, _ = np.split(self.uid[indices], [support_pos_size, support_pos_size + query_size])
-        support_entpair = list(self.data_entpair[indices[:support_pos_size]])
-        
-        support_pos['word'] = support_word
-        support_pos['pos1'] = support_pos1
-        support_pos['pos2'] = support_pos2
-        support_pos['mask'] = support_mask
-        support_pos['label'] = np.ones((support_pos_size), dtype=np.int32)
-        support_pos['id'] = support_id
-        support_pos['entpair'] = support_entpair
-
-        query['word'].append(query_word)
-        query['pos1'].append(query_pos1) 
-        query['pos2'].append(query_pos2)
-        query['mask'].append(query_mask)
-        query['id'].append(query_id)
-        query['label'] += [1] * query_size
-
-        # from train data loader
-        if query_train:
-            for i, class_name in enumerate(train_data_loader.rel2scope.keys()):
-                scope = train_data_loader.rel2scope[class_name]
-                indices = np.random.choice(list(range(scope[0], scope[1])), query_size, False)
-                query['word'].append(train_data_loader.data_word[indices])  
-                query['pos1'].append(train_data_loader.data_pos1[indices])    
-                query['pos2'].append(train_data_loader.data_pos2[indices])    
-                query['mask'].append(train_data_loader.data_mask[indices])
-                query['id'].append(train_data_loader.uid[indices])
-                query['label'] += [0] * query_size
-        # from current data loader
-        if query_val:
-            for i, class_name in enumerate(self.rel2scope.keys()):
-                if class_name == target_class:
-                    continue
-                scope = self.rel2scope[class_name]
-                indices = np.random.choice(list(range(scope[0], scope[1])), query_size, False)
-                query['word'].append(self.data_word[indices])  
-                query['pos1'].append(self.data_pos1[indices])    
-                query['pos2'].append(self.data_pos2[indices])    
-                query['mask'].append(self.data_mask[indices])
-                query['id'].append(self.uid[indices])
-                query['label'] += [0] * query_size
-
-        query['word'] = np.concatenate(query['word'], 0)
-        query['pos1'] = np.concatenate(query['pos1'], 0)
-        query['pos2'] = np.concatenate(query['pos2'], 0)
-        query['mask'] = np.concatenate(query['mask'], 0)
-        query['id'] = np.concatenate(query['id'], 0)
-        query['label'] = np.array(query['label'])
-
-        support_pos['word'] = Variable(torch.from_numpy(support_pos['word']).long()) 
-        support_pos['pos1'] = Variable(torch.from_numpy(support_pos['pos1']).long())
-        support_pos['pos2'] = Variable(torch.from_numpy(support_pos['pos2']).long())
-        support_pos['mask'] = Variable(torch.from_numpy(support_pos['mask']).long())
-        support_pos['id'] = Variable(torch.from_numpy(support_pos['id']).long())
-        support_pos['label'] = Variable(torch.from_numpy(support_pos['label']).long())
-
-        query['word'] = Variable(torch.from_numpy(query['word']).long()) 
-        query['pos1'] = Variable(torch.from_numpy(query['pos1']).long())
-        query['pos2'] = Variable(torch.from_numpy(query['pos2']).long())
-        query['mask'] = Variable(torch.from_numpy(query['mask']).long())
-        query['id'] = Variable(torch.from_numpy(query['id']).long())
-        query['label'] = Variable(torch.from_numpy(query['label']).long())
-
-        # To cuda
-        if self.cuda:
-            for key in ['word', 'pos1', 'pos2', 'mask', 'label', 'id']:
-                support_pos[key] = support_pos[key].cuda()
-                query[key] = query[key].cuda()
-
-        return support_pos, query, target_class
+    def sample_eval_episodes(self, train_data_loader, support_pos_size, query_size, num_episodes, target_classes=None, query_train=True, query_val=True):
+        '''
+        sample several episodes as sample_for_eval does, at once (see episode.draw_eval and episode.gather)
+        num_episodes: num of episodes
+        target_classes: names of the new relations of the episodes, random if None
+        return: list of (support_pos, query, target_class)
+        '''
+        plan = episode.draw_eval(self, train_data_loader, support_pos_size, query_size, num_episodes, target_classes,
+                query_train=query_train, query_val=query_val)
+        return episode.gather(plan, [self, train_data_loader], cuda=self.cuda)
 
+    def sample_for_eval(self, train_data_loader, support_pos_size, query_size, target_class=None, query_train=True, query_val=True): 
+        return self.sample_eval_episodes(train_data_loader, support_pos_size, query_size, 1, None if target_class is None else [target_class],
+                query_train=query_train, query_val=query_val)[0]
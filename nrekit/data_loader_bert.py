@@ -5,6 +5,12 @@ import numpy as np
 import random
 import torch
 from torch.autograd import Variable
+from . import preprocess
+from . import container
+from . import sampling
+from . import episode
+from . import uidset
+from .data_loader import to_tensor, to_tensors
 
 from pytorch_pretrained_bert import BertTokenizer, BertModel, BertForMaskedLM
 
@@ -22,45 +28,32 @@ class FileDataLoader:
 class JSONFileDataLoaderBERT(FileDataLoader):
     def _load_preprocessed_file(self):
         name_prefix = '.'.join(self.file_name.split('/')[-1].split('.')[:-1])
-        self.uid = np.load('./data/' + name_prefix + '_uid.npy')
+        # read-only memory maps share their pages across processes through the page cache
+        mmap_mode = 'r' if self.mmap else None
+        self.uid = np.load('./data/' + name_prefix + '_uid.npy', mmap_mode=mmap_mode)
         processed_data_dir = '_processed_data/bert'
-        if not os.path.isdir(processed_data_dir):
-            return False
-        word_npy_file_name = os.path.join(processed_data_dir, name_prefix + '_word.npy')
-        mask_npy_file_name = os.path.join(processed_data_dir, name_prefix + '_mask.npy')
-        length_npy_file_name = os.path.join(processed_data_dir, name_prefix + '_length.npy')
-        label_npy_file_name = os.path.join(processed_data_dir, name_prefix + '_label.npy')
-        entpair_npy_file_name = os.path.join(processed_data_dir, name_prefix + '_entpair.npy')
-        rel2scope_file_name = os.path.join(processed_data_dir, name_prefix + '_rel2scope.json')
-        rel2id_file_name = os.path.join(processed_data_dir, name_prefix + '_rel2id.json')
-        entpair2scope_file_name = os.path.join(processed_data_dir, name_prefix + '_entpair2scope.json')
-        if not os.path.exists(word_npy_file_name) or \
-           not os.path.exists(mask_npy_file_name) or \
-           not os.path.exists(length_npy_file_name) or \
-           not os.path.exists(label_npy_file_name) or \
-           not os.path.exists(entpair_npy_file_name) or \
-           not os.path.exists(rel2scope_file_name) or \
-           not os.path.exists(rel2id_file_name) or \
-           not os.path.exists(entpair2scope_file_name):
+        data = container.load(os.path.join(processed_data_dir, name_prefix + '.nre'), copy=not self.mmap)
+        if data is None:
             return False
         print("Pre-processed files exist. Loading them...")
-        self.data_word = np.load(word_npy_file_name)
-        self.data_mask = np.load(mask_npy_file_name)
-        self.data_length = np.load(length_npy_file_name)
-        self.data_label = np.load(label_npy_file_name)
-        self.data_entpair = np.load(entpair_npy_file_name)
-        self.rel2scope = json.load(open(rel2scope_file_name))
-        self.rel2id = json.load(open(rel2id_file_name))
-        self.entpair2scope = json.load(open(entpair2scope_file_name))
+        header, columns, sections = data
+        if header['params'] != self.params or \
+           (os.path.isfile(self.file_name) and not container.source_matches(header['source'], self.file_name)) or \
+           'entpair_id' not in columns:
+            print("Pre-processed files don't match current settings or source files. Reprocessing...")
+            return False
+        for key in columns:
+            if not key.startswith('entpair_'):
+                setattr(self, 'data_' + key, columns[key])
+        self.data_entpair = preprocess.EntpairIndex.from_columns(columns)
+        self.rel2scope = sections['rel2scope']
+        self.rel2id = sections['rel2id']
         self.instance_tot = self.data_word.shape[0]
         self.rel_tot = len(self.rel2id)
-        if self.data_word.shape[1] != self.max_length:
-            print("Pre-processed files don't match current settings. Reprocessing...")
-            return False
         print("Finish loading")
         return True
 
-    def __init__(self, file_name, vocab, max_length=40, case_sensitive=False, reprocess=False, cuda=True, distant=False, rel2id=None, shuffle=True):
+    def __init__(self, file_name, vocab, max_length=40, case_sensitive=False, reprocess=False, cuda=True, distant=False, rel2id=None, shuffle=True, num_workers=1, mmap=False, compact=True, dynamic_padding=False):
         '''
         file_name: Json file storing the data in the following format
             {
@@ -83,112 +76,29 @@ class JSONFileDataLoaderBERT(FileDataLoader):
         case_sensitive: Whether the data processing is case-sensitive, default as False.
         reprocess: Do the pre-processing whether there exist pre-processed files, default as False.
         cuda: Use cuda or not, default as True.
+        num_workers: Num of processes for pre-processing (tokenization), default as 1. With more than one, the processes parse and tokenize parts of the data file in parallel.
+        mmap: Memory-map the pre-processed files instead of reading them into memory, default as False.
+        compact: Store the pre-processed arrays with the smallest dtypes holding them (widened to int64 on the device), default as True.
+        dynamic_padding: Let next_batch_one_epoch group sentences of similar length and cut each batch to its longest sentence, default as False.
         '''
         self.file_name = file_name
         self.case_sensitive = case_sensitive
         self.max_length = max_length
         self.cuda = cuda
         self.shuffle = shuffle
+        self.mmap = mmap
+        self.dynamic_padding = dynamic_padding
+        # everything the pre-processed data depends on besides the source file, checked when loading it
+        self.params = {'max_length': max_length, 'case_sensitive': case_sensitive, 'distant': distant, 'compact': compact, 'rel2id': None if rel2id is None else dict(rel2id),
+                'vocab': container.file_hash(vocab) if os.path.isfile(vocab) else vocab}
 
         if reprocess or not self._load_preprocessed_file(): # Try to load pre-processed files:
             # Check files
             if file_name is None or not os.path.isfile(file_name):
                 raise Exception("[ERROR] Data file doesn't exist")
 
-            # Load files
-            print("Loading data file...")
-            self.ori_data = json.load(open(self.file_name, "r"))
-            print("Finish loading")
-            print("Loading word vector file...")
-            print("Finish loading")
-            
-            # Eliminate case sensitive
-            if not case_sensitive:
-                print("Elimiating case sensitive problem...")
-                for relation in self.ori_data:
-                    for ins in self.ori_data[relation]:
-                        for i in range(len(ins['tokens'])):
-                            ins['tokens'][i] = ins['tokens'][i].lower()
-                print("Finish eliminating")
-
             # Pre-process data
             print("Pre-processing data...")
-            self.instance_tot = 0
-            for relation in self.ori_data:
-                self.instance_tot += len(self.ori_data[relation])
-            self.data_word = np.zeros((self.instance_tot, self.max_length), dtype=np.int32)
-            self.data_mask = np.zeros((self.instance_tot, self.max_length), dtype=np.int32)
-            self.data_length = np.zeros((self.instance_tot), dtype=np.int32)
-            self.data_label = np.zeros((self.instance_tot), dtype=np.int32)
-            self.data_entpair =[]
-            self.rel2scope = {} # left close right open
-            self.entpair2scope = {}
-            if rel2id is not None:
-                self.rel2id = rel2id
-                self.rel_tot = len(self.rel2id)
-            else:
-                self.rel2id = {}
-                self.rel_tot = 0
-            i = 0
-
-            tokenizer = BertTokenizer.from_pretrained(vocab)
-
-            for relation in self.ori_data:
-                self.rel2scope[relation] = [i, i]
-                if relation not in self.rel2id:
-                    self.rel2id[relation] = self.rel_tot
-                    self.rel_tot += 1
-                for ins in self.ori_data[relation]:
-                    if distant:
-                        head = ins['h']['name']
-                        tail = ins['t']['name']
-                        pos1 = ins['h']['pos'][0][0]
-                        pos2 = ins['t']['pos'][0][0]
-                        pos1_end = ins['h']['pos'][0][-1]
-                        pos2_end = ins['t']['pos'][0][-1]
-                    else:
-                        head = ins['h'][0]
-                        tail = ins['t'][0]
-                        pos1 = ins['h'][2][0][0]
-                        pos2 = ins['t'][2][0][0]
-                        pos1_end = ins['h'][2][0][-1]
-                        pos2_end = ins['t'][2][0][-1]
-                    words = ins['tokens']
-                    entpair = head + '#' + tail
-                    self.data_entpair.append(entpair)
-
-                    # tokenize
-                    # # head entity # @ tail entity @
-                    if pos1 < pos2:
-                        new_words = ['[CLS]'] + words[:pos1] + ['#'] + words[pos1:pos1_end+1] + ['#'] + words[pos1_end+1:pos2] \
-                                + ['@'] + words[pos2:pos2_end+1] + ['@'] + words[pos2_end+1:]
-                    else:
-                        new_words = ['[CLS]'] + words[:pos2] + ['@'] + words[pos2:pos2_end+1] + ['@'] + words[pos2_end+1:pos1] \
-                                + ['#'] + words[pos1:pos1_end+1] + ['#'] + words[pos1_end+1:]
-                    sentence = ' '.join(new_words)
-                    tmp = tokenizer.convert_tokens_to_ids(tokenizer.tokenize(sentence))
-                    self.data_length[i] = min(len(tmp), max_length)
-                    if len(tmp) < max_length:
-                        self.data_mask[i][:len(tmp)] = 1
-                        tmp += [0] * (max_length - len(tmp))
-                    else:
-                        tmp = tmp[:max_length]
-                        self.data_mask[i][:] = 1
-                    self.data_word[i][:] = np.array(tmp)
-                    
-                    self.data_label[i] = self.rel2id[relation]
-                    if len(words) > max_length:
-                        self.data_length[i] = max_length
-                    if not entpair in self.entpair2scope:
-                        self.entpair2scope[entpair] = [i]
-                    else:
-                        self.entpair2scope[entpair].append(i)
-                    i += 1
-                self.rel2scope[relation][1] = i 
-
-            print("Finish pre-processing")     
-
-            print("Storing processed files...")
             name_prefix = '.'.join(file_name.split('/')[-1].split('.')[:-1])
             processed_data_dir = '_processed_data'
             if not os.path.isdir(processed_data_dir):
@@ -196,26 +106,58 @@ class JSONFileDataLoaderBERT(FileDataLoader):
             processed_data_dir = '_processed_data/bert'
             if not os.path.isdir(processed_data_dir):
                 os.mkdir(processed_data_dir)
-            self.data_entpair = np.array(self.data_entpair)
-            np.save(os.path.join(processed_data_dir, name_prefix + '_word.npy'), self.data_word)
-            np.save(os.path.join(processed_data_dir, name_prefix + '_mask.npy'), self.data_mask)
-            np.save(os.path.join(processed_data_dir, name_prefix + '_length.npy'), self.data_length)
-            np.save(os.path.join(processed_data_dir, name_prefix + '_label.npy'), self.data_label)
-            np.save(os.path.join(processed_data_dir, name_prefix + '_entpair.npy'), self.data_entpair)
-            json.dump(self.rel2scope, open(os.path.join(processed_data_dir, name_prefix + '_rel2scope.json'), 'w'))
-            json.dump(self.rel2id, open(os.path.join(processed_data_dir, name_prefix + '_rel2id.json'), 'w'))
-            json.dump(self.entpair2scope, open(os.path.join(processed_data_dir, name_prefix + '_entpair2scope.json'), 'w'))
+            tokenizer = BertTokenizer.from_pretrained(vocab)
+            # The json file is streamed, so the raw object never needs to be in memory at once
+            processed = preprocess.preprocess_bert(self.file_name, tokenizer, max_length, case_sensitive=case_sensitive,
+                    distant=distant, rel2id=rel2id, num_workers=num_workers, shard_prefix=os.path.join(processed_data_dir, name_prefix), compact=compact)
+            for key in processed:
+                setattr(self, key, processed[key])
+            self.instance_tot = self.data_word.shape[0]
+            self.rel_tot = len(self.rel2id)
+            print("Finish pre-processing")     
+
+            print("Storing processed files...")
+            container.save(os.path.join(processed_data_dir, name_prefix + '.nre'),
+                    {'source': container.source_signature(file_name), 'params': self.params},
+                    dict({key[5:]: processed[key] for key in processed if key.startswith('data_') and key != 'data_entpair'}, **self.data_entpair.columns()),
+                    {'rel2scope': self.rel2scope, 'rel2id': self.rel2id})
             print("Finish storing")
         
         self.id2rel = {}
         for rel in self.rel2id:
             self.id2rel[self.rel2id[rel]] = rel
+        # [start, end) of each relation in rel2scope order, for sampling several relations at once
+        self.rel_scope = np.array([self.rel2scope[rel] for rel in self.rel2scope], dtype=np.int64).reshape(-1, 2)
         self.index = list(range(self.instance_tot))
         if self.shuffle:
             random.shuffle(self.index)
         self.current = 0
 
+    def _length_bucketed_index(self, batch_size, pool_size=100):
+        '''
+        order the instances so that consecutive batches hold sentences of similar length.
+        With shuffle, the instances are shuffled, sorted by length within pools of pool_size batches,
+        and the resulting batches are shuffled again (the last, incomplete one stays last).
+        Without shuffle, the instances keep their order (e.g. for predictions saved in file order)
+        and the batches are only cut.
+        '''
+        index = np.arange(self.instance_tot)
+        if not self.shuffle:
+            return index
+        random.shuffle(index)
+        pool_size *= batch_size
+        batches = []
+        for i in range(0, len(index), pool_size):
+            pool = index[i:i+pool_size]
+            pool = pool[np.argsort(self.data_length[pool], kind='stable')]
+            batches += [pool[j:j+batch_size] for j in range(0, len(pool), batch_size)]
+        last = [batches.pop()] if batches and len(batches[-1]) < batch_size else []
+        random.shuffle(batches)
+        return np.concatenate(batches + last)
+
     def next_batch_one_epoch(self, batch_size):
+        if self.current == 0 and self.dynamic_padding:
+            self.index = self._length_bucketed_index(batch_size)
         if self.current >= len(self.index):
             if self.shuffle:
                 random.shuffle(self.index)
@@ -227,15 +169,16 @@ class JSONFileDataLoaderBERT(FileDataLoader):
         current_index = self.index[self.current:self.current+batch_size]
         self.current += batch_size
 
-        batch['word'] = Variable(torch.from_numpy(self.data_word[current_index]).long()) 
-        batch['mask'] = Variable(torch.from_numpy(self.data_mask[current_index]).long())
-        batch['label']= Variable(torch.from_numpy(self.data_label[current_index]).long())
-        batch['id'] = Variable(torch.from_numpy(self.uid[current_index]).long())
-
-        # To cuda
-        if self.cuda:
-            for key in batch:
-                batch[key] = batch[key].cuda()
+        if self.dynamic_padding:
+            # the columns past the longest sentence are padding (mask 0) in the whole batch
+            width = int(self.data_length[current_index].max())
+            batch['word'] = to_tensor(self.data_word[current_index, :width], self.cuda)
+            batch['mask'] = to_tensor(self.data_mask[current_index, :width], self.cuda)
+        else:
+            batch['word'] = to_tensor(self.data_word[current_index], self.cuda) 
+            batch['mask'] = to_tensor(self.data_mask[current_index], self.cuda)
+        batch['label']= to_tensor(self.data_label[current_index], self.cuda)
+        batch['id'] = to_tensor(self.uid[current_index], self.cuda)
 
         return batch
 
@@ -249,15 +192,40 @@ class JSONFileDataLoaderBERT(FileDataLoader):
         current_index = self.index[self.current:self.current+batch_size]
         self.current += batch_size
 
-        batch['word'] = Variable(torch.from_numpy(self.data_word[current_index]).long()) 
-        batch['mask'] = Variable(torch.from_numpy(self.data_mask[current_index]).long())
-        batch['id'] = Variable(torch.from_numpy(self.uid[current_index]).long())
-        batch['label']= Variable(torch.from_numpy(self.data_label[current_index]).long())
+        batch['word'] = to_tensor(self.data_word[current_index], self.cuda) 
+        batch['mask'] = to_tensor(self.data_mask[current_index], self.cuda)
+        batch['id'] = to_tensor(self.uid[current_index], self.cuda)
+        batch['label']= to_tensor(self.data_label[current_index], self.cuda)
 
-        # To cuda
-        if self.cuda:
-            for key in batch:
-                batch[key] = batch[key].cuda()
+        return batch
+
+    def gather(self, index):
+        '''
+        index: int array of instance indices
+        return: dict of the numpy arrays of the instances (word, mask, id, entpair)
+        '''
+        data = {}
+        data['word'] = self.data_word[index]
+        data['mask'] = self.data_mask[index]
+        data['id'] = self.uid[index]
+        data['entpair'] = self.data_entpair[index]
+        return data
+
+    def next_multi_class(self, num_size, num_class):
+        '''
+        sample instances of several relations for training the siamese models
+        num_size: num of instances for each relation
+        num_class: num of relations, all different
+        return: batch of num_class * num_size instances, those of the same relation next to each other
+        '''
+        size = self.rel_scope[:, 1] - self.rel_scope[:, 0]
+        target_classes = np.random.choice(np.flatnonzero(size >= num_size), num_class, False)
+        indices = sampling.sample_scopes(self.rel_scope[target_classes, 0], size[target_classes], num_size).reshape(-1)
+        batch = {}
+        batch['word'] = to_tensor(self.data_word[indices], self.cuda)
+        batch['mask'] = to_tensor(self.data_mask[indices], self.cuda)
+        batch['label'] = to_tensor(self.data_label[indices], self.cuda)
+        batch['id'] = to_tensor(self.uid[indices], self.cuda)
 
         return batch
 
@@ -266,20 +234,61 @@ class JSONFileDataLoaderBERT(FileDataLoader):
         return instances with the same entpair
         entpair: a string with the format '$head_entity#$tail_entity'
         '''
-        if not entpair in self.entpair2scope:
+        # a contiguous slice of the entity pair index, found by binary search
+        scope = self.data_entpair.scope(entpair)
+        if scope is None:
             return None
-        scope = self.entpair2scope[entpair]
         batch = {}
-        batch['word'] = Variable(torch.from_numpy(self.data_word[scope]).long()) 
-        batch['mask'] = Variable(torch.from_numpy(self.data_mask[scope]).long())
-        batch['label']= Variable(torch.from_numpy(self.data_label[scope]).long())
-        batch['id'] = Variable(torch.from_numpy(self.uid[scope]).long())
+        batch['word'] = to_tensor(self.data_word[scope], self.cuda) 
+        batch['mask'] = to_tensor(self.data_mask[scope], self.cuda)
+        batch['label']= to_tensor(self.data_label[scope])
+        batch['id'] = to_tensor(self.uid[scope], self.cuda)
         batch['entpair'] = [entpair] * len(scope)
 
-        # To cuda
-        if self.cuda:
-            for key in ['word', 'mask', 'id']:
-                batch[key] = batch[key].cuda()
+        return batch
+
+    def get_same_entpair_ins_batch(self, entpairs, exclude_id=None, table=None):
+        '''
+        return the instances of several entpairs at once, as one batch gathered and moved to the device together
+        entpairs: list of strings with the format '$head_entity#$tail_entity'
+        exclude_id: uids of instances to leave out (e.g. those already in the support set), array or uidset.UidSet
+        table: entpair_table.EntpairTable of this data, the precomputed representations of the instances
+               are added as batch['repre']
+        return: batch of the instances of entpairs[0], then of entpairs[1], ..., and
+                batch['offset'], such that those of entpairs[i] are [offset[i], offset[i + 1])
+        '''
+        position, offset = self.data_entpair.positions(entpairs)
+        index = self.data_entpair.member[position].astype(np.int64)
+        if exclude_id is not None:
+            if isinstance(exclude_id, uidset.UidSet):
+                keep = ~exclude_id.contains(self.uid[index])
+            else:
+                keep = ~np.isin(self.uid[index], np.asarray(exclude_id, dtype=np.int64))
+            segment = np.repeat(np.arange(len(entpairs)), np.diff(offset))
+            position = position[keep]
+            index = index[keep]
+            offset = np.concatenate([[0], np.cumsum(np.bincount(segment[keep], minlength=len(entpairs)))]).astype(np.int64)
+        data = self.gather(index)
+        entpair = data.pop('entpair')
+        data['label'] = self.data_label[index]
+        batch = to_tensors(data, self.cuda)
+        batch['entpair'] = list(entpair)
+        batch['offset'] = offset
+        if table is not None:
+            batch['repre'] = table.lookup(position, self.uid[index], self.cuda)
+
+        return batch
+
+    def get_ins(self, index):
+        '''
+        return the instances of the given indices as a batch (e.g. the candidates of snowball phase 2
+        retrieved by an ann.IVFIndex)
+        index: int array of instance indices
+        '''
+        data = self.gather(index)
+        entpair = data.pop('entpair')
+        batch = to_tensors(data, self.cuda)
+        batch['entpair'] = list(entpair)
 
         return batch
 
@@ -299,7 +308,7 @@ class JSONFileDataLoaderBERT(FileDataLoader):
 
         for i, class_name in enumerate(target_classes):
             scope = self.rel2scope[class_name]
-            indices = np.random.choice(list(range(scope[0], scope[1])), min(num_ins_per_class, scope[1] - scope[0]), False)
+            indices = sampling.sample_scope(scope[0], scope[1], min(num_ins_per_class, scope[1] - scope[0]))
             candidate['word'].append(self.data_word[indices])
             candidate['mask'].append(self.data_mask[indices])
             candidate['id'].append(self.uid[indices])
@@ -309,14 +318,9 @@ class JSONFileDataLoaderBERT(FileDataLoader):
         candidate['mask'] = np.concatenate(candidate['mask'], 0)
         candidate['id'] = np.concatenate(candidate['id'], 0)
 
-        candidate['word'] = Variable(torch.from_numpy(candidate['word']).long()) 
-        candidate['mask'] = Variable(torch.from_numpy(candidate['mask']).long())
-        candidate['id'] = Variable(torch.from_numpy(candidate['id']).long())
-
-        # To cuda
-        if self.cuda:
-            for key in ['word', 'mask', 'id']:
-                candidate[key] = candidate[key].cuda()
+        candidate['word'] = to_tensor(candidate['word'], self.cuda) 
+        candidate['mask'] = to_tensor(candidate['mask'], self.cuda)
+        candidate['id'] = to_tensor(candidate['id'], self.cuda)
 
         return candidate
    
@@ -337,7 +341,7 @@ class JSONFileDataLoaderBERT(FileDataLoader):
 
         # New relation
         scope = self.rel2scope[target_classes[0]]
-        indices = np.random.choice(list(range(scope[0], scope[1])), support_pos_size + query_size, False)
+        indices = sampling.sample_scope(scope[0], scope[1], support_pos_size + query_size)
         support_word, query_word, _ = np.split(self.data_word[indices], [support_pos_size, support_pos_size + query_size])
         support_mask, query_mask, _ = np.split(self.data_mask[indices], [support_pos_size, support_pos_size + query_size])
         support_id, query_id, _ = np.split(self.uid[indices], [support_pos_size, support_pos_size + query_size])
@@ -368,7 +372,7 @@ class JSONFileDataLoaderBERT(FileDataLoader):
 
         for i, class_name in enumerate(target_classes[1:]):
             scope = neg_loader.rel2scope[class_name]
-            indices = np.random.choice(list(range(scope[0], scope[1])), query_size, False)
+            indices = sampling.sample_scope(scope[0], scope[1], query_size)
             query['word'].append(neg_loader.data_word[indices])  
             query['mask'].append(neg_loader.data_mask[indices])
             query['id'].append(neg_loader.uid[indices])
@@ -379,25 +383,21 @@ class JSONFileDataLoaderBERT(FileDataLoader):
         query['id'] = np.concatenate(query['id'], 0)
         query['label'] = np.array(query['label'])
 
-        support_pos['word'] = Variable(torch.from_numpy(support_pos['word']).long()) 
-        support_pos['mask'] = Variable(torch.from_numpy(support_pos['mask']).long())
-        support_pos['id'] = Variable(torch.from_numpy(support_pos['id']).long())
-        support_pos['label'] = Variable(torch.from_numpy(support_pos['label']).long())
+        support_pos['word'] = to_tensor(support_pos['word'], self.cuda) 
+        support_pos['mask'] = to_tensor(support_pos['mask'], self.cuda)
+        support_pos['id'] = to_tensor(support_pos['id'], self.cuda)
+        support_pos['label'] = to_tensor(support_pos['label'], self.cuda)
 
-        support_neg['label'] = Variable(torch.from_numpy(support_neg['label']).long())
-
-        query['word'] = Variable(torch.from_numpy(query['word']).long()) 
-        query['mask'] = Variable(torch.from_numpy(query['mask']).long())
-        query['id'] = Variable(torch.from_numpy(query['id']).long())
-        query['label'] = Variable(torch.from_numpy(query['label']).long())
-
-        # To cuda
+        support_neg['label'] = to_tensor(support_neg['label'], self.cuda)
+        # support_neg comes from the batches of neg_train_loader
         if self.cuda:
-            for key in ['word', 'mask', 'label', 'id']:
-                support_pos[key] = support_pos[key].cuda()
+            for key in ['word', 'mask', 'id']:
                 support_neg[key] = support_neg[key].cuda()
-                query[key] = query[key].cuda()
-            support_neg[key] = support_neg[key].cuda()
+
+        query['word'] = to_tensor(query['word'], self.cuda) 
+        query['mask'] = to_tensor(query['mask'], self.cuda)
+        query['id'] = to_tensor(query['id'], self.cuda)
+        query['label'] = to_tensor(query['label'], self.cuda)
 
         return support_pos, support_neg, query, target_classes[0]
 
@@ -411,93 +411,9 @@ class JSONFileDataLoaderBERT(FileDataLoader):
         query_class: num of classes in query set
         return: support_pos, support_neg, query, name_of_pos_class
         '''
-        target_classes = self.rel2scope.keys()
-        support_pos = {'word': [], 'mask': [], 'id': [], 'entpair': []}
-        support_neg = {'word': [], 'mask': [], 'id': [], 'entpair': [], 'label': []}
-        query = {'word': [], 'mask': [], 'label': [], 'entpair': [], 'id': []}
-
-        # New relation
-        scope = self.rel2scope[main_class]
-        indices = list(range(scope[0], scope[0] + support_pos_size + query_size))
-        support_word, query_word, _ = np.split(self.data_word[indices], [support_pos_size, support_pos_size + query_size])
-        support_mask, query_mask, _ = np.split(self.data_mask[indices], [support_pos_size, support_pos_size + query_size])
-        support_id, query_id, _ = np.split(self.uid[indices], [support_pos_size, support_pos_size + query_size])
-        support_entpair = list(self.data_entpair[indices[:support_pos_size]])
-        query['entpair'] += list(self.data_entpair[indices[support_pos_size:]])
-
-        # support_neg = train_data_loader.next_batch(support_pos_size * support_neg_rate)
-        # support_neg['label'] = np.zeros((support_neg_rate * support_pos_size), dtype=np.int32)
-        
-        if neg_train_loader is None:
-            neg_train_loader = train_data_loader
-        for i, class_name in enumerate(neg_train_loader.rel2scope.keys()[:support_neg_rate]):
-            scope = neg_train_loader.rel2scope[class_name]
-            support_neg['word'].append(neg_train_loader.data_word[scope[0]:scope[0]+support_pos_size])  
-            support_neg['mask'].append(neg_train_loader.data_mask[scope[0]:scope[0]+support_pos_size])
-            support_neg['id'].append(neg_train_loader.uid[scope[0]:scope[0]+support_pos_size])
-            support_neg['label'] += [0] * support_pos_size
-
-        support_neg['word'] = np.concatenate(support_neg['word'], 0)
-        support_neg['mask'] = np.concatenate(support_neg['mask'], 0)
-        support_neg['id'] = np.concatenate(support_neg['id'], 0)
-        support_neg['label'] = np.array(support_neg['label'])
-
-        support_pos['word'] = support_word
-        support_pos['mask'] = support_mask
-        support_pos['label'] = np.ones((support_pos_size), dtype=np.int32)
-        support_pos['id'] = support_id
-        support_pos['entpair'] = support_entpair
-
-        query['word'].append(query_word)
-        query['mask'].append(query_mask)
-        query['id'].append(query_id)
-        query['label'] += [1] * query_size
-
-        # Other query classes (negative)
-        if use_train_neg:
-            neg_loader = train_data_loader
-            target_classes = random.sample(neg_loader.rel2scope.keys(), query_class) # discard 0 class 
-        else:
-            neg_loader = self
-
-        for i, class_name in enumerate(target_classes):
-            if class_name == main_class:
-                continue
-            scope = neg_loader.rel2scope[class_name]
-            query['word'].append(neg_loader.data_word[scope[0]+support_pos_size:scope[0]+support_pos_size+query_size])  
-            query['mask'].append(neg_loader.data_mask[scope[0]+support_pos_size:scope[0]+support_pos_size+query_size])
-            query['id'].append(neg_loader.uid[scope[0]+support_pos_size:scope[0]+support_pos_size+query_size])
-            query['label'] += [0] * query_size
-            query['entpair'] += list(neg_loader.data_entpair[scope[0]+support_pos_size:scope[0]+support_pos_size+query_size])
-
-        query['word'] = np.concatenate(query['word'], 0)
-        query['mask'] = np.concatenate(query['mask'], 0)
-        query['id'] = np.concatenate(query['id'], 0)
-        query['label'] = np.array(query['label'])
-
-        support_pos['word'] = Variable(torch.from_numpy(support_pos['word']).long()) 
-        support_pos['mask'] = Variable(torch.from_numpy(support_pos['mask']).long())
-        support_pos['id'] = Variable(torch.from_numpy(support_pos['id']).long())
-        support_pos['label'] = Variable(torch.from_numpy(support_pos['label']).long())
-
-        support_neg['word'] = Variable(torch.from_numpy(support_neg['word']).long()) 
-        support_neg['mask'] = Variable(torch.from_numpy(support_neg['mask']).long())
-        support_neg['id'] = Variable(torch.from_numpy(support_neg['id']).long())
-        support_neg['label'] = Variable(torch.from_numpy(support_neg['label']).long())
-
-        query['word'] = Variable(torch.from_numpy(query['word']).long()) 
-        query['mask'] = Variable(torch.from_numpy(query['mask']).long())
-        query['id'] = Variable(torch.from_numpy(query['id']).long())
-        query['label'] = Variable(torch.from_numpy(query['label']).long())
-
-        # To cuda
-        if self.cuda:
-            for key in ['word', 'mask', 'label', 'id']:
-                support_pos[key] = support_pos[key].cuda()
-                support_neg[key] = support_neg[key].cuda()
-                query[key] = query[key].cuda()
-
-        return support_pos, support_neg, query, main_class
+        plan = episode.draw_selected(self, train_data_loader, support_pos_size, support_neg_rate, query_size, query_class, [main_class],
+                use_train_neg=use_train_neg, neg_train_loader=neg_train_loader)
+        return episode.gather(plan, [self, train_data_loader, neg_train_loader or train_data_loader], cuda=self.cuda)[0]
 
     def next_fewshot_one(self, N, K, Q):
         target_classes = random.sample(self.rel2scope.keys(), N)
@@ -507,7 +423,7 @@ class JSONFileDataLoaderBERT(FileDataLoader):
 
         for i, class_name in enumerate(target_classes):
             scope = self.rel2scope[class_name]
-            indices = np.random.choice(list(range(scope[0], scope[1])), K + Q, False)
+            indices = sampling.sample_scope(scope[0], scope[1], K + Q)
             word = self.data_word[indices]
             mask = self.data_mask[indices]
             id = self.uid[indices]
@@ -550,90 +466,28 @@ class JSONFileDataLoaderBERT(FileDataLoader):
             query['word'].append(current_query['word'])
             query['id'].append(current_query['id'])
             label.append(current_label)
-        support['word'] = Variable(torch.from_numpy(np.stack(support['word'], 0)).long().view(-1, self.max_length))
-        support['mask'] = Variable(torch.from_numpy(np.stack(support['mask'], 0)).long().view(-1, self.max_length)) 
-        support['id'] = Variable(torch.from_numpy(np.stack(support['id'], 0)).long().view(-1, self.max_length)) 
-        query['word'] = Variable(torch.from_numpy(np.stack(query['word'], 0)).long().view(-1, self.max_length)) 
-        query['mask'] = Variable(torch.from_numpy(np.stack(query['mask'], 0)).long().view(-1, self.max_length)) 
-        query['id'] = Variable(torch.from_numpy(np.stack(query['id'], 0)).long().view(-1, self.max_length)) 
-        label = Variable(torch.from_numpy(np.stack(label, 0).astype(np.int64)).long())
+        support['word'] = to_tensor(np.stack(support['word'], 0), self.cuda).view(-1, self.max_length)
+        support['mask'] = to_tensor(np.stack(support['mask'], 0), self.cuda).view(-1, self.max_length) 
+        support['id'] = to_tensor(np.stack(support['id'], 0), self.cuda).view(-1, self.max_length) 
+        query['word'] = to_tensor(np.stack(query['word'], 0), self.cuda).view(-1, self.max_length) 
+        query['mask'] = to_tensor(np.stack(query['mask'], 0), self.cuda).view(-1, self.max_length) 
+        query['id'] = to_tensor(np.stack(query['id'], 0), self.cuda).view(-1, self.max_length) 
+        label = to_tensor(np.stack(label, 0).astype(np.int64), self.cuda)
         
-        # To cuda
-        if self.cuda:
-            for key in support:
-                support[key] = support[key].cuda()
-            for key in query:
-                query[key] = query[key].cuda()
-            label = label.cuda()
 
         return support, query, label
 
-    def sample_for_eval(self, train_data_loader, support_pos_size, query_size, target_class=None, query_train=True, query_val=True): 
-        if target_class is None:
-            target_class = random.sample(self.rel2scope.keys(), 1)[0] 
-        support_pos = {'word': [], 'mask': [], 'id': [], 'entpair': []}
-        query = {'word': [], 'mask': [], 'id': [], 'label': []}
-
-        # New relation
-        scope = self.rel2scope[target_class]
-        indices = np.random.choice(list(range(scope[0], scope[1])), support_pos_size + query_size, False)
-        support_word, query_word, _ = np.split(self.data_word[indices], [support_pos_size, support_pos_size + query_size])
-        support_mask, query_mask, _ = np.split(self.data_mask[indices], [support_pos_size, support_pos_size + query_size])
-        support_id, query_id, _ = np.split(self.uid[indices], [support_pos_size, support_pos_size + query_size])
-        support_entpair = list(self.data_entpair[indices[:support_pos_size]])
-        
-        support_pos['word'] = support_word
-        support_pos['mask'] = support_mask
-        support_pos['label'] = np.ones((support_pos_size), dtype=np.int32)
-        support_pos['id'] = support_id
-        support_pos['entpair'] = support_entpair
-
-        query['word'].append(query_word)
-        query['mask'].append(query_mask)
-        query['id'].append(query_id)
-        query['label'] += [1] * query_size
-
-        # from train data loader
-        if query_train:
-            for i, class_name in enumerate(train_data_loader.rel2scope.keys()):
-                scope = train_data_loader.rel2scope[class_name]
-                indices = np.random.choice(list(range(scope[0], scope[1])), query_size, False)
-                query['word'].append(train_data_loader.data_word[indices])  
-                query['mask'].append(train_data_loader.data_mask[indices])
-                query['id'].append(train_data_loader.uid[indices])
-                query['label'] += [0] * query_size
-        # from current data loader
-        if query_val:
-            for i, class_name in enumerate(self.rel2scope.keys()):
-                if class_name == target_class:
-                    continue
-                scope = self.rel2scope[class_name]
-                indices = np.random.choice(list(range(scope[0], scope[1])), query_size, False)
-                query['word'].append(self.data_word[indices])  
-                query['mask'].append(self.data_mask[indices])
-                query['id'].append(self.uid[indices])
-                query['label'] += [0] * query_size
-
-        query['word'] = np.concatenate(query['word'], 0)
-        query['mask'] = np.concatenate(query['mask'], 0)
-        query['id'] = np.concatenate(query['id'], 0)
-        query['label'] = np.array(query['label'])
-
-        support_pos['word'] = Variable(torch.from_numpy(support_pos['word']).long()) 
-        support_pos['mask'] = Variable(torch.from_numpy(support_pos['mask']).long())
-        support_pos['id'] = Variable(torch.from_numpy(support_pos['id']).long())
-        support_pos['label'] = Variable(torch.from_numpy(support_pos['label']).long())
-
-        query['word'] = Variable(torch.from_numpy(query['word']).long()) 
-        query['mask'] = Variable(torch.from_numpy(query['mask']).long())
-        query['id'] = Variable(torch.from_numpy(query['id']).long())
-        query['label'] = Variable(torch.from_numpy(query['label']).long())
-
-        # To cuda
-        if self.cuda:
-            for key in ['word', 'mask', 'label', 'id']:
-                support_pos[key] = support_pos[key].cuda()
-                query[key] = query[key].cuda()
-
-        return support_pos, query, target_class
+    def sample_eval_episodes(self, train_data_loader, support_pos_size, query_size, num_episodes, target_classes=None, query_train=True, query_val=True):
+        '''
+        sample several episodes as sample_for_eval does, at once (see episode.draw_eval and episode.gather)
+        num_episodes: num of episodes
+        target_classes: names of the new relations of the episodes, random if None
+        return: list of (support_pos, query, target_class)
+        '''
+        plan = episode.draw_eval(self, train_data_loader, support_pos_size, query_size, num_episodes, target_classes,
+                query_train=query_train, query_val=query_val)
+        return episode.gather(plan, [self, train_data_loader], cuda=self.cuda)
 
+    def sample_for_eval(self, train_data_loader, support_pos_size, query_size, target_class=None, query_train=True, query_val=True): 
+        return self.sample_eval_episodes(train_data_loader, support_pos_size, query_size, 1, None if target_class is None else [target_class],
+                query_train=query_train, query_val=query_val)[0]
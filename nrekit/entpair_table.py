@@ -0,0 +1,104 @@
+'''
+Neighbourhood tables of the entity pairs of the distant data.
+
+Phase 1 of the snowball scores the distant instances sharing an entity pair with the support set
+against the support instances of that pair, encoding them with the siamese encoder again at every
+iteration of every episode, while the distant data never changes. The table holds the uids and the
+siamese representations of the instances of all the pairs, contiguously in the order of
+EntpairIndex.member (the instances of a pair are a slice of it), so phase 1 is a lookup and a small
+product with the representations of the support instances.
+
+Optionally, it also holds the mean siamese score between the instances of each pair, i.e. how
+consistently the pair expresses a single relation.
+
+The table is saved as a container (see container.py), memory-mapped and shared by the runs.
+'''
+
+import numpy as np
+import torch
+from . import container
+from . import pairwise
+
+KIND = 'entpair_table'
+
+class EntpairTable:
+    '''
+    uid: uids of the instances, in the order of EntpairIndex.member (instance_tot)
+    repre: their siamese representations (instance_tot, hidden_size)
+    offset: the instances of pair i are [offset[i], offset[i + 1]), as EntpairIndex.offset (pair_tot + 1)
+    cohesion: mean siamese score between two different instances of each pair, nan for the pairs of a
+              single instance (pair_tot), or None
+    '''
+    def __init__(self, uid, repre, offset, cohesion=None):
+        self.uid = uid
+        self.repre = repre
+        self.offset = offset
+        self.cohesion = cohesion
+
+    @classmethod
+    def build(cls, data_entpair, uid, repre, fc=None, euc=True, chunk_size=256):
+        '''
+        data_entpair: EntpairIndex of the data
+        uid: uids of the instances of the data
+        repre: siamese representations of the instances of the data, in their order
+        fc, euc: the linear layer of the siamese network and its kind (see pairwise.logits), to
+                 compute the cohesion of the pairs; no cohesion if fc is None
+        chunk_size: num of instances of a pair scored at a time
+        '''
+        member = np.asarray(data_entpair.member, dtype=np.int64)
+        repre = np.ascontiguousarray(np.asarray(repre, dtype=np.float32)[member])
+        offset = np.asarray(data_entpair.offset, dtype=np.int64)
+        cohesion = None
+        if fc is not None:
+            cohesion = np.full(len(offset) - 1, np.nan, dtype=np.float32)
+            with torch.no_grad():
+                for pair in np.flatnonzero(np.diff(offset) > 1):
+                    x = torch.from_numpy(repre[offset[pair]:offset[pair + 1]]).to(fc.weight.device)
+                    score = pairwise.MeanScore(x, fc, euc=euc, tile_size=chunk_size)
+                    for chunk in pairwise.tiles(x.size(0), chunk_size):
+                        score.update(x[chunk])
+                    # the score of an instance with itself left out
+                    itself = torch.sigmoid(fc(torch.zeros_like(x) if euc else x * x)).sum()
+                    num = x.size(0)
+                    cohesion[pair] = float((score.total.sum() - itself) / (num * (num - 1)))
+        return cls(np.asarray(uid, dtype=np.int64)[member], repre, offset, cohesion)
+
+    def columns(self):
+        columns = {'table_uid': self.uid, 'table_repre': self.repre, 'table_offset': self.offset}
+        if self.cohesion is not None:
+            columns['table_cohesion'] = self.cohesion
+        return columns
+
+    def save(self, file_name, header=None):
+        '''
+        header: json-serializable dict stored along (e.g. the representations the table was built on)
+        '''
+        container.save(file_name, dict(header or {}, kind=KIND), self.columns(), {})
+
+    @classmethod
+    def load(cls, file_name, copy=False):
+        '''
+        copy: read the table into memory instead of mapping it
+        return: the table, or None if the file is missing or not a table
+        '''
+        loaded = container.load(file_name, copy=copy)
+        if loaded is None or loaded[0].get('kind') != KIND:
+            return None
+        columns = loaded[1]
+        return cls(columns['table_uid'], columns['table_repre'], columns['table_offset'], columns.get('table_cohesion'))
+
+    def __len__(self):
+        return len(self.uid)
+
+    def lookup(self, position, uid, cuda=False):
+        '''
+        position: positions of instances in EntpairIndex.member
+        uid: their uids, checked against the table
+        return: their representations (FloatTensor)
+        '''
+        if not np.array_equal(self.uid[position], uid):
+            raise ValueError('the entity pair table was built on another data')
+        repre = torch.from_numpy(self.repre[position])
+        if cuda:
+            repre = repre.cuda(non_blocking=True)
+        return repre
@@ -0,0 +1,222 @@
+'''
+Episode plans: the instances of evaluation episodes, as indices into the data loaders.
+
+A plan is drawn once (e.g. from a seed with make_episode_plan.py) and stored in a container file,
+so that evaluations replay identical episodes: runs of different models or hyper-parameters are
+compared on the same episodes, and a sweep can be split across machines.
+
+For each role (support_pos, support_neg, query), a plan holds the instances of all the episodes
+one after another:
+    <role>_source: which loader each instance comes from, an index into the loaders given to gather
+        EVAL: the evaluated loader (val or test)
+        TRAIN: the train loader, source of the negative queries
+        NEG_TRAIN: the loader of the negative support set (Framework.neg_train_loader)
+    <role>_index: index of each instance in its loader
+    <role>_offset: the instances of episode i are [offset[i], offset[i + 1])
+and query_label, 1 for the queries of the new relation. target_class holds the name of the new
+relation of each episode.
+The CNN and the BERT loaders number the instances in the order of the json files, so a plan is
+shared by both.
+'''
+
+import hashlib
+import numpy as np
+from . import container
+from . import data_loader
+from . import preprocess
+from . import sampling
+
+EVAL = 0
+TRAIN = 1
+NEG_TRAIN = 2
+ROLES = ['support_pos', 'support_neg', 'query']
+
+def _add_role(plan, role, sources, indices):
+    '''
+    sources, indices: lists (one item per episode) of int arrays
+    '''
+    plan[role + '_source'] = np.concatenate(sources).astype(np.uint8)
+    plan[role + '_index'] = np.concatenate(indices).astype(np.int64)
+    plan[role + '_offset'] = np.concatenate([[0], np.cumsum([len(index) for index in indices])]).astype(np.int64)
+
+def draw_eval(eval_loader, train_loader, support_pos_size, query_size, num_episodes, target_classes=None, query_train=True, query_val=True):
+    '''
+    draw the episodes of sample_for_eval: support_pos_size + query_size instances of the new relation,
+    query_size of each train relation (query_train) and of each other relation of eval_loader (query_val)
+    num_episodes: num of episodes
+    target_classes: names of the new relations of the episodes, random if None
+    return: plan
+    '''
+    rel_names = list(eval_loader.rel2scope)
+    size = eval_loader.rel_scope[:, 1] - eval_loader.rel_scope[:, 0]
+    if target_classes is None:
+        target = np.random.randint(len(rel_names), size=num_episodes)
+    else:
+        rel_index = {rel: i for i, rel in enumerate(rel_names)}
+        target = np.array([rel_index[rel] for rel in target_classes], dtype=np.int64)
+
+    # all the episodes at once: new relation (support, then the positive queries), other relations
+    positive = sampling.sample_scopes(eval_loader.rel_scope[target, 0], size[target], support_pos_size + query_size)
+    if query_val:
+        other = np.tile(np.arange(len(rel_names)), (num_episodes, 1))
+        other = other[other != target[:, None]]
+        negative = sampling.sample_scopes(eval_loader.rel_scope[other, 0], size[other], query_size).reshape(num_episodes, -1)
+    else:
+        negative = np.zeros((num_episodes, 0), dtype=np.int64)
+    if query_train:
+        train_size = train_loader.rel_scope[:, 1] - train_loader.rel_scope[:, 0]
+        train_negative = sampling.sample_scopes(np.tile(train_loader.rel_scope[:, 0], num_episodes), np.tile(train_size, num_episodes), query_size)
+        train_negative = train_negative.reshape(num_episodes, -1)
+    else:
+        train_negative = np.zeros((num_episodes, 0), dtype=np.int64)
+
+    # each query set: positive, from train data loader, from current data loader
+    query_index = np.concatenate([positive[:, support_pos_size:], train_negative, negative], 1)
+    query_source = np.full(query_index.shape, EVAL, dtype=np.uint8)
+    query_source[:, query_size:query_size + train_negative.shape[1]] = TRAIN
+    query_label = np.zeros(query_index.shape, dtype=np.uint8)
+    query_label[:, :query_size] = 1
+
+    plan = {'target_class': [rel_names[i] for i in target]}
+    _add_role(plan, 'support_pos', [np.full(support_pos_size, EVAL)] * num_episodes, list(positive[:, :support_pos_size]))
+    _add_role(plan, 'support_neg', [np.zeros(0)] * num_episodes, [np.zeros(0)] * num_episodes)
+    _add_role(plan, 'query', list(query_source), list(query_index))
+    plan['query_label'] = query_label.reshape(-1)
+    return plan
+
+def draw_selected(eval_loader, train_loader, support_pos_size, support_neg_rate, query_size, query_class, main_classes=None, use_train_neg=False, neg_train_loader=None):
+    '''
+    draw the episodes of get_selected, one for each of main_classes (all the relations of eval_loader if None):
+    the first instances of each relation, the negative support set from the first support_neg_rate relations
+    of neg_train_loader, and with use_train_neg, the negative queries from query_class random train relations
+    return: plan
+    '''
+    if main_classes is None:
+        main_classes = list(eval_loader.rel2scope)
+    if neg_train_loader is None:
+        neg_train_loader = train_loader
+    plan = {'target_class': list(main_classes)}
+    support_pos = []
+    support_neg = []
+    support_neg_source = []
+    query = []
+    query_source = []
+    query_label = []
+    for main_class in main_classes:
+        start = eval_loader.rel2scope[main_class][0]
+        support_pos.append(np.arange(start, start + support_pos_size))
+        index = [np.arange(start + support_pos_size, start + support_pos_size + query_size)]
+        source = [np.full(query_size, EVAL)]
+        support_neg.append(np.concatenate([np.arange(neg_train_loader.rel2scope[class_name][0], neg_train_loader.rel2scope[class_name][0] + support_pos_size)
+            for class_name in list(neg_train_loader.rel2scope)[:support_neg_rate]] + [np.zeros(0, dtype=np.int64)]))
+        support_neg_source.append(np.full(len(support_neg[-1]), NEG_TRAIN))
+
+        # Other query classes (negative)
+        if use_train_neg:
+            neg_loader, neg_source = train_loader, TRAIN
+            target_classes = [list(train_loader.rel2scope)[i] for i in np.random.choice(len(train_loader.rel2scope), query_class, False)]
+        else:
+            neg_loader, neg_source = eval_loader, EVAL
+            target_classes = list(eval_loader.rel2scope)
+        for class_name in target_classes:
+            if class_name == main_class:
+                continue
+            start = neg_loader.rel2scope[class_name][0]
+            index.append(np.arange(start + support_pos_size, start + support_pos_size + query_size))
+            source.append(np.full(query_size, neg_source))
+        query.append(np.concatenate(index))
+        query_source.append(np.concatenate(source))
+        label = np.zeros(len(query[-1]), dtype=np.uint8)
+        label[:query_size] = 1
+        query_label.append(label)
+    _add_role(plan, 'support_pos', [np.full(support_pos_size, EVAL)] * len(main_classes), support_pos)
+    _add_role(plan, 'support_neg', support_neg_source, support_neg)
+    _add_role(plan, 'query', query_source, query)
+    plan['query_label'] = np.concatenate(query_label)
+    return plan
+
+def gather(plan, loaders, start=0, stop=None, cuda=True):
+    '''
+    build the episodes [start, stop) of a plan. For each role, each array is gathered with one take per
+    loader and moved to the device as one buffer, of which the episodes are slices.
+    loaders: data loaders indexed by the sources (EVAL, TRAIN, NEG_TRAIN)
+    return: list of (support_pos, query, target_class), or of (support_pos, support_neg, query, target_class)
+            if the plan has negative support sets
+    '''
+    if stop is None:
+        stop = len(plan['target_class'])
+    with_support_neg = len(plan['support_neg_index']) > 0
+    roles = {}
+    for role in ROLES:
+        offset = plan[role + '_offset'][start:stop + 1]
+        source = plan[role + '_source'][offset[0]:offset[-1]]
+        index = plan[role + '_index'][offset[0]:offset[-1]]
+        gathered = {}
+        for i in np.unique(source):
+            gathered[i] = (source == i, loaders[i].gather(index[source == i]))
+        data = {}
+        for key in (gathered[source[0]][1] if len(source) else []):
+            arrays = [gathered[i][1][key] for i in gathered]
+            data[key] = np.empty((len(index),) + arrays[0].shape[1:], dtype=np.result_type(*arrays))
+            for i in gathered:
+                data[key][gathered[i][0]] = gathered[i][1][key]
+            if key != 'entpair':
+                data[key] = data_loader.to_tensor(data[key], cuda)
+        if role == 'query':
+            data['label'] = data_loader.to_tensor(plan['query_label'][offset[0]:offset[-1]], cuda)
+        elif len(index):
+            data['label'] = data_loader.to_tensor((np.ones if role == 'support_pos' else np.zeros)((len(index)), dtype=np.int32), cuda)
+        roles[role] = (offset - offset[0], data)
+
+    episodes = []
+    for i in range(stop - start):
+        episode = []
+        for role in ROLES:
+            if role == 'support_neg' and not with_support_neg:
+                continue
+            offset, data = roles[role]
+            begin, end = offset[i], offset[i + 1]
+            part = {key: data[key][begin:end] for key in data if key != 'entpair'}
+            # as get_selected, the negative support set has no entity pairs
+            part['entpair'] = list(data['entpair'][begin:end]) if role != 'support_neg' and 'entpair' in data else []
+            episode.append(part)
+        episode.append(plan['target_class'][start + i])
+        episodes.append(tuple(episode))
+    return episodes
+
+def fingerprint(loader):
+    '''
+    return: what a plan checks a loader against, as the indices are only meaningful for the same data
+    '''
+    return {'instance_tot': int(loader.instance_tot), 'uid': hashlib.sha1(np.ascontiguousarray(loader.uid).tobytes()).hexdigest()}
+
+def save(file_name, plan, loaders, params):
+    '''
+    loaders: data loaders indexed by the sources, stored as fingerprints
+    params: json-serializable dict of the parameters the plan was drawn with
+    '''
+    columns = {key: plan[key] for key in plan if key != 'target_class'}
+    for role in ROLES:
+        index = columns[role + '_index']
+        columns[role + '_index'] = index.astype(preprocess.compact_dtype(int(index.max()) if len(index) else 0))
+    container.save(file_name, {'kind': 'episode_plan', 'params': params, 'loaders': [fingerprint(loader) for loader in loaders]},
+            columns, {'target_class': plan['target_class']})
+
+def load(file_name, loaders):
+    '''
+    loaders: data loaders the plan will be gathered from, indexed by the sources
+    return: plan, params
+    '''
+    data = container.load(file_name, copy=True)
+    if data is None or data[0].get('kind') != 'episode_plan':
+        raise Exception("[ERROR] Episode plan file '%s' doesn't exist or isn't valid" % file_name)
+    header, columns, sections = data
+    used = set()
+    for role in ROLES:
+        used.update(np.unique(columns[role + '_source']).tolist())
+    for i in used:
+        if i >= len(loaders) or loaders[i] is None or fingerprint(loaders[i]) != header['loaders'][i]:
+            raise Exception("[ERROR] Episode plan '%s' was drawn from other data" % file_name)
+    plan = dict(columns)
+    plan['target_class'] = sections['target_class']
+    return plan, header['params']
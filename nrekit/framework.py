@@ -6,6 +6,8 @@ import sys
 import time
 from . import sentence_encoder
 from . import data_loader
+from .prefetch import Prefetcher
+from . import episode
 import torch
 from torch import autograd, optim, nn
 from torch.autograd import Variable
@@ -334,7 +336,8 @@ class Framework:
             support_size=10, query_size=600, unlabelled_size=50, query_class=16,
             ckpt=None,
             is_model2=False,
-            threshold=0.5):
+            threshold=0.5,
+            plan=None):
         '''
         model: a FewShotREModel instance
         B: Batch size
@@ -343,6 +346,7 @@ class Framework:
         Q: Num of instances for each class in the query set
         eval_iter: Num of iterations
         ckpt: Checkpoint path. Set as None if using current model parameters.
+        plan: Episode plan file (see make_episode_plan.py) to replay instead of drawing the episodes
         return: Accuracy
         '''
         print("")
@@ -354,6 +358,9 @@ class Framework:
             model.load_state_dict(checkpoint['state_dict'])
             eval_dataset = self.test_data_loader
         eval_distant_dataset = self.distant
+        loaders = [eval_dataset, self.train_data_loader, self.neg_train_loader]
+        if plan is not None:
+            plan, _ = episode.load(plan, loaders)
 
         iter_right = 0.0
         iter_prec = 0.0
@@ -364,8 +371,11 @@ class Framework:
         iter_brecall = 0.0
         snowball_metric = [np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32) ]
         # for rel in ['P2094']:
-        for rel in self.val_data_loader.rel2scope:
-            support_pos, support_neg, query, pos_class = eval_dataset.get_selected(self.train_data_loader, support_size, 10, query_size, query_class, main_class=rel, use_train_neg=True, neg_train_loader=self.neg_train_loader)
+        for i, rel in enumerate(self.val_data_loader.rel2scope if plan is None else plan['target_class']):
+            if plan is None:
+                support_pos, support_neg, query, pos_class = eval_dataset.get_selected(self.train_data_loader, support_size, 10, query_size, query_class, main_class=rel, use_train_neg=True, neg_train_loader=self.neg_train_loader)
+            else:
+                support_pos, support_neg, query, pos_class = episode.gather(plan, loaders, i, i + 1, cuda=eval_dataset.cuda)[0]
 
             model.forward_baseline(support_pos, support_neg, query, threshold=threshold)
             model.forward(support_pos, support_neg, query, eval_distant_dataset, pos_class, threshold=threshold)
@@ -410,7 +420,9 @@ class Framework:
             eval_iter=2000,
             ckpt=None,
             is_model2=False,
-            threshold=0.5):
+            threshold=0.5,
+            episode_batch=10,
+            plan=None, plan_start=0):
         '''
         model: a FewShotREModel instance
         B: Batch size
@@ -419,6 +431,10 @@ class Framework:
         Q: Num of instances for each class in the query set
         eval_iter: Num of iterations
         ckpt: Checkpoint path. Set as None if using current model parameters.
+        episode_batch: Num of episodes sampled (and moved to the device) at once
+        plan: Episode plan file (see make_episode_plan.py) to replay instead of sampling the episodes, whose
+              support_size, query_size, query_train and query_val it fixes
+        plan_start: First episode of the plan to replay, e.g. to split a plan across machines
         return: Accuracy
         '''
         print("")
@@ -430,6 +446,9 @@ class Framework:
             model.load_state_dict(checkpoint['state_dict'])
             eval_dataset = self.test_data_loader
         eval_distant_dataset = self.distant
+        if plan is not None:
+            plan, _ = episode.load(plan, [eval_dataset, self.train_data_loader])
+            eval_iter = min(eval_iter, len(plan['target_class']) - plan_start)
 
         iter_right = 0.0
         iter_prec = 0.0
@@ -439,8 +458,13 @@ class Framework:
         iter_bprec = 0.0
         iter_brecall = 0.0
         snowball_metric = [np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32) ]
+        episodes = []
         for it in range(eval_iter):
-            support_pos, query, pos_class = eval_dataset.sample_for_eval(self.train_data_loader, support_size, query_size)
+            if not episodes and plan is not None:
+                episodes = episode.gather(plan, [eval_dataset, self.train_data_loader], plan_start + it, plan_start + min(it + episode_batch, eval_iter), cuda=eval_dataset.cuda)
+            elif not episodes:
+                episodes = eval_dataset.sample_eval_episodes(self.train_data_loader, support_size, query_size, min(episode_batch, eval_iter - it))
+            support_pos, query, pos_class = episodes.pop(0)
             model.forward_baseline(support_pos, query, threshold=threshold)
 
             # support_pos, support_neg, query, pos_class = eval_dataset.get_one_new_relation(self.train_data_loader, support_size, 10, query_size, query_class, use_train_neg=True, neg_train_loader=self.neg_train_loader)
@@ -467,7 +491,9 @@ class Framework:
             ckpt=None,
             is_model2=False,
             threshold=0.5,
-            query_train=True, query_val=True):
+            query_train=True, query_val=True,
+            episode_batch=10,
+            plan=None, plan_start=0):
         '''
         model: a FewShotREModel instance
         B: Batch size
@@ -476,6 +502,10 @@ class Framework:
         Q: Num of instances for each class in the query set
         eval_iter: Num of iterations
         ckpt: Checkpoint path. Set as None if using current model parameters.
+        episode_batch: Num of episodes sampled (and moved to the device) at once
+        plan: Episode plan file (see make_episode_plan.py) to replay instead of sampling the episodes, whose
+              support_size, query_size, query_train and query_val it fixes
+        plan_start: First episode of the plan to replay, e.g. to split a plan across machines
         return: Accuracy
         '''
         print("")
@@ -487,6 +517,9 @@ class Framework:
             model.load_state_dict(checkpoint['state_dict'])
             eval_dataset = self.test_data_loader
         eval_distant_dataset = self.distant
+        if plan is not None:
+            plan, _ = episode.load(plan, [eval_dataset, self.train_data_loader])
+            eval_iter = min(eval_iter, len(plan['target_class']) - plan_start)
 
         iter_right = 0.0
         iter_prec = 0.0
@@ -496,9 +529,15 @@ class Framework:
         iter_bprec = 0.0
         iter_brecall = 0.0
         snowball_metric = [np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32), np.zeros([3], dtype=np.float32) ]
+        episodes = []
         for it in range(eval_iter):
             # support_pos, support_neg, query, pos_class = eval_dataset.get_one_new_relation(self.train_data_loader, support_size, 10, query_size, query_class, use_train_neg=True, neg_train_loader=self.neg_train_loader)
-            support_pos, query, pos_class = eval_dataset.sample_for_eval(self.train_data_loader, support_size, query_size, query_train=query_train, query_val=query_val)
+            if not episodes and plan is not None:
+                episodes = episode.gather(plan, [eval_dataset, self.train_data_loader], plan_start + it, plan_start + min(it + episode_batch, eval_iter), cuda=eval_dataset.cuda)
+            elif not episodes:
+                episodes = eval_dataset.sample_eval_episodes(self.train_data_loader, support_size, query_size, min(episode_batch, eval_iter - it),
+                        query_train=query_train, query_val=query_val)
+            support_pos, query, pos_class = episodes.pop(0)
             model.forward_baseline(support_pos, query, threshold=threshold)
             model.forward(support_pos, query, eval_distant_dataset, pos_class, threshold=threshold)
 
@@ -617,7 +656,8 @@ class SuperviseFramework:
               support_size=10,
               warmup=True,
               warmup_step=300,
-              grad_iter=1):
+              grad_iter=1,
+              prefetch=0):
         '''
         model: a FewShotREModel instance
         model_name: Name of the model
@@ -634,6 +674,7 @@ class SuperviseFramework:
         val_step: Validate every val_step steps
         cuda: Use CUDA or not
         pretrain_model: Pre-trained checkpoint path
+        prefetch: Num of batches prepared ahead in a background thread, 0 for none
         '''
         print("Start training...")
         model.train()
@@ -652,57 +693,68 @@ class SuperviseFramework:
         # Training
         best_acc = 0
         global_step = 0
+
+        def next_data():
+            batch_data = self.train_data_loader.next_batch_one_epoch(batch_size)
+            if support and batch_data is not None:
+                return batch_data, self.train_data_loader.next_support(support_size)
+            return batch_data, None
+        if prefetch:
+            next_data = Prefetcher(next_data, depth=prefetch, cuda=self.train_data_loader.cuda)
         
-        for epoch in range(train_epoch):
-            epoch_step = 0
-            iter_loss = 0.0
-            iter_right = 0.0
-            iter_sample = 0.0
-            while True:
-                global_step += 1
-                epoch_step += 1
-                batch_data = self.train_data_loader.next_batch_one_epoch(batch_size)
-                if batch_data is None:
-                    break
+        try:
+            for epoch in range(train_epoch):
+                epoch_step = 0
+                iter_loss = 0.0
+                iter_right = 0.0
+                iter_sample = 0.0
+                while True:
+                    global_step += 1
+                    epoch_step += 1
+                    batch_data, support_data = next_data()
+                    if batch_data is None:
+                        break
       
-                if support:
-                    support_data = self.train_data_loader.next_support(support_size)
-                    model.forward_base(batch_data, support_data)
-                else:
-                    model.forward_base(batch_data)
-                loss = model.loss() / grad_iter
-                right = model.accuracy()
-                loss.backward()
+                    if support:
+                        model.forward_base(batch_data, support_data)
+                    else:
+                        model.forward_base(batch_data)
+                    loss = model.loss() / grad_iter
+                    right = model.accuracy()
+                    loss.backward()
                 
-                # warmup
-                cur_lr = learning_rate
-                if warmup:
-                    cur_lr *= warmup_linear(global_step, warmup_step)
-                for param_group in optimizer.param_groups:
-                    param_group['lr'] = cur_lr
-
-                if global_step % grad_iter == 0:
-                    optimizer.step()
-                    optimizer.zero_grad()
+                    # warmup
+                    cur_lr = learning_rate
+                    if warmup:
+                        cur_lr *= warmup_linear(global_step, warmup_step)
+                    for param_group in optimizer.param_groups:
+                        param_group['lr'] = cur_lr
+
+                    if global_step % grad_iter == 0:
+                        optimizer.step()
+                        optimizer.zero_grad()
                 
-                iter_loss += loss
-                iter_right += right
-                iter_sample += 1
+                    iter_loss += loss
+                    iter_right += right
+                    iter_sample += 1
 
-                sys.stdout.write('step: {0:4} | loss: {1:2.6f}, accuracy: {2:3.2f}%'.format(epoch_step, iter_loss / iter_sample, 100 * iter_right / iter_sample) +'\r')
-                sys.stdout.flush()
+                    sys.stdout.write('step: {0:4} | loss: {1:2.6f}, accuracy: {2:3.2f}%'.format(epoch_step, iter_loss / iter_sample, 100 * iter_right / iter_sample) +'\r')
+                    sys.stdout.flush()
 
-            print('')
-            acc = self.eval_encoder_one_epoch(model, support=support, batch_size=batch_size)
-            print('')
-            if acc > best_acc:
-                print('Best checkpoint')
-                if not os.path.exists(ckpt_dir):
-                    os.makedirs(ckpt_dir)
-                save_path = os.path.join(ckpt_dir, model_name + ".pth.tar")
-                torch.save({'state_dict': model.state_dict()}, save_path)
-                best_acc = acc
+                print('')
+                acc = self.eval_encoder_one_epoch(model, support=support, batch_size=batch_size)
+                print('')
+                if acc > best_acc:
+                    print('Best checkpoint')
+                    if not os.path.exists(ckpt_dir):
+                        os.makedirs(ckpt_dir)
+                    save_path = os.path.join(ckpt_dir, model_name + ".pth.tar")
+                    torch.save({'state_dict': model.state_dict()}, save_path)
+                    best_acc = acc
                 
+        finally:
+            if prefetch:
+                next_data.close()
         print("\n####################\n")
         print("Finish training " + model_name)
 
@@ -721,7 +773,8 @@ class SuperviseFramework:
               pretrain_model=None,
               support=False,
               support_size=10,
-              optimizer=optim.SGD):
+              optimizer=optim.SGD,
+              prefetch=0):
         '''
         model: a FewShotREModel instance
         model_name: Name of the model
@@ -738,6 +791,7 @@ class SuperviseFramework:
         val_step: Validate every val_step steps
         cuda: Use CUDA or not
         pretrain_model: Pre-trained checkpoint path
+        prefetch: Num of batches prepared ahead in a background thread, 0 for none
         '''
         print("Start training...")
         model.train()
@@ -765,45 +819,56 @@ class SuperviseFramework:
         iter_right = 0.0
         iter_sample = 0.0
 
-        for it in range(start_iter, start_iter + train_iter):
-            scheduler.step()
+        def next_data():
             batch_data = self.train_data_loader.next_batch(batch_size)
-      
             if support:
-                support_data = self.train_data_loader.next_support(support_size)
-                model.forward_base(batch_data, support_data)
-            else:
-                model.forward_base(batch_data)
-            loss = model.loss()
-            right = model.accuracy()
-            opt.zero_grad()
-            loss.backward()
-            opt.step()
+                return batch_data, self.train_data_loader.next_support(support_size)
+            return batch_data, None
+        if prefetch:
+            next_data = Prefetcher(next_data, depth=prefetch, cuda=self.train_data_loader.cuda)
+
+        try:
+            for it in range(start_iter, start_iter + train_iter):
+                scheduler.step()
+                batch_data, support_data = next_data()
+      
+                if support:
+                    model.forward_base(batch_data, support_data)
+                else:
+                    model.forward_base(batch_data)
+                loss = model.loss()
+                right = model.accuracy()
+                opt.zero_grad()
+                loss.backward()
+                opt.step()
             
-            iter_loss += loss
-            iter_right += right
-            iter_sample += 1
-
-            sys.stdout.write('step: {0:4} | loss: {1:2.6f}, accuracy: {2:3.2f}%'.format(it + 1, iter_loss / iter_sample, 100 * iter_right / iter_sample) +'\r')
-            sys.stdout.flush()
+                iter_loss += loss
+                iter_right += right
+                iter_sample += 1
 
-            if it % val_step == 0:
-                iter_loss = 0.
-                iter_right = 0.
-                iter_sample = 0.
+                sys.stdout.write('step: {0:4} | loss: {1:2.6f}, accuracy: {2:3.2f}%'.format(it + 1, iter_loss / iter_sample, 100 * iter_right / iter_sample) +'\r')
+                sys.stdout.flush()
 
-            if (it + 1) % val_step == 0:
-                print('')
-                acc = self.eval_encoder(model, support=support, eval_iter=val_iter)
-                print('')
-                if acc > best_acc:
-                    print('Best checkpoint')
-                    if not os.path.exists(ckpt_dir):
-                        os.makedirs(ckpt_dir)
-                    save_path = os.path.join(ckpt_dir, model_name + ".pth.tar")
-                    torch.save({'state_dict': model.state_dict()}, save_path)
-                    best_acc = acc
+                if it % val_step == 0:
+                    iter_loss = 0.
+                    iter_right = 0.
+                    iter_sample = 0.
+
+                if (it + 1) % val_step == 0:
+                    print('')
+                    acc = self.eval_encoder(model, support=support, eval_iter=val_iter)
+                    print('')
+                    if acc > best_acc:
+                        print('Best checkpoint')
+                        if not os.path.exists(ckpt_dir):
+                            os.makedirs(ckpt_dir)
+                        save_path = os.path.join(ckpt_dir, model_name + ".pth.tar")
+                        torch.save({'state_dict': model.state_dict()}, save_path)
+                        best_acc = acc
                 
+        finally:
+            if prefetch:
+                next_data.close()
         print("\n####################\n")
         print("Finish training " + model_name)
 
@@ -908,7 +973,8 @@ class SuperviseFramework:
               warmup=True,
               warmup_step=300,
               s_num_class=8,
-              grad_iter=1):
+              grad_iter=1,
+              prefetch=0):
         '''
         model: a FewShotREModel instance
         model_name: Name of the model
@@ -925,6 +991,7 @@ class SuperviseFramework:
         val_step: Validate every val_step steps
         cuda: Use CUDA or not
         pretrain_model: Pre-trained checkpoint path
+        prefetch: Num of batches prepared ahead in a background thread, 0 for none
         '''
         print("Start training...")
         model.train()
@@ -952,55 +1019,63 @@ class SuperviseFramework:
 
         s_num_size = batch_size // s_num_class
 
-        for it in range(start_iter, start_iter + train_iter):
-            global_step += 1
+        next_data = lambda: self.train_data_loader.next_multi_class(num_size=s_num_size, num_class=s_num_class)
+        if prefetch:
+            next_data = Prefetcher(next_data, depth=prefetch, cuda=self.train_data_loader.cuda)
 
-            batch_data = self.train_data_loader.next_multi_class(num_size=s_num_size, num_class=s_num_class)
-            model(batch_data, s_num_size, s_num_class)
+        try:
+            for it in range(start_iter, start_iter + train_iter):
+                global_step += 1
 
-            loss = model._loss / grad_iter
-            right = model._accuracy
-            loss.backward()
+                batch_data = next_data()
+                model(batch_data, s_num_size, s_num_class)
 
-            # warmup
-            cur_lr = learning_rate
-            if warmup:
-                cur_lr *= warmup_linear(global_step, warmup_step)
-            for param_group in optimizer.param_groups:
-                param_group['lr'] = cur_lr
-            
-            if global_step % grad_iter == 0:
-                optimizer.step()
-                optimizer.zero_grad()
+                loss = model._loss / grad_iter
+                right = model._accuracy
+                loss.backward()
 
-            iter_loss += loss
-            iter_right += right
-            iter_sample += 1
-            iter_prec += model._prec
-            iter_recall += model._recall
-            sys.stdout.write('step: {0:4} | loss: {1:2.6f}, accuracy: {2:3.2f}%, prec: {3:3.2f}%, recall: {4:3.2f}%'.format( \
-                it + 1, iter_loss / iter_sample, 100 * iter_right / iter_sample, 100.0 * iter_prec / iter_sample, 100.0 * iter_recall / iter_sample) +'\r')
-            sys.stdout.flush()
+                # warmup
+                cur_lr = learning_rate
+                if warmup:
+                    cur_lr *= warmup_linear(global_step, warmup_step)
+                for param_group in optimizer.param_groups:
+                    param_group['lr'] = cur_lr
+            
+                if global_step % grad_iter == 0:
+                    optimizer.step()
+                    optimizer.zero_grad()
 
-            if it % val_step == 0:
-                iter_loss = 0.
-                iter_right = 0.
-                iter_sample = 0.
-                iter_prec = 0.
-                iter_recall = 0.
+                iter_loss += loss
+                iter_right += right
+                iter_sample += 1
+                iter_prec += model._prec
+                iter_recall += model._recall
+                sys.stdout.write('step: {0:4} | loss: {1:2.6f}, accuracy: {2:3.2f}%, prec: {3:3.2f}%, recall: {4:3.2f}%'.format( \
+                    it + 1, iter_loss / iter_sample, 100 * iter_right / iter_sample, 100.0 * iter_prec / iter_sample, 100.0 * iter_recall / iter_sample) +'\r')
+                sys.stdout.flush()
 
-            if (it + 1) % val_step == 0:
-                print('')
-                prec = self.eval_siamese(model, eval_iter=val_iter, threshold=0.5, s_num_size=s_num_size, s_num_class=s_num_class)
-                print('')
-                if prec > best_prec:
-                    print('Best checkpoint')
-                    if not os.path.exists(ckpt_dir):
-                        os.makedirs(ckpt_dir)
-                    save_path = os.path.join(ckpt_dir, model_name + ".pth.tar")
-                    torch.save({'state_dict': model.state_dict()}, save_path)
-                    best_prec = prec
+                if it % val_step == 0:
+                    iter_loss = 0.
+                    iter_right = 0.
+                    iter_sample = 0.
+                    iter_prec = 0.
+                    iter_recall = 0.
+
+                if (it + 1) % val_step == 0:
+                    print('')
+                    prec = self.eval_siamese(model, eval_iter=val_iter, threshold=0.5, s_num_size=s_num_size, s_num_class=s_num_class)
+                    print('')
+                    if prec > best_prec:
+                        print('Best checkpoint')
+                        if not os.path.exists(ckpt_dir):
+                            os.makedirs(ckpt_dir)
+                        save_path = os.path.join(ckpt_dir, model_name + ".pth.tar")
+                        torch.save({'state_dict': model.state_dict()}, save_path)
+                        best_prec = prec
                 
+        finally:
+            if prefetch:
+                next_data.close()
         print("\n####################\n")
         print("Finish training " + model_name)
 
@@ -0,0 +1,98 @@
+'''
+Scores of the siamese networks for all the (support ins, candidate) pairs.
+
+A siamese network scores a pair of representations with a linear layer on (x - y)^2 (euclidean) or
+on x * y, and broadcasting x.unsqueeze(1) - y.unsqueeze(0) builds a (num of support ins, num of
+candidates, hidden_size) tensor first: gigabytes with BERT, a grown support set and thousands of
+candidates. As the layer is linear,
+
+    w . (x - y)^2 = w . x^2 - 2 (w * x) . y + w . y^2
+    w . (x * y) = (w * x) . y
+
+so the scores of all the pairs are a matrix product, and the candidates are scored a tile at a time
+to bound the memory by (num of support ins, tile size).
+'''
+
+import torch
+
+def logits(x, y, fc, euc=True):
+    '''
+    x: representations of the support ins (num of support ins, hidden_size)
+    y: representations of the candidates (num of candidates, hidden_size)
+    fc: linear layer of the siamese network (hidden_size -> 1)
+    euc: fc((x - y)^2) if True, else fc(x * y)
+    return: logits of all the pairs (num of support ins, num of candidates)
+    '''
+    if euc:
+        # (x - y)^2 doesn't change when both are shifted, and the norms are the smallest (so is the
+        # rounding error of the expansion) around the support ins
+        center = x.mean(0)
+        y = y - center
+        return _centered_logits(x - center, y, (y * y).matmul(fc.weight.view(-1)), fc)
+    return (x * fc.weight.view(-1)).matmul(y.t()) + fc.bias
+
+def _centered_logits(x, y, y_norm, fc):
+    '''
+    fc((x - y)^2), x and y shifted by the same vector
+    y_norm: (y * y) . w
+    '''
+    xw = x * fc.weight.view(-1)
+    return (xw * x).sum(1, keepdim=True) - 2 * xw.matmul(y.t()) + y_norm.unsqueeze(0) + fc.bias
+
+def tiles(num, tile_size=0):
+    '''
+    num: num of candidates
+    tile_size: num of candidates of a tile (0: all of them)
+    return: slices of [0, num)
+    '''
+    if tile_size <= 0:
+        tile_size = max(num, 1)
+    return [slice(start, min(start + tile_size, num)) for start in range(0, max(num, 1), tile_size)]
+
+class MeanScore:
+    '''
+    mean scores of the candidates against the support ins, fed a chunk of support ins at a time, so a
+    large support set is scored in the memory of a chunk
+    y: representations of the candidates (num of candidates, hidden_size)
+    fc, euc: see logits
+    tile_size: num of candidates scored at a time (0: all of them)
+    '''
+    def __init__(self, y, fc, euc=True, tile_size=0):
+        self.fc = fc
+        self.euc = euc
+        self.tiles = tiles(y.size(0), tile_size)
+        if euc:
+            # the candidates are shifted (and their norms computed) once for all the chunks
+            self.center = y.mean(0)
+            y = y - self.center
+            self.y_norm = (y * y).matmul(fc.weight.view(-1))
+        self.y = y
+        self.total = y.new_zeros(y.size(0)) # sum of the scores over the support ins fed so far
+        self.count = 0
+
+    def logits(self, x):
+        '''
+        x: representations of a chunk of support ins (chunk size, hidden_size)
+        return: (tile, logits of the pairs of the chunk and the candidates of the tile) for each tile
+        '''
+        if self.euc:
+            x = x - self.center
+        for tile in self.tiles:
+            if self.euc:
+                yield tile, _centered_logits(x, self.y[tile], self.y_norm[tile], self.fc)
+            else:
+                yield tile, logits(x, self.y[tile], self.fc, euc=False)
+
+    def update(self, x):
+        '''
+        x: representations of a chunk of support ins (chunk size, hidden_size)
+        '''
+        for tile, z in self.logits(x):
+            self.total[tile] += torch.sigmoid(z).sum(0)
+        self.count += x.size(0)
+
+    def mean(self):
+        '''
+        return: mean scores (num of candidates)
+        '''
+        return self.total / max(self.count, 1)
@@ -0,0 +1,101 @@
+'''
+Background preparation of batches.
+
+A Prefetcher calls a batch function (e.g. lambda: loader.next_batch(batch_size)) in a worker
+thread and keeps up to `depth` results ready. With cuda, the worker runs on its own CUDA stream
+and the loaders' to_tensor pins the host arrays and copies them without blocking, so gathering,
+widening and host-to-device copies overlap with the training step on the default stream.
+The results come out in the same order as sequential calls of the function would return them.
+'''
+
+import threading
+import queue
+import torch
+
+_local = threading.local()
+
+def pinned():
+    '''
+    return: whether the current thread prepares batches for a Prefetcher with cuda, in which case
+            to_tensor should pin host memory before copying it to the device
+    '''
+    return getattr(_local, 'pinned', False)
+
+def _tensors(data):
+    if torch.is_tensor(data):
+        yield data
+    elif isinstance(data, dict):
+        for value in data.values():
+            for tensor in _tensors(value):
+                yield tensor
+    elif isinstance(data, (list, tuple)):
+        for value in data:
+            for tensor in _tensors(value):
+                yield tensor
+
+class Prefetcher:
+    def __init__(self, fn, depth=2, cuda=True):
+        '''
+        fn: function returning the next batch, called in the worker thread only.
+            The loaders it uses must not be used by the caller at the same time.
+        depth: number of batches prepared ahead
+        cuda: the batches are moved to the device (as the loaders' cuda flag); ignored without a GPU
+        '''
+        self.fn = fn
+        self.cuda = cuda and torch.cuda.is_available()
+        self.stream = torch.cuda.Stream() if self.cuda else None
+        self.queue = queue.Queue(maxsize=depth)
+        self.stopped = False
+        self.thread = threading.Thread(target=self._work)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _work(self):
+        _local.pinned = self.cuda
+        while not self.stopped:
+            try:
+                if self.cuda:
+                    with torch.cuda.stream(self.stream):
+                        data = self.fn()
+                        event = torch.cuda.Event()
+                        event.record(self.stream)
+                else:
+                    data = self.fn()
+                    event = None
+                item = (data, event, None)
+            except Exception as e:
+                item = (None, None, e)
+            # wake up every now and then to notice close()
+            while not self.stopped:
+                try:
+                    self.queue.put(item, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if item[2] is not None:
+                return
+
+    def __call__(self):
+        '''
+        return: the next result of fn, ready to be used on the current stream
+        '''
+        data, event, error = self.queue.get()
+        if error is not None:
+            raise error
+        if event is not None:
+            stream = torch.cuda.current_stream()
+            stream.wait_event(event)
+            # the memory was allocated on the worker stream, keep it until the current stream is done with it
+            for tensor in _tensors(data):
+                if tensor.is_cuda:
+                    tensor.record_stream(stream)
+        return data
+
+    def close(self):
+        '''
+        stop the worker thread, dropping the batches prepared ahead
+        '''
+        self.stopped = True
+        self.thread.join()
+        while not self.queue.empty():
+            self.queue.get()
@@ -0,0 +1,739 @@
+import io
+import os
+import re
+import glob
+import json
+import hashlib
+import itertools
+import multiprocessing
+import numpy as np
+
+class JSONStream:
+    '''
+    incremental reader of a json file, decoding one element at a time
+    so that the whole document never needs to be in memory
+    '''
+    _whitespace = re.compile(r'[ \t\n\r]*')
+
+    def __init__(self, f, buffer_size=1 << 22):
+        self.file = f
+        self.buffer_size = buffer_size
+        self.buffer = ''
+        self.pos = 0
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.file.read(self.buffer_size)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        '''
+        return: the next non-whitespace character ('' at the end of file)
+        '''
+        while True:
+            self.pos = self._whitespace.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, chars):
+        c = self.peek()
+        if c == '' or c not in chars:
+            raise Exception("[ERROR] Expect one of '{}' in json file, got '{}'".format(chars, c))
+        self.pos += 1
+        return c
+
+    def decode(self):
+        '''
+        return: the next complete json value
+        '''
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                self.pos = end
+                return value
+            except ValueError:
+                # the value may be cut by the end of the buffer
+                if not self._fill():
+                    raise
+
+    def iter_list(self):
+        '''
+        yield the elements of a json list one by one
+        '''
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.decode()
+            if self.expect(',]') == ']':
+                return
+
+    def iter_dict_of_lists(self):
+        '''
+        yield (key, generator of list elements) for a json dict whose values are lists
+        '''
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.decode()
+            self.expect(':')
+            items = self.iter_list()
+            yield key, items
+            for _ in items: # skip what the caller didn't read
+                pass
+            if self.expect(',}') == '}':
+                return
+
+def iter_json_data(file_name):
+    '''
+    stream a data file {relation: [instance, ...], ...}
+    return: generator of (relation, generator of instances)
+    '''
+    with open(file_name, 'r') as f:
+        for relation, instances in JSONStream(f).iter_dict_of_lists():
+            yield relation, instances
+
+# the bytes scan_json_data looks at
+_QUOTE, _BACKSLASH, _OPEN, _CLOSE = 1, 2, 3, 4
+_JSON_BYTES = np.zeros(256, dtype=np.uint8)
+_JSON_BYTES[[ord('"'), ord('\\'), ord('{'), ord('['), ord('}'), ord(']')]] = [_QUOTE, _BACKSLASH, _OPEN, _OPEN, _CLOSE, _CLOSE]
+
+def scan_json_data(file_name, block_size=1 << 22):
+    '''
+    locate the relations and the instances of a data file {relation: [instance, ...], ...} without
+    decoding it, from the brackets outside of strings, one block at a time
+    return: list of (relation, byte offsets of its instances, byte offset of the end of its list)
+    '''
+    opens = [] # byte offsets of the top dict and the lists of the relations
+    closes = []
+    instances = []
+    depth = 0
+    in_string = 0
+    backslashes = 0 # backslashes ending the previous block
+    offset = 0
+    with open(file_name, 'rb') as f:
+        while True:
+            block = np.frombuffer(f.read(block_size), dtype=np.uint8)
+            if block.shape[0] == 0:
+                break
+            kind = _JSON_BYTES[block]
+            index = np.flatnonzero(kind)
+            kind = kind[index]
+            is_backslash = kind == _BACKSLASH
+            quote = kind == _QUOTE
+            run = None
+            if len(index) > 0 and (backslashes > 0 or is_backslash.any()):
+                # the backslashes right before each of the bytes: those right after the last byte
+                # before it that isn't a backslash, j. A quote after an odd number of them is escaped
+                follows = np.zeros(len(index), dtype=bool)
+                follows[1:] = is_backslash[:-1] & (index[:-1] == index[1:] - 1)
+                follows[0] = backslashes > 0 and index[0] == 0
+                j = np.maximum.accumulate(np.where(follows, -backslashes, np.arange(len(index))))
+                run = np.arange(len(index)) - j
+                quote &= run % 2 == 0
+            inside = (np.cumsum(quote, dtype=np.int32) + in_string) % 2 == 1
+            is_open = (kind == _OPEN) & ~inside
+            is_close = (kind == _CLOSE) & ~inside
+            level = depth + np.cumsum(is_open.astype(np.int32) - is_close) # after each byte
+            opens.append(index[is_open & (level <= 2)] + offset)
+            closes.append(index[is_close & (level == 1)] + offset)
+            instances.append(index[is_open & (level == 3)] + offset)
+            if len(index) > 0:
+                depth = int(level[-1])
+                in_string = int(inside[-1])
+            if len(index) > 0 and is_backslash[-1] and index[-1] == block.shape[0] - 1:
+                backslashes = int(run[-1]) + 1
+            else:
+                backslashes = 0
+            offset += block.shape[0]
+
+        opens = np.concatenate([[]] + opens).astype(np.int64)
+        closes = np.concatenate([[]] + closes).astype(np.int64)
+        instances = np.concatenate([[]] + instances).astype(np.int64)
+        if depth != 0 or in_string or len(opens) != len(closes) + 1:
+            raise Exception("[ERROR] Data file '%s' isn't a valid json dict of lists" % file_name)
+        relations = []
+        for i in range(len(closes)):
+            # the key before the list, between the previous list (or the top dict) and the list
+            f.seek(opens[i] + 1 if i == 0 else closes[i - 1] + 1)
+            key = f.read(opens[i + 1] - f.tell()).decode('utf-8').strip().lstrip(',').rstrip(':')
+            begin, end = np.searchsorted(instances, [opens[i + 1], closes[i]])
+            relations.append((json.loads(key), instances[begin:end], int(closes[i])))
+    return relations
+
+def iter_json_list(file_name):
+    '''
+    stream a json file holding a list, e.g. the word vector file
+    '''
+    with open(file_name, 'r') as f:
+        for item in JSONStream(f).iter_list():
+            yield item
+
+def _reserve(array, size):
+    '''
+    grow array in place (doubling) so that it holds at least size rows
+    '''
+    if size > array.shape[0]:
+        array.resize((max(size, 2 * array.shape[0]),) + array.shape[1:], refcheck=False)
+
+def parse_instance(ins, distant=False):
+    '''
+    ins: one instance of the json data file
+    distant: whether the instance is in the distant data format
+    return: head, tail, pos1, pos2 (start positions of the entities)
+    '''
+    if distant:
+        return ins['h']['name'], ins['t']['name'], ins['h']['pos'][0][0], ins['t']['pos'][0][0]
+    else:
+        return ins['h'][0], ins['t'][0], ins['h'][2][0][0], ins['t'][2][0][0]
+
+def parse_entity_end(ins, distant=False):
+    '''
+    return: end positions (inclusive) of head / tail entities
+    '''
+    if distant:
+        return ins['h']['pos'][0][-1], ins['t']['pos'][0][-1]
+    else:
+        return ins['h'][2][0][-1], ins['t'][2][0][-1]
+
+def build_word_vec(ori_word_vec, case_sensitive=False):
+    '''
+    ori_word_vec: list (or a stream such as iter_json_list) of {'word': word, 'vec': vector}
+    case_sensitive: whether the words are case-sensitive
+    return: word2id (with UNK and BLANK appended), normalized word vector matrix
+    '''
+    word2id = {}
+    word_vec_mat = None
+    word_vec_tot = 0
+    for cur_id, word in enumerate(ori_word_vec):
+        w = word['word']
+        if not case_sensitive:
+            w = w.lower()
+        word2id[w] = cur_id
+        if word_vec_mat is None:
+            word_vec_mat = np.zeros((1024, len(word['vec'])), dtype=np.float32)
+        _reserve(word_vec_mat, cur_id + 1)
+        word_vec_mat[cur_id] = word['vec']
+        word_vec_tot = cur_id + 1
+    if word_vec_mat is None:
+        raise ValueError('[ERROR] The word vector file holds no word')
+    word_vec_mat.resize((word_vec_tot, word_vec_mat.shape[1]), refcheck=False)
+    word_vec_mat /= np.sqrt(np.sum(word_vec_mat ** 2, 1, keepdims=True))
+    word2id['UNK'] = word_vec_tot
+    word2id['BLANK'] = word_vec_tot + 1
+    return word2id, word_vec_mat
+
+class _WordIdCache(dict):
+    '''
+    word -> id cache, so that each distinct token is lower-cased and looked up only once
+    '''
+    def __init__(self, word2id, case_sensitive):
+        dict.__init__(self)
+        self.word2id = word2id
+        self.case_sensitive = case_sensitive
+        self.unk = word2id['UNK']
+
+    def __missing__(self, word):
+        key = word if self.case_sensitive else word.lower()
+        self[word] = self.word2id.get(key, self.unk)
+        return self[word]
+
+def encode_words(tokens, word2id, max_length, case_sensitive=False):
+    '''
+    map sentences to word ids in bulk
+    tokens: list of token lists
+    word2id: word -> id, containing 'UNK' and 'BLANK'
+    return: data_word (instance_tot, max_length), data_length (instance_tot)
+    '''
+    BLANK = word2id['BLANK']
+    length = np.fromiter(map(len, tokens), dtype=np.int32, count=len(tokens))
+    length = np.minimum(length, max_length)
+    flat = itertools.chain.from_iterable(words[:max_length] for words in tokens)
+    ids = np.fromiter(map(_WordIdCache(word2id, case_sensitive).__getitem__, flat), dtype=np.int32, count=int(length.sum()))
+
+    data_word = np.full((len(tokens), max_length), BLANK, dtype=np.int32)
+    # boolean indexing walks rows in order, the same order as flat
+    data_word[np.arange(max_length)[None, :] < length[:, None]] = ids
+    # the per-token loop padded from the j left by the position loop of the previous instance
+    # (max_length - 1), so empty sentences stayed all zeros (an empty first instance crashed it)
+    data_word[length == 0] = 0
+    return data_word, length
+
+def encode_position(pos, max_length):
+    '''
+    pos: start positions of an entity, already cut to max_length - 1, (instance_tot)
+    return: position features relative to the entity, (instance_tot, max_length)
+    '''
+    j = np.arange(max_length, dtype=np.int32)[None, :]
+    return j - np.asarray(pos, dtype=np.int32)[:, None] + max_length
+
+def encode_mask(pos1, pos2, length, max_length):
+    '''
+    pos1, pos2: start positions of head / tail entities, already cut to max_length - 1, (instance_tot)
+    return: PCNN masks, (instance_tot, max_length)
+    '''
+    pos1 = np.asarray(pos1, dtype=np.int32)[:, None]
+    pos2 = np.asarray(pos2, dtype=np.int32)[:, None]
+    j = np.arange(max_length, dtype=np.int32)[None, :]
+    data_mask = np.full((pos1.shape[0], max_length), 3, dtype=np.int32)
+    data_mask[j <= np.maximum(pos1, pos2)] = 2
+    data_mask[j <= np.minimum(pos1, pos2)] = 1
+    data_mask[j >= np.asarray(length, dtype=np.int32)[:, None]] = 0
+    return data_mask
+
+def encode_positions(pos1, pos2, length, max_length):
+    '''
+    compute position features and PCNN masks with broadcast operations
+    pos1, pos2: start positions of head / tail entities, (instance_tot)
+    length: sentence lengths (already cut to max_length), (instance_tot)
+    return: data_pos1, data_pos2, data_mask, all (instance_tot, max_length)
+    '''
+    pos1 = np.minimum(np.asarray(pos1, dtype=np.int32), max_length - 1)
+    pos2 = np.minimum(np.asarray(pos2, dtype=np.int32), max_length - 1)
+    return encode_position(pos1, max_length), encode_position(pos2, max_length), encode_mask(pos1, pos2, length, max_length)
+
+class PositionFeature:
+    '''
+    read-only stand-in for data_pos1 / data_pos2 / data_mask, computing the rows when they are
+    gathered from the head / tail offsets and lengths, so that only those are kept in memory
+    kind: 'pos1', 'pos2' or 'mask'
+    head, tail: start positions of the entities, already cut to max_length - 1, (instance_tot)
+    length: sentence lengths, (instance_tot)
+    '''
+    def __init__(self, kind, head, tail, length, max_length, dtype=np.int32):
+        self.kind = kind
+        self.head = head
+        self.tail = tail
+        self.length = length
+        self.max_length = max_length
+        self.dtype = np.dtype(dtype)
+        self.shape = (head.shape[0], max_length)
+        self.ndim = 2
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __getitem__(self, index):
+        # gather the scalars first, so that only the requested rows are expanded
+        head = np.atleast_1d(self.head[index])
+        if self.kind == 'pos1':
+            rows = encode_position(head, self.max_length)
+        elif self.kind == 'pos2':
+            rows = encode_position(np.atleast_1d(self.tail[index]), self.max_length)
+        else:
+            rows = encode_mask(head, np.atleast_1d(self.tail[index]), np.atleast_1d(self.length[index]), self.max_length)
+        rows = rows.astype(self.dtype, copy=False)
+        if np.ndim(self.head[index]) == 0:
+            return rows[0]
+        return rows
+
+def entpair_key(entpair):
+    '''
+    return: 64-bit key of an entity pair name, the same in every process (unlike hash())
+    '''
+    return int.from_bytes(hashlib.blake2b(entpair.encode('utf-8'), digest_size=8).digest(), 'little')
+
+class EntpairIndex:
+    '''
+    read-only stand-in for data_entpair, and the index of the instances by entity pair that
+    entpair2scope used to be. Everything is kept in flat arrays (CSR layout), so that the index is
+    stored as container columns and memory-mapped instead of being decoded from json.
+    id: pair of each instance, (instance_tot)
+    key: entpair_key of each pair, sorted, (pair_tot)
+    offset: the instances of pair i are member[offset[i]:offset[i + 1]], (pair_tot + 1)
+    member: instance indices grouped by pair, increasing within a pair, (instance_tot)
+    name, name_offset: the utf-8 name of pair i is name[name_offset[i]:name_offset[i + 1]]
+    '''
+    def __init__(self, id, key, offset, member, name, name_offset):
+        self.id = id
+        self.key = key
+        self.offset = offset
+        self.member = member
+        self.name = name
+        self.name_offset = name_offset
+        self.shape = id.shape
+        self.ndim = 1
+
+    @classmethod
+    def build(cls, data_entpair):
+        '''
+        data_entpair: list of the pair names of the instances
+        '''
+        pair2id = {}
+        first_id = np.fromiter((pair2id.setdefault(entpair, len(pair2id)) for entpair in data_entpair), dtype=np.int64, count=len(data_entpair))
+        return cls.build_from_ids(first_id, list(pair2id))
+
+    @classmethod
+    def build_from_ids(cls, first_id, names):
+        '''
+        first_id: index in names of the pair of each instance
+        names: the distinct pair names, in the order they first appear
+        '''
+        key = np.fromiter((entpair_key(entpair) for entpair in names), dtype=np.uint64, count=len(names))
+        order = np.argsort(key, kind='stable')
+        rank = np.empty(len(names), dtype=np.int64)
+        rank[order] = np.arange(len(names))
+        id = rank[first_id].astype(np.int32)
+        encoded = [names[i].encode('utf-8') for i in order]
+        return cls(id, key[order],
+                np.concatenate([[0], np.cumsum(np.bincount(id, minlength=len(names)))]).astype(np.int64),
+                np.argsort(id, kind='stable').astype(np.int32),
+                np.frombuffer(b''.join(encoded), dtype=np.uint8),
+                np.concatenate([[0], np.cumsum([len(name) for name in encoded], dtype=np.int64)]).astype(np.int64))
+
+    @classmethod
+    def from_columns(cls, columns):
+        return cls(*[columns['entpair_' + key] for key in ['id', 'key', 'offset', 'member', 'name', 'name_offset']])
+
+    def columns(self):
+        '''
+        return: {name: array} to be stored in a container
+        '''
+        return {'entpair_id': self.id, 'entpair_key': self.key, 'entpair_offset': self.offset, 'entpair_member': self.member,
+                'entpair_name': self.name, 'entpair_name_offset': self.name_offset}
+
+    def __len__(self):
+        return self.shape[0]
+
+    def pair_name(self, pair):
+        return self.name[self.name_offset[pair]:self.name_offset[pair + 1]].tobytes().decode('utf-8')
+
+    def __getitem__(self, index):
+        pair = self.id[index]
+        if np.ndim(pair) == 0:
+            return self.pair_name(pair)
+        return np.array([self.pair_name(p) for p in pair.tolist()], dtype=str)
+
+    def lookup(self, entpair):
+        '''
+        return: the pair id of the name, or -1 if no instance has it
+        '''
+        key = entpair_key(entpair)
+        i = int(np.searchsorted(self.key, np.uint64(key)))
+        # keys may collide, the names tell them apart
+        while i < len(self.key) and int(self.key[i]) == key:
+            if self.pair_name(i) == entpair:
+                return i
+            i += 1
+        return -1
+
+    def __contains__(self, entpair):
+        return self.lookup(entpair) >= 0
+
+    def scope(self, entpair):
+        '''
+        return: indices of the instances with the entity pair, as a slice of member, or None
+        '''
+        pair = self.lookup(entpair)
+        if pair < 0:
+            return None
+        return self.member[self.offset[pair]:self.offset[pair + 1]]
+
+    def positions(self, entpairs):
+        '''
+        the scopes of several entity pairs at once, one after another, as positions in member
+        return: positions, and offsets (len(entpairs) + 1) such that those of entpairs[i]
+                are [offset[i], offset[i + 1]), empty for a pair no instance has
+        '''
+        pair = np.array([self.lookup(entpair) for entpair in entpairs], dtype=np.int64)
+        begin = np.where(pair >= 0, self.offset[pair], 0)
+        size = np.where(pair >= 0, self.offset[pair + 1] - begin, 0)
+        offset = np.concatenate([[0], np.cumsum(size)]).astype(np.int64)
+        # position in member of each instance: the begin of its pair plus its rank within the pair
+        return np.arange(offset[-1]) + np.repeat(begin - offset[:-1], size), offset
+
+    def scopes(self, entpairs):
+        '''
+        the scopes of several entity pairs at once, one after another
+        return: indices of the instances, and offsets (len(entpairs) + 1) such that those of entpairs[i]
+                are [offset[i], offset[i + 1]), empty for a pair no instance has
+        '''
+        position, offset = self.positions(entpairs)
+        return self.member[position].astype(np.int64), offset
+
+def compact_dtype(max_value):
+    '''
+    return: the smallest of uint8, int16 and int32 holding the values in [0, max_value]
+    '''
+    for dtype in [np.uint8, np.int16]:
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.int32
+
+def encode_instances(instances, word2id, max_length, case_sensitive=False, distant=False, compact=False, expand_positions=True):
+    '''
+    encode a list of instances for CNN / PCNN encoders
+    compact: use the smallest dtypes holding the values instead of int32
+    expand_positions: return the pos1, pos2, mask matrices. Otherwise return head and tail,
+                      the entity positions they are computed from (see PositionFeature)
+    return: dict of word, pos1, pos2, mask (or head, tail), length arrays
+    '''
+    tokens = []
+    pos1 = []
+    pos2 = []
+    for ins in instances:
+        _, _, p1, p2 = parse_instance(ins, distant)
+        tokens.append(ins['tokens'])
+        pos1.append(p1)
+        pos2.append(p2)
+    word, length = encode_words(tokens, word2id, max_length, case_sensitive)
+    pos_dtype = compact_dtype(2 * max_length) if compact else np.int32
+    if compact:
+        word = word.astype(compact_dtype(len(word2id) - 1))
+        length = length.astype(compact_dtype(max_length))
+    if not expand_positions:
+        head = np.minimum(np.array(pos1, dtype=np.int32), max_length - 1).astype(pos_dtype)
+        tail = np.minimum(np.array(pos2, dtype=np.int32), max_length - 1).astype(pos_dtype)
+        return {'word': word, 'head': head, 'tail': tail, 'length': length}
+    pos1, pos2, mask = encode_positions(pos1, pos2, length, max_length)
+    if compact:
+        # positions are in [1, 2 * max_length), mask in [0, 3]
+        pos1 = pos1.astype(pos_dtype)
+        pos2 = pos2.astype(pos_dtype)
+        mask = mask.astype(np.uint8)
+    return {'word': word, 'pos1': pos1, 'pos2': pos2, 'mask': mask, 'length': length}
+
+def encode_instances_bert(instances, tokenizer, max_length, case_sensitive=False, distant=False, compact=False):
+    '''
+    tokenize a list of instances for the BERT encoder
+    tokenizer: BertTokenizer
+    compact: use the smallest dtypes holding the values instead of int32
+    return: dict of word, mask, length arrays
+    '''
+    ids = []
+    word_length = []
+    for ins in instances:
+        _, _, pos1, pos2 = parse_instance(ins, distant)
+        pos1_end, pos2_end = parse_entity_end(ins, distant)
+        words = ins['tokens']
+        if not case_sensitive:
+            words = [word.lower() for word in words]
+
+        # tokenize
+        # # head entity # @ tail entity @
+        if pos1 < pos2:
+            new_words = ['[CLS]'] + words[:pos1] + ['#'] + words[pos1:pos1_end+1] + ['#'] + words[pos1_end+1:pos2] \
+                    + ['@'] + words[pos2:pos2_end+1] + ['@'] + words[pos2_end+1:]
+        else:
+            new_words = ['[CLS]'] + words[:pos2] + ['@'] + words[pos2:pos2_end+1] + ['@'] + words[pos2_end+1:pos1] \
+                    + ['#'] + words[pos1:pos1_end+1] + ['#'] + words[pos1_end+1:]
+        sentence = ' '.join(new_words)
+        ids.append(tokenizer.convert_tokens_to_ids(tokenizer.tokenize(sentence)))
+        word_length.append(len(words))
+
+    length = np.minimum(np.fromiter(map(len, ids), dtype=np.int32, count=len(ids)), max_length)
+    in_sentence = np.arange(max_length)[None, :] < length[:, None]
+    word = np.zeros((len(ids), max_length), dtype=np.int32)
+    word[in_sentence] = np.fromiter(itertools.chain.from_iterable(tmp[:max_length] for tmp in ids), dtype=np.int32, count=int(length.sum()))
+    mask = in_sentence.astype(np.int32)
+    length[np.array(word_length, dtype=np.int32) > max_length] = max_length
+    if compact:
+        word = word.astype(compact_dtype(len(tokenizer.vocab) - 1))
+        mask = mask.astype(np.uint8)
+        length = length.astype(compact_dtype(max_length))
+    return {'word': word, 'mask': mask, 'length': length}
+
+_worker = None
+
+def _init_worker(encode, kwargs):
+    global _worker
+    _worker = (encode, kwargs)
+
+def _encode_part(part):
+    '''
+    part: (file_name, begin, end, instance_num, shard_prefix)
+    parse the instance_num instances in bytes [begin, end) of the data file and encode them as a shard
+    return: the keys of the shard, the distinct pair names of the instances and the index in them
+            of the pair of each instance
+    '''
+    file_name, begin, end, instance_num, shard_prefix = part
+    encode, kwargs = _worker
+    with open(file_name, 'rb') as f:
+        f.seek(begin)
+        stream = JSONStream(io.StringIO(f.read(end - begin).decode('utf-8')))
+    instances = []
+    for _ in range(instance_num):
+        if len(instances) > 0:
+            stream.expect(',')
+        instances.append(stream.decode())
+    pair2id = {}
+    entpair = np.zeros(instance_num, dtype=np.int64)
+    for i, ins in enumerate(instances):
+        head, tail, _, _ = parse_instance(ins, kwargs['distant'])
+        entpair[i] = pair2id.setdefault(head + '#' + tail, len(pair2id))
+    encoded = encode(instances, **kwargs)
+    for key in encoded:
+        np.save(shard_prefix + key + '.npy', encoded[key])
+    return list(encoded.keys()), list(pair2id), entpair
+
+def _merge_shards(shard_prefixes, keys, instance_tot):
+    '''
+    load the shard files written by the workers into the final arrays, deleting them
+    '''
+    merged = {}
+    for key in keys:
+        i = 0
+        for shard_prefix in shard_prefixes:
+            shard = np.load(shard_prefix + key + '.npy')
+            if key not in merged:
+                merged[key] = np.zeros((instance_tot,) + shard.shape[1:], dtype=shard.dtype)
+            merged[key][i:i + shard.shape[0]] = shard
+            i += shard.shape[0]
+            os.remove(shard_prefix + key + '.npy')
+    return merged
+
+def _remove_shards(shard_prefixes):
+    for shard_prefix in shard_prefixes:
+        for shard_file in glob.glob(glob.escape(shard_prefix) + '*.npy'):
+            os.remove(shard_file)
+
+def _preprocess_parts(file_name, encode, kwargs, rel2id, num_workers, shard_prefix, chunk_size):
+    '''
+    split the data file into parts of at most chunk_size instances of a relation, which the workers
+    parse and encode into shards; this process only locates the parts (see scan_json_data) and
+    merges the shards and the pair names
+    '''
+    rel2scope = {} # left close right open
+    parts = []
+    data_label = []
+    i = 0
+    for relation, starts, end in scan_json_data(file_name):
+        rel2scope[relation] = [i, i + len(starts)]
+        if relation not in rel2id:
+            rel2id[relation] = len(rel2id)
+        bounds = np.append(starts, end)
+        for begin in range(0, len(starts), chunk_size):
+            instance_num = min(chunk_size, len(starts) - begin)
+            parts.append((file_name, int(bounds[begin]), int(bounds[begin + instance_num]), instance_num,
+                    shard_prefix + '.shard{}_'.format(len(parts))))
+            data_label.append(np.full(instance_num, rel2id[relation], dtype=np.int32))
+        i += len(starts)
+
+    shard_prefixes = [part[-1] for part in parts]
+    pair2id = {}
+    first_id = np.zeros(i, dtype=np.int64)
+    keys = []
+    pool = multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=(encode, kwargs))
+    try:
+        offset = 0
+        for keys, names, entpair in pool.imap(_encode_part, parts):
+            # the pairs are numbered in the order they first appear, as by EntpairIndex.build
+            ids = np.fromiter((pair2id.setdefault(name, len(pair2id)) for name in names), dtype=np.int64, count=len(names))
+            first_id[offset:offset + len(entpair)] = ids[entpair]
+            offset += len(entpair)
+        pool.close()
+        pool.join()
+        arrays = _merge_shards(shard_prefixes, keys, i) if i > 0 else encode([], **kwargs)
+    except BaseException:
+        pool.terminate()
+        pool.join()
+        _remove_shards(shard_prefixes)
+        raise
+
+    processed = {'data_label': np.concatenate([np.zeros(0, dtype=np.int32)] + data_label),
+            'data_entpair': EntpairIndex.build_from_ids(first_id, list(pair2id)), 'rel2scope': rel2scope, 'rel2id': rel2id}
+    for key in arrays:
+        processed['data_' + key] = arrays[key]
+    return processed
+
+def _preprocess(ori_data, encode, kwargs, distant, rel2id, num_workers, shard_prefix, chunk_size):
+    '''
+    walk the instances one at a time and encode them chunk by chunk in this process or, for a data
+    file and num_workers > 1, have a process pool parse and encode parts of the file
+    '''
+    if rel2id is None:
+        rel2id = {}
+    if isinstance(ori_data, str):
+        if num_workers > 1:
+            return _preprocess_parts(ori_data, encode, kwargs, rel2id, num_workers, shard_prefix, chunk_size)
+        ori_data = iter_json_data(ori_data)
+    if isinstance(ori_data, dict):
+        ori_data = ori_data.items()
+    data_label = []
+    data_entpair = []
+    rel2scope = {} # left close right open
+
+    arrays = {}
+    def flush(chunk, offset):
+        encoded = encode(chunk, **kwargs)
+        for key in encoded:
+            if key not in arrays:
+                arrays[key] = np.zeros((0,) + encoded[key].shape[1:], dtype=encoded[key].dtype)
+            _reserve(arrays[key], offset + len(chunk))
+            arrays[key][offset:offset + len(chunk)] = encoded[key]
+
+    i = 0
+    chunk = []
+    for relation, instances in ori_data:
+        rel2scope[relation] = [i, i]
+        if relation not in rel2id:
+            rel2id[relation] = len(rel2id)
+        for ins in instances:
+            head, tail, _, _ = parse_instance(ins, distant)
+            entpair = head + '#' + tail
+            data_entpair.append(entpair)
+            data_label.append(rel2id[relation])
+            chunk.append(ins)
+            i += 1
+            if len(chunk) == chunk_size:
+                flush(chunk, i - len(chunk))
+                chunk = []
+        rel2scope[relation][1] = i
+    if len(chunk) > 0 or i == 0:
+        flush(chunk, i - len(chunk))
+
+    for key in arrays:
+        arrays[key].resize((i,) + arrays[key].shape[1:], refcheck=False)
+    processed = {'data_label': np.array(data_label, dtype=np.int32), 'data_entpair': EntpairIndex.build(data_entpair),
+            'rel2scope': rel2scope, 'rel2id': rel2id}
+    for key in arrays:
+        processed['data_' + key] = arrays[key]
+    return processed
+
+def preprocess(ori_data, word2id, max_length, case_sensitive=False, distant=False, rel2id=None, num_workers=1, shard_prefix=None, chunk_size=10000, compact=False, expand_positions=True):
+    '''
+    pre-processing of a json data file for CNN / PCNN encoders (see JSONFileDataLoader)
+    ori_data: {relation: [instance, ...]}, a stream of (relation, instances) such as iter_json_data, or
+              the name of the json data file
+    word2id: word -> id, containing 'UNK' and 'BLANK'
+    rel2id: existing relation mapping, new relations are appended to it
+    num_workers: num of processes parsing and encoding parts of the data file (ori_data being its name),
+                 each part written as a shard
+    shard_prefix: path prefix of the shard files (needed when num_workers > 1)
+    chunk_size: num of instances encoded at a time (at most, in a part)
+    compact: store word ids, positions, masks and lengths with the smallest dtypes holding them
+    expand_positions: store the pos1, pos2, mask matrices, otherwise only data_head and data_tail
+    return: dict of data_word, data_pos1, data_pos2, data_mask, data_length, data_label,
+            data_entpair (EntpairIndex), rel2scope, rel2id
+    '''
+    kwargs = {'word2id': word2id, 'max_length': max_length, 'case_sensitive': case_sensitive, 'distant': distant, 'compact': compact,
+            'expand_positions': expand_positions}
+    return _preprocess(ori_data, encode_instances, kwargs, distant, rel2id, num_workers, shard_prefix, chunk_size)
+
+def preprocess_bert(ori_data, tokenizer, max_length, case_sensitive=False, distant=False, rel2id=None, num_workers=1, shard_prefix=None, chunk_size=10000, compact=False):
+    '''
+    pre-processing of a json data file for BERT (see JSONFileDataLoaderBERT)
+    ori_data: {relation: [instance, ...]}, a stream of (relation, instances) such as iter_json_data, or
+              the name of the json data file
+    tokenizer: BertTokenizer
+    rel2id: existing relation mapping, new relations are appended to it
+    num_workers: num of processes parsing and tokenizing parts of the data file (ori_data being its name),
+                 each part written as a shard
+    shard_prefix: path prefix of the shard files (needed when num_workers > 1)
+    chunk_size: num of instances tokenized at a time (at most, in a part)
+    compact: store word ids, masks and lengths with the smallest dtypes holding them
+    return: dict of data_word, data_mask, data_length, data_label, data_entpair (EntpairIndex),
+            rel2scope, rel2id
+    '''
+    kwargs = {'tokenizer': tokenizer, 'max_length': max_length, 'case_sensitive': case_sensitive, 'distant': distant, 'compact': compact}
+    return _preprocess(ori_data, encode_instances_bert, kwargs, distant, rel2id, num_workers, shard_prefix, chunk_size)
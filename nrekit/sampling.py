@@ -0,0 +1,75 @@
+'''
+Sampling of instance indices for episodes.
+
+The instances of a relation form a contiguous scope [start, end) of the pre-processed arrays,
+so sampling only has to draw offsets within scopes, without materializing them.
+'''
+
+import numpy as np
+
+def sample_scopes(start, size, k):
+    '''
+    draw k distinct indices from each of the scopes [start[i], start[i] + size[i]) at once,
+    with Robert Floyd's algorithm vectorized over the scopes (O(k^2) per scope whatever its size),
+    or a permutation of the scopes that are less than 4 times larger than k
+    start, size: int arrays of the same length, with size >= k
+    return: int64 array (len(start), k), each row in random order
+    '''
+    start = np.asarray(start, dtype=np.int64)
+    size = np.asarray(size, dtype=np.int64)
+    if (size < k).any():
+        raise ValueError('Cannot take a larger sample than population when replace=False')
+    # as in sample_scope, a permutation is cheaper for the scopes a large part of which is drawn
+    permuted = k * 4 >= size
+    if permuted.all():
+        return start[:, None] + _permutations(size, k)
+    if not permuted.any():
+        return start[:, None] + _floyd(size, k)
+    offset = np.empty((len(start), k), dtype=np.int64)
+    offset[permuted] = _permutations(size[permuted], k)
+    offset[~permuted] = _floyd(size[~permuted], k)
+    return start[:, None] + offset
+
+def _permutations(size, k):
+    '''
+    size: int64 array
+    return: k distinct offsets in [0, size[i]) for each i, (len(size), k), each row in random order
+    '''
+    return np.array([np.random.permutation(n)[:k] for n in size.tolist()], dtype=np.int64).reshape(len(size), k)
+
+def _floyd(size, k):
+    '''
+    same as _permutations, in O(k^2) per scope
+    '''
+    offset = np.empty((len(size), k), dtype=np.int64)
+    for i in range(k):
+        j = size - k + i
+        t = np.random.randint(0, j + 1)
+        # t was drawn before: take j, which cannot have been
+        seen = (offset[:, :i] == t[:, None]).any(1)
+        offset[:, i] = np.where(seen, j, t)
+    # Floyd's algorithm draws a uniform set, but j tends to come last
+    order = np.argsort(np.random.random(offset.shape), 1)
+    return np.take_along_axis(offset, order, 1)
+
+def sample_scope(start, end, k):
+    '''
+    draw k distinct indices from [start, end) in O(k), where
+    np.random.choice(list(range(start, end)), k, False) builds and permutes the whole scope
+    return: int64 array of k indices in random order
+    '''
+    n = end - start
+    if k > n:
+        raise ValueError('Cannot take a larger sample than population when replace=False')
+    if k * 4 >= n:
+        # a large part of the scope is drawn anyway, a permutation is cheaper than the Python steps below
+        return start + np.random.permutation(n)[:k]
+    # Floyd's algorithm: for j in [n - k, n), draw t in [0, j] and take j instead if t was drawn before
+    j = np.arange(n - k, n)
+    t = (np.random.random(k) * (j + 1)).astype(np.int64)
+    chosen = set()
+    for j_i, t_i in zip(j.tolist(), t.tolist()):
+        chosen.add(j_i if t_i in chosen else t_i)
+    offset = np.fromiter(chosen, dtype=np.int64, count=k)
+    np.random.shuffle(offset)
+    return start + offset
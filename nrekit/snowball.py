@@ -0,0 +1,282 @@
+'''
+Pieces shared by the snowball models (models/snowball.py, snowball_euc.py, snowball_euc_exp.py and
+snowball_siamese.py).
+
+SiameseBase is the inference side of their siamese networks: the representations of the instances,
+cached by uid, and the scores of the candidates against a support set, computed a tile of candidates
+and a chunk of support ins at a time (see pairwise.py). SnowballBase holds the command line
+arguments of the caches, of the siamese scoring and of the phase 1 / phase 2 lookups, sets them up,
+and gets the candidates of both phases from the distant data.
+'''
+
+import numpy as np
+import torch
+from torch import nn
+from . import framework
+from . import pairwise
+from . import ann
+from . import entpair_table
+from .cache import EmbeddingCache, KEYS, deterministic, weights_version
+
+class CachedEncoder:
+    '''
+    encode of a model with self.sentence_encoder, self.pre_rep (representations by uid used in place of
+    the encoder, or None) and self.cache (cache.EmbeddingCache, or None)
+    '''
+    def encode(self, dataset, batch_size=0):
+        if self.pre_rep is not None:
+            return self.pre_rep[dataset['id'].view(-1)]
+
+        if self.cache is not None and deterministic(self.sentence_encoder):
+            self.cache.sync(weights_version(self.sentence_encoder))
+            return self.cache.encode(dataset, lambda dataset: self._encode(dataset, batch_size))
+        return self._encode(dataset, batch_size)
+
+    def _encode(self, dataset, batch_size=0):
+        if batch_size == 0:
+            x = self.sentence_encoder(dataset)
+        else:
+            total_length = dataset['word'].size(0)
+            max_iter = total_length // batch_size
+            if total_length % batch_size != 0:
+                max_iter += 1
+            x = []
+            for it in range(max_iter):
+                scope = list(range(batch_size * it, min(batch_size * (it + 1), total_length)))
+                with torch.no_grad():
+                    _ = {'word': dataset['word'][scope], 'mask': dataset['mask'][scope]}
+                    if 'pos1' in dataset:
+                        _['pos1'] = dataset['pos1'][scope]
+                        _['pos2'] = dataset['pos2'][scope]
+                    _x = self.sentence_encoder(_)
+                x.append(_x.detach())
+            x = torch.cat(x, 0)
+        return x
+
+class SiameseBase(CachedEncoder, nn.Module):
+    '''
+    sentence_encoder: should be different from the main sentence encoder
+    pre_rep: representations of the instances by uid, used in place of the encoder if not None
+    euc: the pairs are scored by self.fc((x - y)^2) if True, else by self.fc(x * y)
+    any_support: forward_infer picks the candidates scoring > threshold against any support ins,
+                 instead of on average
+    The subclasses set self.fc, the linear layer (hidden_size -> 1) scoring the pairs.
+    '''
+    def __init__(self, sentence_encoder, hidden_size=230, pre_rep=None, euc=True, any_support=False):
+        nn.Module.__init__(self)
+        self.sentence_encoder = sentence_encoder
+        self.hidden_size = hidden_size
+        self.pre_rep = pre_rep
+        self.euc = euc
+        self.any_support = any_support
+        self.cache = None # cache.EmbeddingCache of the encoder, set by SnowballBase
+        self.tile_size = 0 # num of candidates scored at a time (0: all at once), set by SnowballBase
+        self.support_chunk_size = 0 # num of support ins scored at a time (0: all at once), set by SnowballBase
+
+    def encode(self, dataset, batch_size=0):
+        if 'repre' in dataset:
+            return dataset['repre'] # precomputed, e.g. looked up in an entity pair table
+        return CachedEncoder.encode(self, dataset, batch_size)
+
+    def forward_infer(self, x, y, threshold=0.5, batch_size=0):
+        '''
+        return: whether each instance of y is picked (0 / 1): its mean score against the instances of x
+                is > threshold, or with self.any_support, its score against any of them
+        '''
+        if not self.any_support:
+            return (self.score(x, y, batch_size=batch_size) > threshold).long()
+        y = self.encode(y, batch_size=batch_size)
+        pred = y.new_zeros(y.size(0)).bool()
+        score = pairwise.MeanScore(y, self.fc, euc=self.euc, tile_size=self.tile_size)
+        for x_chunk in self._encode_chunks(x, batch_size=batch_size):
+            for tile, z in score.logits(x_chunk):
+                pred[tile] |= (torch.sigmoid(z) > threshold).any(0)
+        return pred.long()
+
+    def score(self, x, y, batch_size=0):
+        '''
+        mean score of each instance of y against the instances of x
+        return: scores (num of ins in y)
+        '''
+        y = self.encode(y, batch_size=batch_size)
+        score = pairwise.MeanScore(y, self.fc, euc=self.euc, tile_size=self.tile_size)
+        for x_chunk in self._encode_chunks(x, batch_size=batch_size):
+            score.update(x_chunk)
+        return score.mean()
+
+    def _encode_chunks(self, x, batch_size=0):
+        '''
+        representations of the instances of x, self.support_chunk_size of them at a time
+        '''
+        for chunk in pairwise.tiles(x['word'].size(0), self.support_chunk_size):
+            yield self.encode({key: x[key][chunk] for key in KEYS if key in x}, batch_size=batch_size)
+
+    def forward_infer_sort(self, x, y, batch_size=0):
+        score, index = self.score(x, y, batch_size=batch_size).sort(descending=True)
+        return list(zip(score.tolist(), index.tolist()))
+
+    def forward_infer_topk(self, x, y, k, threshold=None, batch_size=0):
+        '''
+        the k instances of y with the highest mean scores against x, highest first
+        threshold: only the instances with score > threshold are returned if not None
+        return: scores, indices of the instances in y
+        '''
+        score = self.score(x, y, batch_size=batch_size)
+        score, index = score.topk(min(k, score.size(0)))
+        if threshold is not None:
+            keep = score > threshold
+            score, index = score[keep], index[keep]
+        return score, index
+
+class SnowballBase(CachedEncoder, framework.Model):
+    '''
+    siamese_model: SiameseBase scoring the candidates, or None
+    The subclasses add their own arguments to self.parser, then get them all with self.parse_args().
+    '''
+    CHECK_NUM = 8 # num of looked up ins encoded again to check the entity pair table and the phase 2 index
+    def __init__(self, sentence_encoder, siamese_model=None):
+        framework.Model.__init__(self, sentence_encoder)
+        self.siamese_model = siamese_model
+        self.pre_rep = None # representations of the instances by uid, used in place of the encoder if not None
+        self.cache = None # cache.EmbeddingCache of the encoder, set by parse_args
+        self.candidate_index = None # ann.IVFIndex over the encoder representations of the distant ins (--phase2_index), random phase 2 candidates if None
+        self.entpair_table = None # entpair_table.EntpairTable of the distant data (--entpair_table), siamese representations of the phase 1 candidates
+        self._checked = {} # weights_version of the encoder each precomputed file was last checked against, see _check_precomputed
+
+    def parse_args(self):
+        '''
+        add the arguments shared by the snowball models to self.parser, parse the command line and set
+        up the caches, the siamese scoring, the entity pair table and the phase 2 index
+        return: the parsed arguments
+        '''
+        # representation cache
+        self.parser.add_argument("--embedding_cache", help="cache the representations by uid: none, per episode, or across episodes with LRU eviction (cleared whenever the weights of the encoder change)", choices=["none", "episode", "global"], default="episode")
+        self.parser.add_argument("--embedding_cache_size", help="max num of representations cached per encoder across episodes", type=int, default=100000)
+
+        # siamese scoring
+        self.parser.add_argument("--siamese_tile_size", help="num of candidates scored at a time by the siamese network (0: all at once)", type=int, default=1024)
+        self.parser.add_argument("--siamese_support_chunk_size", help="num of support ins scored at a time by the siamese network (0: all at once)", type=int, default=256)
+
+        # siamese representations of the phase 1 candidates looked up in self.entpair_table
+        self.parser.add_argument("--entpair_table", help="entpair_table.EntpairTable file of the distant ins (see build_entpair_table.py) holding the siamese representations of the phase 1 candidates, encoded if not given", default=None)
+
+        # phase 2 candidates retrieved from self.candidate_index
+        self.parser.add_argument("--phase2_index", help="ann.IVFIndex file of the distant ins (see build_ann_index.py) searched for the phase 2 candidates, random candidates if not given", default=None)
+        self.parser.add_argument("--phase2_retrieve_num", help="num of distant ins retrieved as phase 2 candidates", type=int, default=2000)
+        self.parser.add_argument("--phase2_nprobe", help="num of lists of the index scanned at phase 2", type=int, default=64)
+
+        args = self.parser.parse_args()
+        if self.siamese_model is not None:
+            self.siamese_model.tile_size = args.siamese_tile_size
+            self.siamese_model.support_chunk_size = args.siamese_support_chunk_size
+
+        # one cache per encoder
+        if args.embedding_cache != "none":
+            capacity = args.embedding_cache_size if args.embedding_cache == "global" else None
+            self.cache = EmbeddingCache(capacity)
+            if self.siamese_model is not None:
+                self.siamese_model.cache = EmbeddingCache(capacity)
+
+        if args.entpair_table is not None:
+            self.entpair_table = entpair_table.EntpairTable.load(args.entpair_table)
+            if self.entpair_table is None:
+                raise Exception("[ERROR] Entity pair table file '%s' doesn't exist or isn't valid" % args.entpair_table)
+        if args.phase2_index is not None:
+            self.candidate_index = ann.IVFIndex.load(args.phase2_index)
+            if self.candidate_index is None:
+                raise Exception("[ERROR] Phase 2 index file '%s' doesn't exist or isn't valid" % args.phase2_index)
+        return args
+
+    def start_episode(self):
+        '''
+        called before each episode: drops the representations cached for the previous one
+        '''
+        if self.args.embedding_cache == "episode":
+            self.cache.clear()
+            if self.siamese_model is not None:
+                self.siamese_model.cache.clear()
+
+    def _split_by_entpair(self, dataset):
+        '''
+        group the instances of dataset by entity pair, with one index_select per group instead of row-by-row copies
+        dataset: input dataset (variable)
+        return: {entpair: dataset of its instances}, in order of first appearance
+        '''
+        names, first, segment = np.unique(np.array(dataset['entpair']), return_index=True, return_inverse=True)
+        order = np.argsort(first) # group ids in order of first appearance
+        rank = np.empty_like(order)
+        rank[order] = np.arange(len(order))
+        segment = rank[segment.reshape(-1)]
+        offset = np.concatenate([[0], np.cumsum(np.bincount(segment, minlength=len(order)))])
+        index = torch.from_numpy(np.argsort(segment, kind='stable')).to(dataset['word'].device)
+        groups = {}
+        for k in range(len(order)):
+            scope = index[offset[k]:offset[k + 1]]
+            groups[names[order[k]]] = {key: dataset[key][scope] for key in KEYS if key in dataset}
+        return groups
+
+    def _check_precomputed(self, file_name, model, dataset, repre):
+        '''
+        encode the first self.CHECK_NUM instances of dataset again with model, once per weights of its
+        encoder, and stop if their precomputed representations differ: the file was built from another
+        encoder (or from other weights of it) than the one scoring against them
+        file_name: the entity pair table or the phase 2 index the representations come from
+        model: CachedEncoder the representations should come from
+        repre: precomputed representations of the instances of dataset
+        '''
+        version = weights_version(model.sentence_encoder)
+        if self._checked.get(file_name) == version or dataset['word'].size(0) == 0:
+            return
+        sample = {key: dataset[key][:self.CHECK_NUM] for key in KEYS if key in dataset}
+        training = model.sentence_encoder.training
+        model.sentence_encoder.eval() # without dropout
+        with torch.no_grad():
+            x = model.encode(sample).float()
+        model.sentence_encoder.train(training)
+        repre = repre[:self.CHECK_NUM].to(x.device).float()
+        if ((x - repre).norm(dim=-1) > 1e-3 * repre.norm(dim=-1) + 1e-4).any():
+            raise Exception("[ERROR] '%s' wasn't built from the representations of this encoder, rebuild it" % file_name)
+        self._checked[file_name] = version
+
+    def _same_entpair_batch(self, distant, entpairs, exclude_id):
+        '''
+        phase 1 candidates: the distant ins sharing an entity pair with the support set, looked up for all
+        the entity pairs at once (with their siamese representations if self.entpair_table is set)
+        distant: distant data loader
+        entpairs: entity pairs of the support set
+        exclude_id: uids of the ins already in the support set (uidset.UidSet)
+        return: batch of the distant ins, the ins of entpairs[k] in [batch['offset'][k], batch['offset'][k + 1])
+        '''
+        batch = distant.get_same_entpair_ins_batch(list(entpairs), exclude_id=exclude_id, table=self.entpair_table)
+        if self.entpair_table is not None and self.siamese_model is not None:
+            self._check_precomputed(self.args.entpair_table, self.siamese_model, batch, batch['repre'])
+        return batch
+
+    def _same_entpair_ins(self, distant, entpairs, exclude_id):
+        '''
+        the phase 1 candidates of _same_entpair_batch, by entity pair
+        return: generator of (entpair, dataset of its distant ins), for the entpairs with any
+        '''
+        entpairs = list(entpairs)
+        raw_all = self._same_entpair_batch(distant, entpairs, exclude_id)
+        for k, entpair in enumerate(entpairs):
+            begin, end = raw_all['offset'][k], raw_all['offset'][k + 1]
+            if begin < end:
+                yield entpair, {key: raw_all[key][begin:end] for key in raw_all if key != 'offset'}
+
+    def _phase2_candidate(self, distant, support_pos_rep, num_class, num_ins_per_class):
+        '''
+        phase 2 candidates: the distant ins nearest to the prototype of the support set if
+        self.candidate_index is set, else num_ins_per_class random ins of self.pos_class and of
+        num_class - 1 other relations
+        distant: distant data loader
+        support_pos_rep: representations of the support set
+        return: a dataset
+        '''
+        if self.candidate_index is None:
+            return distant.get_random_candidate(self.pos_class, num_class, num_ins_per_class)
+        prototype = support_pos_rep.detach().mean(0).cpu().numpy()
+        index, _ = self.candidate_index.search(prototype, self.args.phase2_retrieve_num, nprobe=self.args.phase2_nprobe)
+        candidate = distant.get_ins(index)
+        self._check_precomputed(self.args.phase2_index, self, candidate, torch.from_numpy(self.candidate_index.reconstruct(index[:self.CHECK_NUM])))
+        return candidate
@@ -0,0 +1,106 @@
+'''
+Growable support sets for the snowball.
+
+At every snowball iteration, the instances picked from the distant data are appended to the positive
+support set. Appending them one at a time with torch.cat copies the whole set for each of them, so
+the rows are kept in buffers with spare capacity instead, doubled when they are full.
+
+The encoders are frozen during the snowball, so the representations of the support set are kept
+along with it as well, and only the instances appended since they were last needed get encoded.
+'''
+
+import torch
+
+FIELDS = ['word', 'pos1', 'pos2', 'mask', 'id', 'label']
+
+class SupportSet:
+    '''
+    a dataset (word, pos1, pos2, mask, id, label tensors and the entpair list) backed by growable buffers.
+    support['word'] etc. are views of the filled rows, so the set is passed wherever a dataset is.
+    dataset: initial instances
+    capacity: num of rows first allocated
+    '''
+    def __init__(self, dataset, capacity=64):
+        self.size = len(dataset['word'])
+        self.buffers = {}
+        for key in FIELDS:
+            if key in dataset:
+                self.buffers[key] = dataset[key].new_empty((max(capacity, self.size),) + tuple(dataset[key].shape[1:]))
+                self.buffers[key][:self.size] = dataset[key]
+        self.entpair = list(dataset['entpair']) if 'entpair' in dataset else None
+        self.repre = None # representations of the first self.encoded instances
+        self.encoded = 0
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, key):
+        return key in self.buffers or (key == 'entpair' and self.entpair is not None)
+
+    def __getitem__(self, key):
+        if key == 'entpair' and self.entpair is not None:
+            return self.entpair
+        return self.buffers[key][:self.size]
+
+    def keys(self):
+        return [key for key in FIELDS + ['entpair'] if key in self]
+
+    def rows(self, start, stop):
+        '''
+        return: dataset of the instances [start, stop), as views
+        '''
+        dataset = {key: self.buffers[key][start:stop] for key in self.buffers}
+        if self.entpair is not None:
+            dataset['entpair'] = self.entpair[start:stop]
+        return dataset
+
+    def represent(self, encode):
+        '''
+        representations of the instances, encoding only those appended since the previous call
+        encode: dataset -> representations (num of instances, hidden_size), the same frozen encoder at every call
+        return: representations (len(self), hidden_size), a view
+        '''
+        if self.encoded < self.size:
+            repre = encode(self.rows(self.encoded, self.size)).detach()
+            if self.repre is None or len(self.repre) < self.size:
+                buffer = repre.new_empty((len(self.buffers['word']),) + tuple(repre.shape[1:]))
+                if self.repre is not None:
+                    buffer[:self.encoded] = self.repre[:self.encoded]
+                self.repre = buffer
+            self.repre[self.encoded:self.size] = repre
+            self.encoded = self.size
+        if self.repre is None:
+            return None
+        return self.repre[:self.size]
+
+    def _reserve(self, size):
+        capacity = len(self.buffers['word'])
+        if size <= capacity:
+            return
+        capacity = max(size, 2 * capacity)
+        for key in self.buffers:
+            buffer = self.buffers[key].new_empty((capacity,) + tuple(self.buffers[key].shape[1:]))
+            buffer[:self.size] = self.buffers[key][:self.size]
+            self.buffers[key] = buffer
+
+    def append(self, dataset, index, label=None):
+        '''
+        append instances of another dataset, all at once
+        dataset: source dataset
+        index: indices of the instances in dataset (list, numpy array or LongTensor)
+        label: label of the appended instances, their labels in dataset if None
+        '''
+        index = torch.as_tensor(index, dtype=torch.long).view(-1)
+        num = len(index)
+        if num == 0:
+            return
+        self._reserve(self.size + num)
+        for key in self.buffers:
+            rows = self.buffers[key][self.size:self.size + num]
+            if key == 'label' and label is not None:
+                rows.fill_(label)
+            else:
+                rows.copy_(dataset[key][index.to(dataset[key].device)])
+        if self.entpair is not None:
+            self.entpair += [dataset['entpair'][i] for i in index.tolist()]
+        self.size += num
@@ -0,0 +1,55 @@
+'''
+Sets of instances, keyed by their uids.
+
+data/gen_id.py numbers the instances of all the splits one after another, so a uid identifies an
+instance across the loaders and the uids of all the splits fill [0, total num of instances).
+A set is then a boolean array indexed by uid: adding and testing a whole batch of instances is a
+single scatter / gather, instead of a Python loop over the rows.
+'''
+
+import numpy as np
+import torch
+
+def _as_array(uid):
+    '''
+    uid: int, int array or LongTensor (on any device)
+    return: int64 array (1-d)
+    '''
+    if isinstance(uid, torch.Tensor):
+        uid = uid.detach().cpu().numpy()
+    return np.asarray(uid, dtype=np.int64).reshape(-1)
+
+class UidSet:
+    '''
+    size: num of uids the set is first allocated for (e.g. the total num of instances), it grows
+          when a larger uid is added
+    '''
+    def __init__(self, size=0):
+        self.bitmap = np.zeros(size, dtype=bool)
+
+    def add(self, uid):
+        uid = _as_array(uid)
+        if len(uid) == 0:
+            return
+        size = int(uid.max()) + 1
+        if size > len(self.bitmap):
+            bitmap = np.zeros(max(size, 2 * len(self.bitmap)), dtype=bool)
+            bitmap[:len(self.bitmap)] = self.bitmap
+            self.bitmap = bitmap
+        self.bitmap[uid] = True
+
+    def contains(self, uid):
+        '''
+        return: bool array, whether each of the uids is in the set
+        '''
+        uid = _as_array(uid)
+        found = np.zeros(len(uid), dtype=bool)
+        inside = uid < len(self.bitmap)
+        found[inside] = self.bitmap[uid[inside]]
+        return found
+
+    def __contains__(self, uid):
+        return bool(self.contains(uid)[0])
+
+    def __len__(self):
+        return int(np.count_nonzero(self.bitmap))
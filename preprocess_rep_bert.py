@@ -10,24 +10,28 @@ import numpy as np
 
 def get_repre(model, data_loader, save_path):
     print('repre save to ' + save_path)
-    repre = []
+    repre = None
     batch_size = 32
+    # encode the sentences sorted by length, so that each batch is cut to its longest sentence
+    # instead of max_length; the representations are put back in the original order
+    order = np.argsort(data_loader.data_length, kind='stable')
     total_step = data_loader.instance_tot // batch_size
     if data_loader.instance_tot % batch_size != 0:
         total_step += 1
     for it in range(total_step):
-        a = it * batch_size
-        b = min((it + 1) * batch_size, data_loader.instance_tot)
-        word = torch.from_numpy(data_loader.data_word[a:b]).long().cuda()
-        mask = torch.from_numpy(data_loader.data_mask[a:b]).long().cuda()
+        indices = order[it * batch_size:(it + 1) * batch_size]
+        width = int(data_loader.data_length[indices].max())
+        word = torch.from_numpy(data_loader.data_word[indices, :width]).cuda().long()
+        mask = torch.from_numpy(data_loader.data_mask[indices, :width]).cuda().long()
         batch = {'word': word, 'mask': mask}
-        batch_repre = model(batch)
-        repre.append(batch_repre.cpu().detach().numpy())
+        batch_repre = model(batch).cpu().detach().numpy()
+        if repre is None:
+            repre = np.zeros((data_loader.instance_tot, batch_repre.shape[1]), dtype=batch_repre.dtype)
+        repre[indices] = batch_repre
         sys.stdout.write('[{0:3.2f}%] {1:6} / {2:6}'.format(100 * float(it) / float(total_step), it, total_step) + '\r')
         sys.stdout.flush()
 
     print('')
-    repre = np.concatenate(repre, 0)
     np.save(save_path, repre)
     
 max_length = 90
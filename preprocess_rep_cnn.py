@@ -18,9 +18,9 @@ def get_repre(model, data_loader, save_path):
     for it in range(total_step):
         a = it * batch_size
         b = min((it + 1) * batch_size, data_loader.instance_tot)
-        word = torch.from_numpy(data_loader.data_word[a:b]).long().cuda()
-        pos1 = torch.from_numpy(data_loader.data_pos1[a:b]).long().cuda()
-        pos2 = torch.from_numpy(data_loader.data_pos2[a:b]).long().cuda()
+        word = torch.from_numpy(data_loader.data_word[a:b]).cuda().long()
+        pos1 = torch.from_numpy(data_loader.data_pos1[a:b]).cuda().long()
+        pos2 = torch.from_numpy(data_loader.data_pos2[a:b]).cuda().long()
         batch = {'word': word, 'pos1': pos1, 'pos2': pos2} 
         batch_repre = model(batch)
         repre.append(batch_repre.cpu().detach().numpy())
@@ -13,9 +13,9 @@ def get_repre(model, data_loader, save_path):
     repre = np.load('./_repre/cnn_encoder_on_fewrel.distant.npy')
     for it in range(data_loader.instance_tot):
         print(it)
-        word = torch.from_numpy(data_loader.data_word[it:it+1]).long().cuda()
-        pos1 = torch.from_numpy(data_loader.data_pos1[it:it+1]).long().cuda()
-        pos2 = torch.from_numpy(data_loader.data_pos2[it:it+1]).long().cuda()
+        word = torch.from_numpy(data_loader.data_word[it:it+1]).cuda().long()
+        pos1 = torch.from_numpy(data_loader.data_pos1[it:it+1]).cuda().long()
+        pos2 = torch.from_numpy(data_loader.data_pos2[it:it+1]).cuda().long()
         batch = {'word': word, 'pos1': pos1, 'pos2': pos2} 
         batch_repre = model(batch).squeeze()
         batch_repre=(batch_repre.cpu().detach().numpy())
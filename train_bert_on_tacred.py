@@ -9,8 +9,8 @@ from nrekit.data_loader_bert import JSONFileDataLoaderBERT as DataLoader
 from pytorch_pretrained_bert import BertAdam
 
 max_length = 300
-train_data_loader = DataLoader('./data/tacred_train.json', vocab='./data/bert_vocab.txt', max_length=max_length)
-val_data_loader = DataLoader('./data/tacred_val.json', vocab='./data/bert_vocab.txt', max_length=max_length, rel2id=train_data_loader.rel2id, shuffle=False)
+train_data_loader = DataLoader('./data/tacred_train.json', vocab='./data/bert_vocab.txt', max_length=max_length, dynamic_padding=True)
+val_data_loader = DataLoader('./data/tacred_val.json', vocab='./data/bert_vocab.txt', max_length=max_length, rel2id=train_data_loader.rel2id, shuffle=False, dynamic_padding=True)
 
 weight_table = np.zeros((train_data_loader.rel_tot), dtype=np.float32)
 for i in range(train_data_loader.rel_tot):